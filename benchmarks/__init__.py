@@ -0,0 +1,21 @@
+import os
+
+import django
+
+
+def setup():
+    """django.setup() on the migrated SQLite scratch files of benchmarks.settings.
+
+    The benchmarks seed, delete and drop indexes, so they refuse settings without
+    the BENCHMARK_DIR of benchmarks.settings, e.g. the production databases.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    from django.conf import settings
+    directory = getattr(settings, 'BENCHMARK_DIR', None)
+    if directory is None:
+        raise SystemExit('Refusing to benchmark on %s, use benchmarks.settings' % os.environ['DJANGO_SETTINGS_MODULE'])
+    os.makedirs(directory, exist_ok=True)
+    django.setup()
+    from django.core.management import call_command
+    for alias in settings.DATABASES:
+        call_command('migrate', database=alias, verbosity=0)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Load test of the async home page in one process, sequential vs concurrent requests.
+
+Seeds ``--users`` users with data_generator.generate into the SQLite scratch files of
+benchmarks.settings and renders their home page inline (BLOG_LAZY_CHARTS off, chart
+cache cleared per round). The sequential round is what one synchronous worker serves,
+the concurrent round fires every request at once through AsyncClient, i.e. one ASGI
+server process. ``--latency`` adds a sleep to every query to stand in for a database
+across the network.
+
+    python -m benchmarks.async_load --users 8 --readings 3000 --latency 5
+"""
+import argparse
+import asyncio
+import time
+from contextlib import ExitStack
+
+from benchmarks import setup
+
+setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+from django.test import AsyncClient, Client, override_settings  # noqa: E402
+
+import data_generator  # noqa: E402
+from blog import rollups  # noqa: E402
+from blog.models import Activity, Drinking  # noqa: E402
+
+DB = 'new_smartband_db'
+USERNAME = 'load-test-%d'
+
+
+def slow_queries(seconds):
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+def latency(seconds):
+    # execute wrappers are per connection, so install one in every thread that connects
+    def install(sender, connection, **kwargs):
+        if seconds:
+            connection.execute_wrappers.append(slow_queries(seconds))
+    return install
+
+
+def seed(count, readings, days):
+    users = []
+    for i in range(count):
+        user, _ = User.objects.get_or_create(username=USERNAME % i)
+        Activity.objects.using(DB).filter(user=user.id).delete()
+        Drinking.objects.using(DB).filter(user=user.id).delete()
+        data_generator.generate(user.id, days, readings)
+        rollups.rebuild(user=user.id)
+        users.append(user)
+    return users
+
+
+def sequential(users):
+    client = Client()
+    start = time.perf_counter()
+    for user in users:
+        client.force_login(user)
+        assert client.get('/').status_code == 200
+    return time.perf_counter() - start
+
+
+async def concurrent(clients):
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[client.get('/') for client in clients])
+    assert all(response.status_code == 200 for response in responses)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=8, help='users, one request each per round')
+    parser.add_argument('--readings', type=int, default=3000, help='readings per user')
+    parser.add_argument('--days', type=int, default=31)
+    parser.add_argument('--latency', type=float, default=5.0, help='milliseconds added to every query')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--keep', action='store_true', help='keep the seeded rows')
+    args = parser.parse_args()
+
+    users = seed(args.users, args.readings, args.days)
+    clients = []
+    for user in users:
+        client = AsyncClient()
+        client.force_login(user)
+        clients.append(client)
+    install = latency(args.latency / 1000)
+    with ExitStack() as stack:
+        stack.enter_context(override_settings(BLOG_LAZY_CHARTS=False, BLOG_RENDER_MODE='threads',
+                                                ALLOWED_HOSTS=['testserver']))
+        connection_created.connect(install)
+        stack.callback(connection_created.disconnect, install)
+        connections.close_all()
+        for _ in range(args.rounds):
+            caches['charts'].clear()
+            seconds = sequential(users)
+            print('sequential  %3d requests %8.1f ms  %6.1f req/s' % (len(users), seconds * 1000, len(users) / seconds))
+            caches['charts'].clear()
+            seconds = asyncio.run(concurrent(clients))
+            print('concurrent  %3d requests %8.1f ms  %6.1f req/s' % (len(users), seconds * 1000, len(users) / seconds))
+
+    if not args.keep:
+        for user in users:
+            Activity.objects.using(DB).filter(user=user.id).delete()
+            Drinking.objects.using(DB).filter(user=user.id).delete()
+            rollups.rebuild(user=user.id)
+            user.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Micro-benchmark of blog.binning against the per-bucket dict loops it replaced.
+
+    python -m benchmarks.binning [--sizes 10000 100000 1000000 10000000]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from blog import binning
+
+DAY_US = binning.DAY_US
+HOUR_US = DAY_US // 24
+
+
+def legacy_grid2d(x, y, grid_x):
+    d_lists = {}
+    for xx, yy in zip(x, y):
+        d_lists.setdefault(round(xx / grid_x), []).append(yy)
+    return [k * grid_x for k in d_lists], [float(sum(v)) / len(v) for v in d_lists.values()]
+
+
+def legacy_grid3d(x, y, z, grid_x, grid_y):
+    d_lists = {}
+    for xx, yy, zz in zip(x, y, z):
+        d_lists.setdefault((round(xx / grid_x), round(yy / grid_y)), []).append(zz)
+    return {k: float(sum(v)) / len(v) for k, v in d_lists.items()}
+
+
+def legacy_week_grid(timestamps, values, grid_us):
+    d_lists = {}
+    for t, v in zip(timestamps, values):
+        key = ((t // DAY_US + 3) % 7, max(-(-(t % DAY_US) // grid_us) - 1, 0))
+        d_lists.setdefault(key, []).append(v)
+    return {k: float(sum(v)) / len(v) for k, v in d_lists.items()}
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7])
+    parser.add_argument('--legacy-max', type=int, default=10 ** 6,
+                        help='skip the pure Python loops above this size')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    print('%-10s %-10s %12s %12s %9s' % ('size', 'function', 'numpy [s]', 'legacy [s]', 'speed-up'))
+    for size in args.sizes:
+        alcohol = rng.uniform(0, 4, size)
+        steps = rng.randint(0, 50, size)
+        pulse = rng.uniform(60, 140, size)
+        timestamps = rng.randint(0, 365 * DAY_US, size, dtype=np.int64)
+        cases = [
+            ('grid2d', binning.grid2d, legacy_grid2d, (alcohol, steps, 0.2)),
+            ('grid3d', binning.grid3d, legacy_grid3d, (alcohol, steps, pulse, 0.2, 10)),
+            ('week_grid', binning.week_grid, legacy_week_grid, (timestamps, pulse, HOUR_US)),
+        ]
+        for name, func, legacy, case_args in cases:
+            fast = timed(func, *case_args)
+            if size <= args.legacy_max:
+                slow = timed(legacy, *[a.tolist() if isinstance(a, np.ndarray) else a for a in case_args])
+                print('%-10d %-10s %12.4f %12.4f %8.1fx' % (size, name, fast, slow, slow / fast))
+            else:
+                print('%-10d %-10s %12.4f %12s %9s' % (size, name, fast, '-', '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""Regression suite of the dashboard views and every chart of Visualizer.
+
+``run`` seeds one user per size with DataGenerator (fixed seed, the last ``--days``
+days up to today) into the SQLite files of benchmarks.settings, then measures
+views.home, views.analysis and each plot_* behind CHARTS: best wall time of
+``--repeat`` runs, query count, peak traced memory and output bytes, written as json.
+``compare`` fails when a metric of the new results regresses past its threshold.
+
+    python -m benchmarks.dashboard run --sizes 1000 100000 1000000 --output results.json
+    python -m benchmarks.dashboard compare baseline.json results.json --threshold 0.2
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from benchmarks import setup
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+METRICS = ['seconds', 'queries', 'peak_bytes', 'bytes']
+FIRST_USER = 910000
+SEED = 0
+
+
+def seed(user, size, days):
+    from django.contrib.auth.models import User
+    import data_generator
+    from blog import purge, rollups
+    from blog.models import Activity, Drinking
+
+    for model in (Activity, Drinking):
+        purge.purge(model, user=user)
+    rollups.rebuild(user=user)
+    User.objects.filter(id=user).delete()
+    User.objects.create_user(id=user, username='benchmark-%d' % size, password='benchmark')
+    stop = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    stop += datetime.timedelta(days=1)
+    generator = data_generator.DataGenerator(user, stop - datetime.timedelta(days=days), stop)
+    start = time.perf_counter()
+    data_generator.save_chunks(generator.iter_chunks(size, chunk_size=100000, seed=SEED))
+    return time.perf_counter() - start
+
+
+def scenarios(user):
+    from django.core.cache import caches
+    from django.test import Client
+    from blog.models import AnalysisResult
+    from blog.visualizer import CHARTS, Visualizer
+
+    client = Client()
+    client.force_login(client_user(user))
+
+    def view(url):
+        def run():
+            caches['charts'].clear()
+            AnalysisResult.objects.filter(user=user).delete()
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+            return response.content
+        return run
+
+    def plot(method):
+        return lambda: getattr(Visualizer(user=user), method)()
+
+    cases = {'views.home': view('/'), 'views.analysis': view('/analysis/')}
+    for method in sorted(set(CHARTS.values())):
+        cases['Visualizer.%s' % method] = plot(method)
+    return cases
+
+
+def client_user(user):
+    from django.contrib.auth.models import User
+    return User.objects.get(id=user)
+
+
+def output_bytes(result):
+    if isinstance(result, tuple):
+        return sum(output_bytes(r) for r in result)
+    return len(result) if result is not None else 0
+
+
+def measure(func, repeat):
+    from blog.instrumentation import measure as instrument
+    best = None
+    for _ in range(repeat):
+        with instrument('benchmark') as m:
+            result = func()
+        best = m.seconds if best is None else min(best, m.seconds)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'queries': m.queries, 'peak_bytes': peak, 'bytes': output_bytes(result)}
+
+
+def run(args):
+    setup()
+    import django as installed
+    import numpy
+    import plotly
+    results = {
+        'meta': {'python': platform.python_version(), 'django': installed.get_version(),
+                 'numpy': numpy.__version__, 'plotly': plotly.__version__,
+                 'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                 'days': args.days, 'repeat': args.repeat, 'seed': SEED},
+        'results': {},
+    }
+    for index, size in enumerate(args.sizes):
+        user = FIRST_USER + index
+        print('seeding %d readings ... %.1f s' % (size, seed(user, size, args.days)), file=sys.stderr)
+        results['results'][str(size)] = sizes = {}
+        for name, func in scenarios(user).items():
+            sizes[name] = measure(func, args.repeat)
+            print('%9d %-36s %9.1f ms %5d queries %8.1f MB %9d bytes' % (
+                size, name, sizes[name]['seconds'] * 1000, sizes[name]['queries'],
+                sizes[name]['peak_bytes'] / 2 ** 20, sizes[name]['bytes']), file=sys.stderr)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        return compare_files(args.compare, args.output, args)
+    return 0
+
+
+def regressions(baseline, current, threshold, query_threshold, min_seconds):
+    """(size, scenario, metric, old, new) of every metric of ``current`` worse than ``baseline``."""
+    found = []
+    for size, cases in sorted(current['results'].items(), key=lambda item: int(item[0])):
+        for name, metrics in sorted(cases.items()):
+            old = baseline['results'].get(size, {}).get(name)
+            if old is None:
+                continue
+            for metric in METRICS:
+                if metric == 'queries':
+                    worse = metrics[metric] > old[metric] + query_threshold
+                elif metric == 'seconds':
+                    # timer noise of very fast cases
+                    worse = metrics[metric] > max(old[metric] * (1 + threshold), min_seconds)
+                else:
+                    worse = metrics[metric] > old[metric] * (1 + threshold)
+                if worse:
+                    found.append((size, name, metric, old[metric], metrics[metric]))
+    return found
+
+
+def compare_files(baseline_path, current_path, args):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    found = regressions(baseline, current, args.threshold, args.query_threshold, args.min_seconds)
+    for size, name, metric, old, new in found:
+        print('REGRESSION %s readings %s %s: %s -> %s' % (size, name, metric, old, new))
+    if not found:
+        print('no regressions against %s' % baseline_path)
+    return 1 if found else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    run_parser = commands.add_parser('run', help='seed, measure and write the results')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    run_parser.add_argument('--days', type=int, default=31)
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--output', default='benchmark-results.json')
+    run_parser.add_argument('--compare', metavar='BASELINE', help='compare the results against this file')
+    compare_parser = commands.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    for p in (run_parser, compare_parser):
+        p.add_argument('--threshold', type=float, default=0.25,
+                       help='allowed relative growth of time, memory and bytes')
+        p.add_argument('--query-threshold', type=int, default=0, help='allowed additional queries')
+        p.add_argument('--min-seconds', type=float, default=0.05,
+                       help='times below this never count as regression')
+    args = parser.parse_args()
+    if args.command == 'run':
+        sys.exit(run(args))
+    sys.exit(compare_files(args.baseline, args.current, args))
+
+
+if __name__ == '__main__':
+    main()
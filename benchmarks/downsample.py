@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Speed and fidelity of blog.downsample on a synthetic day of band readings.
+
+Fidelity is the RMS error of the line through the kept points against every
+original point, relative to the value range, plus whether the extremes survive.
+Bytes is the size of the scatter trace serialized like Visualizer.plot(output='json').
+
+    python -m benchmarks.downsample [--sizes 10000 100000 1000000] [--points 2000]
+"""
+import argparse
+import datetime
+import json
+import time
+
+import numpy as np
+import plotly
+import plotly.graph_objs as go
+
+from blog import downsample
+from blog.binning import DAY_US
+
+
+def readings(size, rng):
+    x = np.sort(rng.integers(0, DAY_US, size))
+    hours = x / (DAY_US / 24)
+    # circadian pulse with noise and a few spikes
+    y = 70 + 15 * np.sin(hours / 24 * 2 * np.pi) + rng.normal(0, 3, size)
+    spikes = rng.choice(size, max(size // 5000, 1), replace=False)
+    y[spikes] += rng.uniform(30, 60, len(spikes))
+    return x, y
+
+
+def payload(x, y):
+    start = datetime.datetime(2018, 11, 5)
+    times = [start + datetime.timedelta(microseconds=int(t)) for t in x]
+    trace = go.Scatter(x=times, y=y, mode='markers')
+    return len(json.dumps(trace.to_plotly_json(), cls=plotly.utils.PlotlyJSONEncoder, separators=(',', ':')))
+
+
+def fidelity(x, y, keep):
+    line = np.interp(x, x[keep], y[keep])
+    rms = np.sqrt(np.mean((line - y) ** 2)) / (y.max() - y.min())
+    return rms, y.argmax() in keep and y.argmin() in keep
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print('%-8s %9s %10s %9s %9s %9s' % ('method', 'readings', 'ms', 'points', 'rms err', 'extremes'))
+    for size in args.sizes:
+        x, y = readings(size, rng)
+        full_bytes = payload(x, y) if size <= 100000 else None
+        for method in downsample.METHODS:
+            start = time.perf_counter()
+            keep = downsample.select(x, y, args.points, method)
+            seconds = time.perf_counter() - start
+            rms, extremes = fidelity(x, y, keep)
+            print('%-8s %9d %10.2f %9d %8.2f%% %9s' % (method, size, seconds * 1000, len(keep), rms * 100, extremes))
+        if full_bytes:
+            print('%-8s %9d bytes full %d, downsampled %d' % ('payload', size, full_bytes, payload(x[keep], y[keep])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Query plans and latency of the dashboard queries with and without the (user, timestamp) indexes.
+
+Seeds ``--users`` users with data_generator.generate into the new_smartband_db scratch
+file of benchmarks.settings, runs every query with the indexes dropped and again with
+them restored, then removes the seeded rows.
+
+    python -m benchmarks.indexes --users 20 --readings 5000
+"""
+import argparse
+import datetime
+import time
+
+from benchmarks import setup
+
+setup()
+
+from django.db import connections  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+import data_generator  # noqa: E402
+from blog.models import Activity, Drinking  # noqa: E402
+
+DB = 'new_smartband_db'
+FIRST_USER = 900000
+
+
+def queries(user):
+    now = timezone.now()
+    last_day = (now - datetime.timedelta(days=1), now)
+    return [
+        ('activity snapshot', Activity.objects.using(DB).filter(user=user).
+            order_by('timestamp').values_list('timestamp', 'steps', 'pulse')),
+        ('drinking snapshot', Drinking.objects.using(DB).filter(user=user).
+            order_by('timestamp').values_list('timestamp', 'alcohol')),
+        ('activity last day', Activity.objects.using(DB).filter(user=user, timestamp__range=last_day).
+            order_by('timestamp')),
+        ('drinking last day', Drinking.objects.using(DB).filter(user=user, timestamp__range=last_day).
+            order_by('timestamp')),
+    ]
+
+
+def measure(users, repeat):
+    results = []
+    for name, query in queries(users[len(users) // 2]):
+        plan = query.explain()
+        start = time.perf_counter()
+        for user in users[:repeat]:
+            list(dict(queries(user))[name])
+        results.append((name, (time.perf_counter() - start) / min(repeat, len(users)), plan))
+    return results
+
+
+def report(title, results):
+    print('== %s' % title)
+    for name, seconds, plan in results:
+        print('%-20s %9.2f ms' % (name, seconds * 1000))
+        print('    ' + plan.replace('\n', '\n    '))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--readings', type=int, default=5000, help='readings per user')
+    parser.add_argument('--days', type=int, default=31)
+    parser.add_argument('--repeat', type=int, default=10, help='users queried per measurement')
+    parser.add_argument('--keep', action='store_true', help='keep the seeded rows')
+    args = parser.parse_args()
+
+    users = list(range(FIRST_USER, FIRST_USER + args.users))
+    start = time.perf_counter()
+    for user in users:
+        data_generator.generate(user, args.days, args.readings)
+    print('seeded %d readings in %.1f s' % (args.users * args.readings, time.perf_counter() - start))
+
+    indexes = [(model, index) for model in (Activity, Drinking) for index in model._meta.indexes]
+    try:
+        with connections[DB].schema_editor() as editor:
+            for model, index in indexes:
+                editor.remove_index(model, index)
+        report('without indexes', measure(users, args.repeat))
+    finally:
+        with connections[DB].schema_editor() as editor:
+            for model, index in indexes:
+                editor.add_index(model, index)
+    report('with indexes', measure(users, args.repeat))
+
+    if not args.keep:
+        Activity.objects.using(DB).filter(user__in=users).delete()
+        Drinking.objects.using(DB).filter(user__in=users).delete()
+
+
+if __name__ == '__main__':
+    main()
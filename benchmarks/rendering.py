@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Wall-clock time of rendering the analysis page charts in every blog.rendering mode.
+
+Seeds one user with data_generator.generate into the SQLite scratch files of
+benchmarks.settings, renders ANALYSIS_CHARTS (and HOME_CHARTS with --home)
+``--repeat`` times per mode, checks that every mode returns the same charts, then
+removes the seeded rows.
+
+    python -m benchmarks.rendering --readings 20000 --repeat 5
+"""
+import argparse
+import time
+
+from benchmarks import setup
+
+setup()
+
+import data_generator  # noqa: E402
+from blog import rendering, rollups  # noqa: E402
+from blog.models import Activity, Drinking  # noqa: E402
+from blog.visualizer import ANALYSIS_CHARTS, HOME_CHARTS, Visualizer  # noqa: E402
+
+DB = 'new_smartband_db'
+USER = 900500
+
+
+def render(names, mode, output):
+    return Visualizer(user=USER, output=output, render_mode=mode).render(names)
+
+
+def measure(names, mode, output, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        charts = render(names, mode, output)
+        times.append(time.perf_counter() - start)
+    return min(times), charts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readings', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=31)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', choices=['div', 'json'], default='json',
+                        help='div output embeds random ids, only json is compared between modes')
+    parser.add_argument('--home', action='store_true', help='render the home page charts as well')
+    parser.add_argument('--keep', action='store_true', help='keep the seeded rows')
+    args = parser.parse_args()
+
+    data_generator.generate(USER, args.days, args.readings)
+    rollups.rebuild(user=USER)
+    names = ANALYSIS_CHARTS + (HOME_CHARTS if args.home else [])
+    try:
+        # warm the pools so their start-up is not measured
+        for mode in rendering.MODES:
+            render(names, mode, args.output)
+        results = {mode: measure(names, mode, args.output, args.repeat) for mode in rendering.MODES}
+        baseline, expected = results['sequential']
+        for mode in rendering.MODES:
+            seconds, charts = results[mode]
+            same = 'same' if args.output == 'div' or charts == expected else 'DIFFERENT'
+            print('%-12s %8.1f ms  %5.2fx  %s' % (mode, seconds * 1000, baseline / seconds, same))
+    finally:
+        if not args.keep:
+            Activity.objects.using(DB).filter(user=USER).delete()
+            Drinking.objects.using(DB).filter(user=USER).delete()
+            rollups.rebuild(user=USER)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# Settings of benchmarks.dashboard: the project settings on two SQLite files,
+# charts rendered inline and sequentially so every run does the same work.
+from django_project.settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'django_mysql']  # noqa: F405
+
+BENCHMARK_DIR = os.environ.get('BLOG_BENCHMARK_DIR', os.path.join(BASE_DIR, 'benchmarks', 'data'))  # noqa: F405
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_DIR, 'default.sqlite3'),  # noqa: F405
+    },
+    'new_smartband_db': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_DIR, 'readings.sqlite3'),  # noqa: F405
+    },
+}
+
+ALLOWED_HOSTS = ['testserver']
+BLOG_LAZY_CHARTS = False
+BLOG_ANALYSIS_BACKGROUND = False
+BLOG_RENDER_MODE = 'sequential'
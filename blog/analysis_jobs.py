@@ -0,0 +1,107 @@
+import datetime
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .models import AnalysisResult
+from .chart_cache import ChartCache
+from .snapshot import DataSnapshot
+from .visualizer import ANALYSIS_CHARTS, Visualizer
+
+logger = logging.getLogger(__name__)
+
+# a running job not finished after this long is assumed dead and may be claimed again
+STALE_AFTER = datetime.timedelta(minutes=10)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def background():
+    """False runs the jobs in the requesting thread, e.g. in tests."""
+    return getattr(settings, 'BLOG_ANALYSIS_BACKGROUND', True)
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'BLOG_ANALYSIS_WORKERS', 2),
+                                           thread_name_prefix='analysis')
+        return _executor
+
+
+def render(user, output='div', using=None):
+    """Every analysis page chart of ``user``, name -> rendered chart or None."""
+    v = Visualizer(user=user, output=output, snapshot=DataSnapshot(user, using=using))
+    return v.render(ANALYSIS_CHARTS)
+
+
+def claim(user, output='div', using=None):
+    """Mark the job of ``user`` running, False if another thread or process already runs it.
+
+    The conditional UPDATE is atomic in the database, so concurrent requests of
+    one user start a single job even across WSGI processes.
+    """
+    AnalysisResult.objects.using(using).get_or_create(user=user, output=output)
+    now = timezone.now()
+    pending = AnalysisResult.objects.using(using).filter(user=user, output=output)
+    pending = pending.exclude(status=AnalysisResult.RUNNING, started__gt=now - STALE_AFTER)
+    return pending.update(status=AnalysisResult.RUNNING, started=now) == 1
+
+
+def run(user, output='div', using=None):
+    """Render the charts of a claimed job and store them as the latest result."""
+    start = time.perf_counter()
+    # taken before rendering, readings written meanwhile leave the result stale
+    version = ChartCache(user=user, output=output, using=using).version()
+    fields = {'status': AnalysisResult.IDLE, 'finished': timezone.now()}
+    try:
+        charts = render(user, output, using)
+    except Exception as e:
+        logger.exception('analysis of user %s failed', user)
+        fields.update(error=repr(e), failed_version=version)
+    else:
+        fields.update(version=version, charts=json.dumps(charts), error='', failed_version='')
+    fields['seconds'] = time.perf_counter() - start
+    AnalysisResult.objects.using(using).filter(user=user, output=output).update(**fields)
+
+
+def run_in_thread(user, output, using):
+    try:
+        run(user, output, using)
+    finally:
+        # worker threads open their own connections
+        connections.close_all()
+
+
+def refresh(user, output='div', using=None):
+    """Start the analysis job of ``user`` unless it is running already, True if started."""
+    if not claim(user, output, using):
+        return False
+    if background():
+        executor().submit(run_in_thread, user, output, using)
+    else:
+        run(user, output, using)
+    return True
+
+
+def latest(user, output='div', using=None):
+    """(charts of the last completed job or None, whether a newer result is being computed).
+
+    A missing or stale result starts a refresh, the request never renders itself.
+    A job that failed on the current readings is not started again before they change.
+    """
+    result = AnalysisResult.objects.using(using).filter(user=user, output=output).first()
+    version = ChartCache(user=user, output=output, using=using).version()
+    if result is None or version not in (result.version, result.failed_version):
+        refresh(user, output, using)
+        result = AnalysisResult.objects.using(using).filter(user=user, output=output).first()
+    charts = json.loads(result.charts) if result.finished and result.version else None
+    return charts, result.status == AnalysisResult.RUNNING or version not in (result.version, result.failed_version)
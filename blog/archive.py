@@ -0,0 +1,271 @@
+import datetime
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from .models import Activity, DailyRollup, Drinking
+from . import ingest, live, materialized, partitions, purge, rollups, routers
+from .snapshot import ActivityColumns, DrinkingColumns
+from .timeseries import from_epoch, to_epoch
+
+# One file per user and month: MAGIC, the little-endian uint32 length of a json
+# header, the header, then every column at an ALIGN aligned offset. Columns are
+# little-endian arrays, timestamps (epoch microseconds) are stored as their first
+# value followed by the differences, each column is optionally zlib compressed.
+MAGIC = b'SBANDCOL'
+VERSION = 1
+ALIGN = 64
+SUFFIX = '.sband'
+COLUMNS = {
+    'activity.timestamp': ('<i8', 'delta'),
+    'activity.steps': ('<u2', 'raw'),
+    'activity.pulse': ('<f4', 'raw'),
+    'drinking.timestamp': ('<i8', 'delta'),
+    'drinking.alcohol': ('<f4', 'raw'),
+}
+STEPS_MAX = np.iinfo(np.uint16).max
+
+
+def month_path(root, user, month):
+    return os.path.join(root, str(user), '%04d-%02d%s' % (month.year, month.month, SUFFIX))
+
+
+def encode(values, dtype, encoding):
+    values = np.asarray(values)
+    if encoding == 'delta':
+        values = np.diff(values, prepend=np.int64(0)) if len(values) else values
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+def write_month(path, user, month, activity, drinking, compress=False):
+    """Write one month of ``user``, ``activity`` and ``drinking`` are ActivityColumns/DrinkingColumns."""
+    if len(activity.steps) and (activity.steps.min() < 0 or activity.steps.max() > STEPS_MAX):
+        raise ValueError('steps of user %s in %s do not fit uint16' % (user, month))
+    arrays = {'activity.timestamp': activity.timestamp, 'activity.steps': activity.steps,
+              'activity.pulse': activity.pulse, 'drinking.timestamp': drinking.timestamp,
+              'drinking.alcohol': drinking.alcohol}
+    blobs = {}
+    columns = {}
+    for name, (dtype, encoding) in COLUMNS.items():
+        blob = encode(arrays[name], dtype, encoding).tobytes()
+        blobs[name] = zlib.compress(blob) if compress else blob
+        columns[name] = {'dtype': dtype, 'encoding': encoding, 'length': len(arrays[name]),
+                         'compression': 'zlib' if compress else None, 'nbytes': len(blobs[name])}
+    header_size = ALIGN
+    while True:
+        # the offsets depend on the header size and are part of the header
+        offset = header_size
+        for name in COLUMNS:
+            columns[name]['offset'] = offset
+            offset += -(-columns[name]['nbytes'] // ALIGN) * ALIGN
+        header = json.dumps({'version': VERSION, 'user': user, 'month': month.isoformat()[:7],
+                             'columns': columns}).encode()
+        if len(MAGIC) + 4 + len(header) <= header_size:
+            break
+        header_size = -(-(len(MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for name in COLUMNS:
+            f.seek(columns[name]['offset'])
+            f.write(blobs[name])
+        f.truncate(offset)
+    os.replace(tmp, path)
+    return path
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a readings archive' % path)
+        size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(size).decode())
+    if header['version'] != VERSION:
+        raise ValueError('%s has archive version %s, not %s' % (path, header['version'], VERSION))
+    return header
+
+
+def load_column(path, column):
+    """The stored values of a header column, a read-only memmap unless compressed."""
+    dtype = np.dtype(column['dtype'])
+    if not column['length']:
+        return np.empty(0, dtype=dtype)
+    if column['compression'] is None:
+        return np.memmap(path, dtype=dtype, mode='r', offset=column['offset'], shape=(column['length'],))
+    with open(path, 'rb') as f:
+        f.seek(column['offset'])
+        return np.frombuffer(zlib.decompress(f.read(column['nbytes'])), dtype=dtype)
+
+
+def decode(values, encoding):
+    # the one copy of a load, steps, pulse and alcohol stay views of the file
+    return np.cumsum(values, dtype=np.int64) if encoding == 'delta' else values
+
+
+def load_month(path):
+    """(header, ActivityColumns, DrinkingColumns) of one archive file."""
+    header = read_header(path)
+    values = {name: decode(load_column(path, column), column['encoding'])
+              for name, column in header['columns'].items()}
+    activity = ActivityColumns(timestamp=values['activity.timestamp'], steps=values['activity.steps'],
+                               pulse=values['activity.pulse'])
+    drinking = DrinkingColumns(timestamp=values['drinking.timestamp'], alcohol=values['drinking.alcohol'])
+    return header, activity, drinking
+
+
+def user_paths(root, user):
+    directory = os.path.join(root, str(user))
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SUFFIX))
+
+
+class ArchiveSnapshot:
+    """DataSnapshot of archived months, for Visualizer(snapshot=...) without the database.
+
+    Only the charts computed from the snapshot columns (ANALYSIS_CHARTS) work, the
+    last day and monthly charts query the database.
+    """
+    # nothing of the database (weekly cells, materialized analysis) describes these readings
+    in_database = False
+    using = None
+
+    def __init__(self, paths):
+        self.paths = sorted(paths)
+        months = [load_month(path) for path in self.paths]
+        users = {header['user'] for header, _, _ in months}
+        if len(users) > 1:
+            raise ValueError('archives of several users: %s' % sorted(users))
+        self.user = users.pop() if users else None
+        self.activity = self.concatenate(ActivityColumns, [m[1] for m in months])
+        self.drinking = self.concatenate(DrinkingColumns, [m[2] for m in months])
+
+    @staticmethod
+    def concatenate(columns, months):
+        # a single month stays a view of its file
+        if len(months) == 1:
+            return months[0]
+        if not months:
+            return columns(*(np.empty(0, dtype=np.int64) for _ in columns._fields))
+        return columns(*(np.concatenate([getattr(m, field) for m in months]) for field in columns._fields))
+
+    @classmethod
+    def of_user(cls, root, user):
+        return cls(user_paths(root, user))
+
+
+def month_range(month):
+    start = datetime.datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    stop = partitions.add_months(month, 1)
+    return start, datetime.datetime(stop.year, stop.month, 1, tzinfo=timezone.utc)
+
+
+def month_columns(user, month, using):
+    start, stop = month_range(month)
+    rows = Activity.objects.using(using).filter(user=user, timestamp__gte=start, timestamp__lt=stop). \
+        order_by('timestamp').values_list('timestamp', 'steps', 'pulse')
+    activity = list(rows.iterator(chunk_size=ingest.BATCH_SIZE))
+    rows = Drinking.objects.using(using).filter(user=user, timestamp__gte=start, timestamp__lt=stop,
+                                                alcohol__isnull=False). \
+        order_by('timestamp').values_list('timestamp', 'alcohol')
+    drinking = list(rows.iterator(chunk_size=ingest.BATCH_SIZE))
+    return (ActivityColumns(timestamp=to_epoch([r[0] for r in activity]),
+                            steps=np.array([r[1] for r in activity], dtype=np.int64),
+                            pulse=np.array([r[2] for r in activity], dtype=np.float64)),
+            DrinkingColumns(timestamp=to_epoch([r[0] for r in drinking]),
+                            alcohol=np.array([r[1] for r in drinking], dtype=np.float64)))
+
+
+def user_months(user, using):
+    first, last = None, None
+    for model in (Activity, Drinking):
+        bounds = model.objects.using(using).filter(user=user).aggregate(Min('timestamp'), Max('timestamp'))
+        if bounds['timestamp__min'] is not None:
+            first = min(first, bounds['timestamp__min']) if first else bounds['timestamp__min']
+            last = max(last, bounds['timestamp__max']) if last else bounds['timestamp__max']
+    return list(partitions.months_between(first, last)) if first else []
+
+
+def export(root, users=None, months=None, compress=False, using=None):
+    """Write every month of ``users`` (default all) with readings, or only ``months``; the written paths."""
+    if users is None:
+        users = set(Activity.objects.using(using).values_list('user', flat=True).distinct())
+        users |= set(Drinking.objects.using(using).values_list('user', flat=True).distinct())
+    paths = []
+    for user in sorted(users):
+        for month in (months if months is not None else user_months(user, using)):
+            activity, drinking = month_columns(user, month, using)
+            if len(activity.timestamp) or len(drinking.timestamp):
+                paths.append(write_month(month_path(root, user, month), user, month, activity, drinking, compress))
+    return paths
+
+
+def history_days(model, user, start, stop, using):
+    """Local days in [start, stop) whose readings of ``model`` retention dropped while the rollups keep them."""
+    rolled = DailyRollup.objects.using(using).filter(user=user, timestamp__gte=start, timestamp__lt=stop,
+                                                     **{purge.ROLLUP_COUNTS[model] + '__gt': 0})
+    raw = model.objects.using(using).filter(user=user, timestamp__gte=start, timestamp__lt=stop).annotate(
+        day=TruncDay('timestamp')).values_list('day', flat=True).distinct()
+    return set(rolled.values_list('timestamp', flat=True)) - set(raw)
+
+
+def restore_readings(model, user, readings, days, batch_size, using):
+    """Insert ``readings`` of the retention dropped ``days`` without adding them to the history again."""
+    with transaction.atomic(using=using):
+        model.objects.using(using).bulk_create(readings, batch_size=batch_size)
+        # bulk_create does not return the ids on every backend
+        in_days = Q()
+        for day in days:
+            next_day = datetime.datetime.combine(timezone.localdate(day) + datetime.timedelta(days=1), datetime.time())
+            in_days |= Q(timestamp__gte=day, timestamp__lt=timezone.make_aware(next_day))
+        saved = list(model.objects.using(using).filter(in_days, user=user).order_by('timestamp', 'pk'))
+        materialized.restore_readings(user, model, saved, using)
+    return len(saved)
+
+
+def import_month(path, replace=False, batch_size=ingest.BATCH_SIZE, using=None):
+    """Save the readings of an archive file, the number of rows saved.
+
+    Refuses a month that already has readings in the database unless ``replace``
+    purges them first, taking them out of the rollups and the analysis. Readings of
+    days retention dropped are restored to the raw tables only, the rollups and the
+    analysis still count them; the others go through ingest.save_readings.
+    """
+    using = using or routers.write_alias()
+    header, activity, drinking = load_month(path)
+    user = header['user']
+    start, stop = month_range(datetime.date(int(header['month'][:4]), int(header['month'][5:7]), 1))
+    for model in (Activity, Drinking):
+        if model.objects.using(using).filter(user=user, timestamp__gte=start, timestamp__lt=stop).exists():
+            if not replace:
+                raise ValueError('user %s already has readings in %s' % (user, header['month']))
+            purge.purge(model, user=user, after=start, before=stop, using=using)
+    readings = {
+        Activity: [Activity(user=user, timestamp=from_epoch(t), steps=steps, pulse=pulse)
+                   for t, steps, pulse in zip(activity.timestamp.tolist(), activity.steps.tolist(),
+                                              activity.pulse.tolist())],
+        Drinking: [Drinking(user=user, timestamp=from_epoch(t), alcohol=alcohol)
+                   for t, alcohol in zip(drinking.timestamp.tolist(), drinking.alcohol.tolist())],
+    }
+    saved = 0
+    for model in (Activity, Drinking):
+        days = history_days(model, user, start, stop, using)
+        if days:
+            dropped = [r for r in readings[model] if rollups.local_day(r.timestamp) in days]
+            readings[model] = [r for r in readings[model] if rollups.local_day(r.timestamp) not in days]
+            saved += restore_readings(model, user, dropped, days, batch_size, using)
+    activities, drinks = readings[Activity], readings[Drinking]
+    for i in range(0, max(len(activities), len(drinks)), batch_size):
+        saved += sum(ingest.save_readings(activities[i:i + batch_size], drinks[i:i + batch_size],
+                                          batch_size, using))
+    # restored readings bypass add_readings
+    live.ENGINE.forget(user)
+    return saved
@@ -0,0 +1,24 @@
+import logging
+
+import django
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def check_connections(**kwargs):
+    """Close the persistent connections failing a ping, their next query reconnects.
+
+    Connected to request_started, does what CONN_HEALTH_CHECKS does from Django 4.1
+    on for the connections CONN_MAX_AGE keeps open across requests. The pooled
+    backends ping their connections on checkout instead.
+    """
+    if django.VERSION >= (4, 1):
+        return
+    for connection in connections.all():
+        if (connection.connection is None or connection.in_atomic_block
+                or not connection.settings_dict.get('CONN_HEALTH_CHECKS')):
+            continue
+        if not connection.is_usable():
+            logger.info('Closing the unusable persistent connection of %s', connection.alias)
+            connection.close()
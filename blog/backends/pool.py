@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# (alias, database name): Pool, shared by every thread of the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class Pool:
+    """At most ``size`` open DB-API connections, handed out one caller at a time.
+
+    ``acquire`` reuses the most recently released idle connection that is younger
+    than ``max_age`` seconds and passes ``check``, opens a new one while fewer than
+    ``size`` are open, and otherwise waits up to ``timeout`` seconds for a release.
+    """
+    def __init__(self, size=10, timeout=10, max_age=None):
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.condition = threading.Condition()
+        self.idle = []
+        self.opened_at = {}
+        # connections being opened, they count against size already
+        self.opening = 0
+        # checkouts reusing an idle connection, opening one, having to wait, giving up
+        self.hits = 0
+        self.opens = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.discards = 0
+
+    def expired(self, raw):
+        return self.max_age is not None and time.monotonic() - self.opened_at[raw] > self.max_age
+
+    def take(self):
+        # the idle connection to reuse, or None when a new one may be opened
+        start = deadline = None
+        with self.condition:
+            while not self.idle and len(self.opened_at) + self.opening >= self.size:
+                if deadline is None:
+                    self.waits += 1
+                    start = time.monotonic()
+                    deadline = start + self.timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self.wait_seconds += time.monotonic() - start
+                    raise PoolTimeout('no connection free after %.1f s, all %d in use' % (self.timeout, self.size))
+                self.condition.wait(remaining)
+            if start is not None:
+                self.wait_seconds += time.monotonic() - start
+            if self.idle:
+                return self.idle.pop()
+            self.opening += 1
+            return None
+
+    def acquire(self, connect, check=None):
+        while True:
+            raw = self.take()
+            if raw is None:
+                return self.open(connect)
+            if not self.expired(raw) and (check is None or check(raw)):
+                with self.condition:
+                    self.hits += 1
+                return raw
+            self.discard(raw)
+
+    def open(self, connect):
+        try:
+            raw = connect()
+        except Exception:
+            with self.condition:
+                self.opening -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.opening -= 1
+            self.opened_at[raw] = time.monotonic()
+            self.opens += 1
+        return raw
+
+    def release(self, raw, reusable=True):
+        if not reusable or self.expired(raw):
+            self.discard(raw)
+            return
+        with self.condition:
+            self.idle.append(raw)
+            self.condition.notify()
+
+    def discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            logger.debug('Closing a discarded connection failed', exc_info=True)
+        with self.condition:
+            self.opened_at.pop(raw, None)
+            self.discards += 1
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {'size': self.size, 'open': len(self.opened_at), 'idle': len(self.idle),
+                    'in_use': len(self.opened_at) - len(self.idle), 'hits': self.hits, 'opens': self.opens,
+                    'waits': self.waits, 'wait_seconds': self.wait_seconds, 'timeouts': self.timeouts,
+                    'discards': self.discards}
+
+
+def pool_for(alias, settings_dict):
+    options = settings_dict.get('POOL') or {}
+    key = (alias, settings_dict['NAME'])
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = Pool(size=options.get('SIZE', 10), timeout=options.get('TIMEOUT', 10),
+                               max_age=options.get('MAX_AGE'))
+        return _pools[key]
+
+
+def stats():
+    """{'alias:database name': Pool.stats()} of the pools of this process."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {'%s:%s' % key: pool.stats() for key, pool in pools}
+
+
+class PooledDatabaseWrapperMixin:
+    """Takes the DB-API connections of a Django backend from a Pool and returns them on close.
+
+    Configured with POOL = {'SIZE': 10, 'TIMEOUT': 10, 'MAX_AGE': None} in the
+    database settings. Keep CONN_MAX_AGE at 0, closing at the end of the request is
+    what hands the connection back. Idle connections are pinged before reuse.
+    """
+    def pool(self):
+        return pool_for(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        connect = super().get_new_connection
+        try:
+            return self.pool().acquire(lambda: connect(conn_params), self.ping)
+        except PoolTimeout as e:
+            logger.warning('Connection pool of %s exhausted: %s', self.alias, e)
+            raise self.Database.OperationalError(str(e))
+
+    def ping(self, raw):
+        try:
+            cursor = raw.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except self.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # a connection closed inside atomic() is in an unknown state
+        reusable = not self.in_atomic_block
+        if reusable:
+            try:
+                self.connection.rollback()
+            except self.Database.Error:
+                reusable = False
+        self.pool().release(self.connection, reusable)
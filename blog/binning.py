@@ -0,0 +1,81 @@
+import numpy as np
+
+DAY_US = 24 * 60 * 60 * 1000 * 1000
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def bucket_means(index, values, minlength=0):
+    counts = np.bincount(index, minlength=minlength)
+    sums = np.bincount(index, weights=values, minlength=minlength)
+    means = np.full(len(counts), np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return counts, means
+
+
+def grid2d(x, y, grid_x):
+    """Mean of ``y`` per ``grid_x`` bucket of ``x``, buckets in order of first appearance."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    keys = np.rint(x / grid_x).astype(np.int64)
+    if len(keys) == 0:
+        return [], []
+    key_min = keys.min()
+    width = keys.max() - key_min + 1
+    if width > 4 * len(keys):
+        # sparse keys, index through a sort instead of a dense bucket range
+        uniq, first, index = np.unique(keys, return_index=True, return_inverse=True)
+        index = index.ravel()
+    else:
+        index = keys - key_min
+        first = np.full(width, len(keys))
+        # reversed assignment leaves the earliest position of every bucket
+        first[index[::-1]] = np.arange(len(keys) - 1, -1, -1)
+        uniq = np.arange(key_min, key_min + width)
+    counts, means = bucket_means(index, y, minlength=len(uniq))
+    order = np.argsort(first, kind='stable')[:np.count_nonzero(counts)]
+    return (uniq[order] * grid_x).tolist(), means[order].tolist()
+
+
+def grid3d(x, y, z, grid_x, grid_y):
+    """Mean of ``z`` on a ``grid_x`` x ``grid_y`` lattice always spanning the origin.
+
+    Returns ``new_x``, ``new_y`` and a ``(len(new_y), len(new_x))`` matrix with NaN
+    for empty cells.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    x_int = np.rint(x / grid_x).astype(np.int64)
+    y_int = np.rint(y / grid_y).astype(np.int64)
+    x_int_min = min(0, x_int.min(initial=0))
+    x_int_max = max(0, x_int.max(initial=0))
+    y_int_min = min(0, y_int.min(initial=0))
+    y_int_max = max(0, y_int.max(initial=0))
+    width = x_int_max - x_int_min + 1
+    height = y_int_max - y_int_min + 1
+    cells = (y_int - y_int_min) * width + (x_int - x_int_min)
+    _, means = bucket_means(cells, z, minlength=width * height)
+    new_x = np.arange(x_int_min, x_int_max + 1) * grid_x
+    new_y = np.arange(y_int_min, y_int_max + 1) * grid_y
+    return new_x, new_y, means.reshape(height, width)
+
+
+def week_slots(timestamps, grid_us):
+    """Weekday and time-slot index of every epoch microsecond timestamp (UTC).
+
+    A reading exactly on a slot boundary belongs to the slot that ends there,
+    midnight belongs to the first slot of its day.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    n_slots = -(-DAY_US // grid_us)
+    weekday = (timestamps // DAY_US + 3) % 7
+    time_of_day = timestamps % DAY_US
+    slot = np.clip(-(-time_of_day // grid_us) - 1, 0, n_slots - 1)
+    return weekday, slot, n_slots
+
+
+def week_grid(timestamps, values, grid_us):
+    """Mean of ``values`` per time slot and weekday, shape ``(n_slots, 7)`` with NaN for empty cells."""
+    weekday, slot, n_slots = week_slots(timestamps, grid_us)
+    _, means = bucket_means(slot * 7 + weekday, np.asarray(values, dtype=np.float64), minlength=n_slots * 7)
+    return means.reshape(n_slots, 7)
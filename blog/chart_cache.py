@@ -0,0 +1,70 @@
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db.models import Count, Max
+
+from .models import Activity, Drinking
+
+MISSING = object()
+
+
+class ChartCache:
+    """Rendered charts of one user, keyed by chart name and a data-version token.
+
+    The token is the highest id and the row count of the user's readings in every
+    table, taken from the database alone so that writes of other processes, deletes
+    and rows written behind Django's back expire the cache as well. Entries also
+    expire after the cache TIMEOUT and are evicted LRU once the backend's
+    MAX_ENTRIES is reached.
+    """
+    def __init__(self, user, output='div', using=None, cache_alias='charts'):
+        self.user = user
+        self.output = output
+        self.using = using
+        self.cache = caches[cache_alias]
+        self._version = None
+
+    def version(self):
+        if self._version is None:
+            parts = []
+            for model in (Activity, Drinking):
+                rows = model.objects.using(self.using).filter(user=self.user).aggregate(Max('id'), Count('id'))
+                parts.extend([str(rows['id__max']), str(rows['id__count'])])
+            self._version = ':'.join(parts)
+        return self._version
+
+    def key(self, name):
+        return 'charts:%s:%s:%s:%s' % (self.output, self.user, name, self.version())
+
+    def etag(self, name):
+        # also rolls over with the cache TIMEOUT so time-window charts move on
+        period = int(time.time() // self.cache.default_timeout) if self.cache.default_timeout else 0
+        return hashlib.md5(('%s:%s' % (self.key(name), period)).encode()).hexdigest()
+
+    def get(self, name, render):
+        key = self.key(name)
+        value = self.cache.get(key, MISSING)
+        if value is MISSING:
+            value = render()
+            self.cache.set(key, value)
+        return value
+
+    def get_cached(self, names):
+        """The cached charts of ``names``, name -> chart, missing names left out."""
+        keys = {name: self.key(name) for name in names}
+        cached = self.cache.get_many(list(keys.values()))
+        return {name: cached[key] for name, key in keys.items() if key in cached}
+
+    def set_many(self, charts):
+        self.cache.set_many({self.key(name): chart for name, chart in charts.items()})
+
+    def get_many(self, names, render_many):
+        """Charts of ``names``, the missing ones rendered together by ``render_many(missing_names)``."""
+        charts = self.get_cached(names)
+        missing = [name for name in names if name not in charts]
+        if missing:
+            rendered = render_many(missing)
+            self.set_many(rendered)
+            charts.update(rendered)
+        return charts
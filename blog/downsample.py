@@ -0,0 +1,64 @@
+import numpy as np
+
+# Reduce a time series to about ``n_out`` points before it becomes a scatter trace.
+# Every function returns the sorted indices of the points to keep, x must be sorted.
+METHODS = ['lttb', 'minmax']
+
+
+def lttb(x, y, n_out):
+    """Largest-triangle-three-buckets, keeps the first, the last and one point per bucket."""
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # relative float x, epoch microseconds lose precision in the triangle areas
+    x = (x - x[0]).astype(np.float64)
+    every = (n - 2) / (n_out - 2)
+    starts = (np.arange(n_out - 2) * every).astype(np.int64) + 1
+    stops = (np.arange(1, n_out - 1) * every).astype(np.int64) + 1
+    # mean of the following bucket of every bucket, the last one is followed by the last point
+    next_starts = np.append(stops[:-1], n - 1)
+    next_stops = np.append(stops[1:], n)
+    x_sums = np.concatenate([[0.0], np.cumsum(x)])
+    y_sums = np.concatenate([[0.0], np.cumsum(y)])
+    sizes = next_stops - next_starts
+    avg_x = (x_sums[next_stops] - x_sums[next_starts]) / sizes
+    avg_y = (y_sums[next_stops] - y_sums[next_starts]) / sizes
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0] = a = 0
+    for i in range(n_out - 2):
+        bx = x[starts[i]:stops[i]]
+        by = y[starts[i]:stops[i]]
+        area = np.abs((x[a] - avg_x[i]) * (by - y[a]) - (x[a] - bx) * (avg_y[i] - y[a]))
+        a = starts[i] + int(np.argmax(area))
+        kept[i + 1] = a
+    kept[-1] = n - 1
+    return kept
+
+
+def minmax(x, y, n_out):
+    """Minimum and maximum of every one of ``n_out // 2`` equally wide x buckets, plus both ends."""
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    n_buckets = (n_out - 2) // 2
+    span = int(x[-1] - x[0]) + 1
+    bucket = (x - x[0]).astype(np.int64) * n_buckets // span
+    # x is sorted, so every bucket is a contiguous run
+    firsts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    segment = np.repeat(np.arange(len(firsts)), np.diff(np.r_[firsts, n]))
+    kept = [[0, n - 1]]
+    for extreme in (np.minimum, np.maximum):
+        hits = np.flatnonzero(y == extreme.reduceat(y, firsts)[segment])
+        # first hit of every segment
+        kept.append(hits[np.r_[True, segment[hits][1:] != segment[hits][:-1]]])
+    return np.unique(np.concatenate(kept))
+
+
+def select(x, y, n_out, method='lttb'):
+    if method not in METHODS:
+        raise ValueError('downsampling must be one of %s, not %r' % (', '.join(METHODS), method))
+    return lttb(x, y, n_out) if method == 'lttb' else minmax(x, y, n_out)
@@ -0,0 +1,169 @@
+import csv
+import datetime
+import json
+import math
+import time
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Activity, Drinking
+from . import live, rollups, routers
+
+BATCH_SIZE = 2000
+FIELDS = ['timestamp', 'steps', 'pulse', 'alcohol']
+# the range of PositiveIntegerField on every backend, greater values abort the whole batch
+MAX_INTEGER = 2147483647
+
+
+class IngestResult(namedtuple('IngestResult', ['accepted', 'rejected', 'activities', 'drinks', 'seconds', 'errors'])):
+    @property
+    def rows_per_second(self):
+        rows = self.activities + self.drinks
+        return rows / self.seconds if self.seconds else float(rows)
+
+    def __str__(self):
+        return '%d accepted, %d rejected, %d rows in %.2f s (%.0f rows/s)' % (
+            self.accepted, self.rejected, self.activities + self.drinks, self.seconds, self.rows_per_second)
+
+
+def from_seconds(seconds):
+    try:
+        return datetime.datetime.fromtimestamp(seconds, timezone.utc)
+    except (OverflowError, OSError) as e:
+        raise ValueError('timestamp %r out of range' % seconds) from e
+
+
+def parse_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        t = value
+    elif isinstance(value, (int, float)):
+        return from_seconds(value)
+    else:
+        value = str(value).strip()
+        try:
+            seconds = float(value)
+        except ValueError:
+            t = parse_datetime(value)
+        else:
+            return from_seconds(seconds)
+        if t is None:
+            raise ValueError('invalid timestamp %r' % value)
+    return t if timezone.is_aware(t) else timezone.make_aware(t, timezone.utc)
+
+
+def parse_number(value, kind, maximum=None):
+    """``value`` as ``kind``, None when missing; ValueError unless finite, >= 0 and <= ``maximum``."""
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except OverflowError as e:
+        raise ValueError('invalid value %r' % value) from e
+    if not math.isfinite(number) or number < 0 or (maximum is not None and number > maximum):
+        raise ValueError('invalid value %r' % value)
+    return kind(number)
+
+
+def build_readings(record, user=None):
+    """Validated (Activity or None, Drinking or None) of one record with timestamp, steps, pulse and alcohol."""
+    user = record.get('user') or user
+    if user is None:
+        raise ValueError('missing user')
+    user = int(user)
+    if not 0 <= user <= MAX_INTEGER:
+        raise ValueError('invalid user %r' % user)
+    timestamp = parse_timestamp(record['timestamp'])
+    steps = parse_number(record.get('steps'), int, MAX_INTEGER)
+    pulse = parse_number(record.get('pulse'), float)
+    alcohol = parse_number(record.get('alcohol'), float)
+    if steps is None and pulse is None and alcohol is None:
+        raise ValueError('record without readings')
+    activity = None
+    if steps is not None or pulse is not None:
+        activity = Activity(user=user, timestamp=timestamp, steps=steps or 0, pulse=pulse or 0.0)
+    drinking = Drinking(user=user, timestamp=timestamp, alcohol=alcohol) if alcohol is not None else None
+    return activity, drinking
+
+
+def save_readings(activities, drinks, batch_size=BATCH_SIZE, using=None):
+    """Insert model instances with bulk_create in one transaction and update the rollups and live stats."""
+    using = using or routers.write_alias()
+    drinks = [d for d in drinks if d.alcohol is not None]
+    with transaction.atomic(using=using):
+        Activity.objects.using(using).bulk_create(activities, batch_size=batch_size)
+        Drinking.objects.using(using).bulk_create(drinks, batch_size=batch_size)
+        rollups.add_readings(activities, drinks, using=using)
+    live.ENGINE.add_readings(activities, drinks)
+    return len(activities), len(drinks)
+
+
+def ingest(records, user=None, batch_size=BATCH_SIZE, using=None, max_errors=20):
+    """Validate and store an iterable of reading records.
+
+    Records are dicts with ``timestamp`` (datetime, ISO 8601 or epoch seconds),
+    ``steps``, ``pulse`` and ``alcohol``, plus ``user`` unless given as argument.
+    Every ``batch_size`` valid records are written in their own transaction, so
+    ``records`` may be a generator of any length.
+    """
+    start = time.perf_counter()
+    accepted = rejected = activities_count = drinks_count = 0
+    errors = []
+    activities = []
+    drinks = []
+    for line, record in enumerate(records, 1):
+        try:
+            activity, drinking = build_readings(record, user)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            rejected += 1
+            if len(errors) < max_errors:
+                errors.append('record %d: %s' % (line, e))
+            continue
+        accepted += 1
+        if activity is not None:
+            activities.append(activity)
+        if drinking is not None:
+            drinks.append(drinking)
+        if len(activities) + len(drinks) >= batch_size:
+            saved = save_readings(activities, drinks, batch_size, using)
+            activities_count += saved[0]
+            drinks_count += saved[1]
+            activities = []
+            drinks = []
+    if activities or drinks:
+        saved = save_readings(activities, drinks, batch_size, using)
+        activities_count += saved[0]
+        drinks_count += saved[1]
+    return IngestResult(accepted, rejected, activities_count, drinks_count, time.perf_counter() - start, errors)
+
+
+def iter_csv(lines):
+    """Records of CSV lines, with a header row or in FIELDS order."""
+    lines = iter(lines)
+    for first in lines:
+        if first.strip():
+            break
+    else:
+        return
+    header = next(csv.reader([first]))
+    if 'timestamp' in header:
+        reader = csv.DictReader(lines, fieldnames=header)
+    else:
+        reader = csv.DictReader(lines, fieldnames=FIELDS)
+        yield dict(zip(FIELDS, header))
+    for row in reader:
+        yield row
+
+
+def iter_ndjson(lines):
+    """Records of newline-delimited JSON objects, an unparsable line yields None."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
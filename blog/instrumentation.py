@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# measurements in progress, every query is added to all of them
+_active = contextvars.ContextVar('blog_instrumentation_active', default=())
+# finished measurements of the current request, for the Server-Timing header
+_request = contextvars.ContextVar('blog_instrumentation_request', default=None)
+
+
+class Measurement:
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.bytes = None
+
+    def as_dict(self):
+        return {'name': self.name, 'seconds': self.seconds, 'cpu_seconds': self.cpu_seconds,
+                'queries': self.queries, 'db_seconds': self.db_seconds, 'bytes': self.bytes}
+
+    def server_timing(self):
+        desc = '%d queries, db %.1f ms, cpu %.1f ms' % (self.queries, self.db_seconds * 1000, self.cpu_seconds * 1000)
+        if self.bytes is not None:
+            desc += ', %d bytes' % self.bytes
+        return '%s;dur=%.1f;desc="%s"' % (self.name, self.seconds * 1000, desc)
+
+
+def output_size(result):
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    if hasattr(result, 'content') and not getattr(result, 'streaming', False):
+        return len(result.content)
+    return None
+
+
+@contextmanager
+def measure(name, cpu_clock=time.thread_time):
+    """Wall time, CPU time, query count and DB time of the block, logged as json.
+
+    CPU time is ``cpu_clock``, by default of the calling thread only.
+    """
+    m = Measurement(name)
+    token = _active.set(_active.get() + (m,))
+    start = time.perf_counter()
+    cpu_start = cpu_clock()
+    try:
+        yield m
+    finally:
+        m.seconds = time.perf_counter() - start
+        m.cpu_seconds = cpu_clock() - cpu_start
+        _active.reset(token)
+        timings = _request.get()
+        if timings is not None:
+            timings.append(m)
+        logger.info(json.dumps(m.as_dict()), extra={'timing': m.as_dict()})
+
+
+def instrumented(name=None):
+    """Decorator measuring every call, async functions count the CPU time of the whole process."""
+    def decorator(func):
+        label = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with measure(label, time.process_time) as m:
+                    result = await func(*args, **kwargs)
+                    m.bytes = output_size(result)
+                return result
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with measure(label) as m:
+                    result = func(*args, **kwargs)
+                    m.bytes = output_size(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def count_queries(execute, sql, params, many, context):
+    active = _active.get()
+    if not active:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - start
+        for m in active:
+            m.queries += 1
+            m.db_seconds += seconds
+
+
+def install(sender, connection, **kwargs):
+    # connected to connection_created, a reconnecting wrapper keeps its list
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def profile_path(request):
+    directory = getattr(settings, 'BLOG_PROFILE_DIR', None) or tempfile.gettempdir()
+    slug = re.sub(r'[^\w]+', '-', request.path).strip('-') or 'root'
+    return os.path.join(directory, '%s-%s-%d.prof' % (time.strftime('%Y%m%d-%H%M%S'), slug, os.getpid()))
+
+
+class ServerTimingMiddleware:
+    """Adds the measurements of the request as Server-Timing header.
+
+    With BLOG_PROFILE_REQUESTS every request is also run under cProfile and dumped
+    to BLOG_PROFILE_DIR, read the dumps with ``python -m pstats``. cProfile sees the
+    request thread only, not the chart rendering threads, and under ASGI the event
+    loop thread with whatever else it runs meanwhile.
+
+    Sync and async capable, so the async views keep running on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # lets Django see an async middleware, __call__ switches to __acall__
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timings, token, profile = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(request, token, profile)
+        return self.add_header(response, timings)
+
+    async def __acall__(self, request):
+        timings, token, profile = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(request, token, profile)
+        return self.add_header(response, timings)
+
+    def start(self):
+        timings = []
+        token = _request.set(timings)
+        profile = cProfile.Profile() if getattr(settings, 'BLOG_PROFILE_REQUESTS', False) else None
+        if profile is not None:
+            profile.enable()
+        return timings, token, profile
+
+    def stop(self, request, token, profile):
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(profile_path(request))
+        _request.reset(token)
+
+    def add_header(self, response, timings):
+        if timings:
+            response['Server-Timing'] = ', '.join(m.server_timing() for m in timings)
+        return response
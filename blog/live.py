@@ -0,0 +1,202 @@
+import datetime
+import threading
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Activity, Drinking
+from .timeseries import to_epoch, to_microseconds
+
+# bin width of the percentile histograms, percentiles are rounded to it
+RESOLUTION = {'steps': 1, 'pulse': 1.0, 'alcohol': 0.01}
+METRICS = {'steps': Activity, 'pulse': Activity, 'alcohol': Drinking}
+PERCENTILES = [50, 90, 99]
+
+Summary = namedtuple('Summary', ['count', 'mean', 'variance', 'min', 'max', 'percentiles'])
+
+
+def default_windows():
+    # the Visualizer minutes_delta and minutes_grid defaults plus a whole day
+    return [datetime.timedelta(minutes=m) for m in getattr(settings, 'BLOG_LIVE_WINDOWS', [15, 60, 1440])]
+
+
+class WindowStats:
+    """Count, mean, variance, min, max and percentiles of the readings of the last ``width`` microseconds.
+
+    Readings have to arrive in time order, ``add`` and expiring are O(1) amortized:
+    shifted running sums for mean and variance, monotonic deques for min and max,
+    a histogram of ``resolution`` wide bins for the percentiles.
+    """
+    def __init__(self, width, resolution):
+        self.width = width
+        self.resolution = resolution
+        self.readings = deque()
+        self.minima = deque()
+        self.maxima = deque()
+        self.bins = {}
+        self.shift = None
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    def bin(self, value):
+        return int(round(value / self.resolution))
+
+    def add(self, t, value):
+        self.expire(t)
+        if self.shift is None:
+            self.shift = value
+        self.readings.append((t, value))
+        d = value - self.shift
+        self.sum += d
+        self.sum_sq += d * d
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((t, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((t, value))
+        b = self.bin(value)
+        self.bins[b] = self.bins.get(b, 0) + 1
+
+    def expire(self, now):
+        cutoff = now - self.width
+        while self.readings and self.readings[0][0] <= cutoff:
+            _, value = self.readings.popleft()
+            d = value - self.shift
+            self.sum -= d
+            self.sum_sq -= d * d
+            b = self.bin(value)
+            self.bins[b] -= 1
+            if not self.bins[b]:
+                del self.bins[b]
+        for extremes in (self.minima, self.maxima):
+            while extremes and extremes[0][0] <= cutoff:
+                extremes.popleft()
+        if not self.readings:
+            # start over, the running sums drift
+            self.shift = None
+            self.sum = self.sum_sq = 0.0
+
+    def percentile(self, q):
+        rank = q / 100.0 * (len(self.readings) - 1)
+        seen = 0
+        for b in sorted(self.bins):
+            seen += self.bins[b]
+            if seen > rank:
+                return b * self.resolution
+        return None
+
+    def summary(self):
+        n = len(self.readings)
+        if not n:
+            return Summary(0, None, None, None, None, {q: None for q in PERCENTILES})
+        mean = self.sum / n
+        return Summary(n, self.shift + mean, max(self.sum_sq / n - mean * mean, 0.0),
+                       self.minima[0][1], self.maxima[0][1], {q: self.percentile(q) for q in PERCENTILES})
+
+
+class UserStats:
+    """WindowStats of every metric and window of one user, filled with the readings after ``since``."""
+    def __init__(self, windows, since):
+        self.windows = windows
+        self.since = since
+        # stored Activity and Drinking rows after since, another process wrote or deleted some when they differ
+        self.rows = {Activity: 0, Drinking: 0}
+        self.stats = {name: [WindowStats(to_microseconds(w), RESOLUTION[name]) for w in windows]
+                      for name in METRICS}
+        self.latest = {name: None for name in METRICS}
+        # readings older than the newest one of their metric, they are not counted
+        self.late = 0
+
+    def add(self, name, t, value):
+        if self.latest[name] is not None and t < self.latest[name]:
+            self.late += 1
+            return
+        self.latest[name] = t
+        for stats in self.stats[name]:
+            stats.add(t, value)
+
+    def add_activity(self, t, steps, pulse):
+        self.add('steps', t, steps)
+        self.add('pulse', t, pulse)
+
+    def summaries(self, now):
+        result = {}
+        for name, windows in self.stats.items():
+            result[name] = {}
+            for window, stats in zip(self.windows, windows):
+                stats.expire(now)
+                result[name][window] = stats.summary()
+        return result
+
+
+def stored_rows(user, since, using=None):
+    return {Activity: Activity.objects.using(using).filter(user=user, timestamp__gt=since).count(),
+            Drinking: Drinking.objects.using(using).filter(user=user, timestamp__gt=since,
+                                                           alcohol__isnull=False).count()}
+
+
+class LiveStats:
+    """Per-process sliding window statistics of the users someone asked for.
+
+    A user's windows are filled from the database on the first ``current`` call,
+    later readings of this process arrive through ``add_readings`` (signals and
+    ingest.save_readings). Every ``current`` call compares the rows counted since
+    with the stored ones and fills the windows again when another process wrote or
+    deleted readings; purges and imports ``forget`` the user.
+    """
+    def __init__(self, windows=None):
+        self.windows = windows or default_windows()
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def add_readings(self, activities=(), drinks=()):
+        with self.lock:
+            activities = sorted((a for a in activities if a.user in self.users), key=lambda a: a.timestamp)
+            drinks = sorted((d for d in drinks if d.user in self.users and d.alcohol is not None),
+                            key=lambda d: d.timestamp)
+            for model, readings in ((Activity, activities), (Drinking, drinks)):
+                for r in readings:
+                    stats = self.users[r.user]
+                    if r.timestamp > stats.since:
+                        stats.rows[model] += 1
+            for a, t in zip(activities, to_epoch([a.timestamp for a in activities]).tolist()):
+                self.users[a.user].add_activity(t, a.steps, a.pulse)
+            for d, t in zip(drinks, to_epoch([d.timestamp for d in drinks]).tolist()):
+                self.users[d.user].add('alcohol', t, d.alcohol)
+
+    def warm(self, user, now, using=None):
+        since = now - max(self.windows)
+        stats = UserStats(self.windows, since)
+        activities = list(Activity.objects.using(using).filter(user=user, timestamp__gt=since).
+                          order_by('timestamp').values_list('timestamp', 'steps', 'pulse'))
+        for (_, steps, pulse), t in zip(activities, to_epoch([a[0] for a in activities]).tolist()):
+            stats.add_activity(t, steps, pulse)
+        drinks = list(Drinking.objects.using(using).filter(user=user, timestamp__gt=since, alcohol__isnull=False).
+                      order_by('timestamp').values_list('timestamp', 'alcohol'))
+        for (_, alcohol), t in zip(drinks, to_epoch([d[0] for d in drinks]).tolist()):
+            stats.add('alcohol', t, alcohol)
+        stats.rows = {Activity: len(activities), Drinking: len(drinks)}
+        return stats
+
+    def current(self, user, now=None, using=None):
+        """{metric: {window: Summary}} of ``user`` at ``now``."""
+        now = now or timezone.now()
+        with self.lock:
+            stats = self.users.get(user)
+            rows = dict(stats.rows) if stats is not None else None
+        # counting from an old since gets slower, the windows start over past twice the widest one
+        if stats is None or stats.since < now - 2 * max(self.windows) or rows != stored_rows(user, stats.since, using):
+            stats = self.warm(user, now, using)
+            with self.lock:
+                self.users[user] = stats
+        with self.lock:
+            return stats.summaries(int(to_epoch([now])[0]))
+
+    def forget(self, user):
+        with self.lock:
+            self.users.pop(user, None)
+
+
+ENGINE = LiveStats()
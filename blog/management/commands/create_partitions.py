@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from blog import partitions, routers
+
+
+class Command(BaseCommand):
+    help = 'Create the monthly partitions of the readings tables ahead of time (MySQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3)
+        parser.add_argument('--database', default=routers.PRIMARY)
+        parser.add_argument('--dry-run', action='store_true', help='print the SQL instead of running it')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'mysql':
+            raise CommandError('Partitioning needs MySQL, %s is %s' % (options['database'], connection.vendor))
+        until = partitions.add_months(partitions.month_floor(timezone.now()), options['months_ahead'])
+        for table in partitions.TABLES:
+            existing = partitions.existing_partitions(connection, table)
+            if not existing:
+                raise CommandError('%s is not partitioned, run the blog migrations first' % table)
+            months = partitions.missing_months(existing, until)
+            for sql in partitions.add_partitions_sql(table, months):
+                if options['dry_run']:
+                    self.stdout.write(sql)
+                else:
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql)
+            self.stdout.write(self.style.SUCCESS('%s: %d partitions added, up to %s' % (
+                table, len(months), partitions.partition_name(until))))
@@ -0,0 +1,35 @@
+import datetime
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import archive
+
+
+def parse_month(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise CommandError('Invalid month %s, expected YYYY-MM' % value)
+
+
+class Command(BaseCommand):
+    help = 'Write Activity/Drinking readings as per-user, per-month column files (see blog.archive)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='files go to DIRECTORY/<user>/<YYYY-MM>.sband')
+        parser.add_argument('--user', type=int, action='append', help='only this user, may be repeated')
+        parser.add_argument('--month', action='append', help='only this YYYY-MM, may be repeated')
+        parser.add_argument('--compress', action='store_true', help='zlib compress the columns')
+        parser.add_argument('--database', help="the router's choice when omitted")
+
+    def handle(self, *args, **options):
+        months = [parse_month(m) for m in options['month']] if options['month'] else None
+        try:
+            paths = archive.export(options['directory'], users=options['user'], months=months,
+                                   compress=options['compress'], using=options['database'])
+        except ValueError as e:
+            raise CommandError(e)
+        for path in paths:
+            self.stdout.write('%s %d bytes' % (path, os.path.getsize(path)))
+        self.stdout.write(self.style.SUCCESS('%d months exported' % len(paths)))
@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+import data_generator
+
+
+class Command(BaseCommand):
+    help = 'Generate reproducible random readings for load tests into the database, a CSV or a Parquet file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[1])
+        parser.add_argument('--readings', type=int, default=100000, help='readings per user')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=50000)
+        parser.add_argument('--output', help='.csv or .parquet file, the database when omitted')
+        parser.add_argument('--database', help='the primary of blog.routers when omitted')
+
+    def chunks(self, options):
+        stop = timezone.now()
+        start = stop - timedelta(days=options['days'])
+        for user in options['users']:
+            gen = data_generator.DataGenerator(user, start, stop)
+            # a seed per user keeps every user's data the same whatever the user list
+            yield from gen.iter_chunks(options['readings'], options['chunk_size'], seed=options['seed'] + user)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        output = options['output']
+        if output is None:
+            rows = data_generator.save_chunks(self.chunks(options), using=options['database'])
+        elif output.endswith('.csv'):
+            with open(output, 'w', newline='') as f:
+                rows = data_generator.write_csv(self.chunks(options), f)
+        elif output.endswith('.parquet'):
+            try:
+                rows = data_generator.write_parquet(self.chunks(options), output)
+            except ImportError:
+                raise CommandError('Parquet output needs pyarrow')
+        else:
+            raise CommandError('Unknown output format %s' % output)
+        seconds = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS('%d rows in %.2f s (%.0f rows/s)' % (rows, seconds, rows / seconds)))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import archive, ingest
+
+
+class Command(BaseCommand):
+    help = 'Load readings back from column files written by export_readings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='.sband files')
+        parser.add_argument('--replace', action='store_true',
+                            help='delete the readings of the month first instead of refusing')
+        parser.add_argument('--batch-size', type=int, default=ingest.BATCH_SIZE)
+        parser.add_argument('--database', help='the primary of blog.routers when omitted')
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            try:
+                saved = archive.import_month(path, replace=options['replace'], batch_size=options['batch_size'],
+                                             using=options['database'])
+            except (OSError, ValueError) as e:
+                raise CommandError('%s: %s' % (path, e))
+            self.stdout.write(self.style.SUCCESS('%s: %d readings saved' % (path, saved)))
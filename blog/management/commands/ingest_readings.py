@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import ingest
+
+PARSERS = {'csv': ingest.iter_csv, 'ndjson': ingest.iter_ndjson}
+
+
+class Command(BaseCommand):
+    help = 'Bulk load smartband readings from CSV or NDJSON files (timestamp, steps, pulse, alcohol[, user])'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="files to load, '-' reads stdin")
+        parser.add_argument('--user', type=int, help='user of records without a user column')
+        parser.add_argument('--format', choices=['auto'] + list(PARSERS), default='auto')
+        parser.add_argument('--batch-size', type=int, default=ingest.BATCH_SIZE)
+        parser.add_argument('--database', help='the primary of blog.routers when omitted')
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            fmt = options['format']
+            if fmt == 'auto':
+                fmt = 'csv' if path.endswith('.csv') else 'ndjson'
+            if path == '-':
+                result = self.load(sys.stdin, fmt, options)
+            else:
+                try:
+                    with open(path, newline='', encoding='utf-8') as f:
+                        result = self.load(f, fmt, options)
+                except OSError as e:
+                    raise CommandError(e)
+            for error in result.errors:
+                self.stderr.write(error)
+            self.stdout.write(self.style.SUCCESS('%s: %s' % (path, result)))
+
+    def load(self, f, fmt, options):
+        return ingest.ingest(PARSERS[fmt](f), user=options['user'],
+                             batch_size=options['batch_size'], using=options['database'])
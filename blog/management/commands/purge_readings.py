@@ -0,0 +1,57 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from blog import purge
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError('Invalid date %s' % value)
+        moment = datetime.datetime.combine(day, datetime.time())
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment, timezone.utc)
+
+
+class Command(BaseCommand):
+    help = 'Delete Activity/Drinking readings in bounded chunks, by user and time range or by retention policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', choices=['all'] + list(purge.TABLES), default='all')
+        parser.add_argument('--user', type=int)
+        parser.add_argument('--before', help='delete readings before this date/datetime')
+        parser.add_argument('--after', help='delete readings at or after this date/datetime')
+        parser.add_argument('--older-than-days', type=int,
+                            help='retention: drop raw readings older than N days that are in the rollups')
+        parser.add_argument('--all', action='store_true', help='allow deleting without any filter')
+        parser.add_argument('--chunk-size', type=int, default=purge.CHUNK_SIZE)
+        parser.add_argument('--database', help='the primary of blog.routers when omitted')
+
+    def handle(self, *args, **options):
+        retention = options['older_than_days'] is not None
+        filters = [options['user'], options['before'], options['after']]
+        if retention and any(f is not None for f in filters):
+            raise CommandError('--older-than-days cannot be combined with --user/--before/--after')
+        if not retention and all(f is None for f in filters) and not options['all']:
+            raise CommandError('Refusing to delete every reading without --all')
+        tables = purge.TABLES if options['table'] == 'all' else {options['table']: purge.TABLES[options['table']]}
+        for name, model in tables.items():
+            def progress(deleted, seconds):
+                self.stdout.write('%s: %d rows deleted (%.0f rows/s)' % (name, deleted, deleted / seconds))
+
+            if retention:
+                result = purge.retention(model, options['older_than_days'], chunk_size=options['chunk_size'],
+                                         using=options['database'], progress=progress)
+                for user, day in result.skipped_days:
+                    self.stderr.write('%s: kept user %s on %s, not in the rollups' % (name, user, day.date()))
+            else:
+                result = purge.purge(model, user=options['user'],
+                                     before=parse_moment(options['before']) if options['before'] else None,
+                                     after=parse_moment(options['after']) if options['after'] else None,
+                                     chunk_size=options['chunk_size'], using=options['database'],
+                                     progress=progress)
+            self.stdout.write(self.style.SUCCESS('%s: %s' % (name, result)))
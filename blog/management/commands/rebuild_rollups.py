@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from blog import rollups
+
+
+class Command(BaseCommand):
+    help = ('Recompute the hourly and daily rollups and the weekly heatmap cells from the raw '
+            'Activity/Drinking readings, also the backfill after adding a BLOG_WEEKLY_GRIDS entry')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='only rebuild this user')
+        parser.add_argument('--database', help='the primary of blog.routers when omitted')
+
+    def handle(self, *args, **options):
+        rollups.rebuild(user=options['user'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS('Rollups rebuilt'))
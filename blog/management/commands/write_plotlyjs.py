@@ -0,0 +1,17 @@
+import os
+
+import plotly
+from django.core.management.base import BaseCommand
+
+PLOTLYJS_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'static', 'blog', 'js', 'plotly.min.js')
+
+
+class Command(BaseCommand):
+    help = 'Write the plotly.js bundle of the installed plotly package to blog/static/blog/js'
+
+    def handle(self, *args, **options):
+        path = os.path.normpath(PLOTLYJS_PATH)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(plotly.offline.get_plotlyjs())
+        self.stdout.write(self.style.SUCCESS('Wrote %s' % path))
@@ -0,0 +1,268 @@
+import json
+import time
+from collections import namedtuple
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Activity, AnalysisState, Drinking, DrinkWindow
+from . import binning, routers
+from .timeseries import from_epoch, to_epoch, window_sums
+
+# activity of at most this many time ranges is fetched in one query, closer windows are merged
+MAX_RANGES = 50
+CHUNK_SIZE = 1000
+# Concurrent transactions commit their readings out of id order, so ids above a mark
+# already joined are kept as runs and the mark only passes a run SETTLE_AFTER seconds
+# after it was seen. A transaction committing later than that is missed until forget().
+SETTLE_AFTER = 60
+# the lowest runs are bridged beyond this many, their gaps are the least likely in flight
+MAX_RUNS = 1000
+
+Analysis = namedtuple('Analysis', ['activity_count', 'drinking_count', 'grid2d', 'grid3d', 'recomputed'])
+
+
+def merge_ranges(centers, half_width, max_ranges=MAX_RANGES):
+    """[start, stop] microsecond ranges covering every window around the sorted ``centers``."""
+    if not len(centers):
+        return []
+    starts = np.asarray(centers, dtype=np.int64) - half_width
+    stops = np.asarray(centers, dtype=np.int64) + half_width
+    gap = 0
+    while True:
+        # a window starting after the ones before it stopped (plus gap) opens a new range
+        opens = np.r_[True, starts[1:] > np.maximum.accumulate(stops)[:-1] + gap]
+        if np.count_nonzero(opens) <= max_ranges:
+            break
+        gap = max(2 * gap, half_width)
+    firsts = np.flatnonzero(opens)
+    lasts = np.r_[firsts[1:], len(starts)] - 1
+    return list(zip(starts[firsts].tolist(), np.maximum.accumulate(stops)[lasts].tolist()))
+
+
+def window_rows(user, half_width, drinks, using):
+    """DrinkWindow rows of ``drinks``, (id, timestamp, alcohol) tuples sorted by timestamp."""
+    centers = to_epoch([t for _, t, _ in drinks])
+    ranges = Q()
+    for start, stop in merge_ranges(centers, half_width):
+        ranges |= Q(timestamp__range=(from_epoch(start), from_epoch(stop)))
+    activity = list(Activity.objects.using(using).filter(ranges, user=user).order_by('timestamp').
+                    values_list('timestamp', 'steps', 'pulse'))
+    act_timestamps = to_epoch([a[0] for a in activity])
+    counts, steps_sum = window_sums(centers, act_timestamps, np.array([a[1] for a in activity], dtype=np.int64),
+                                    half_width)
+    _, pulse_sum = window_sums(centers, act_timestamps, np.array([a[2] for a in activity], dtype=np.float64),
+                               half_width)
+    rows = []
+    for (drinking_id, timestamp, alcohol), count, steps, pulse in zip(drinks, counts.tolist(), steps_sum.tolist(),
+                                                                      pulse_sum.tolist()):
+        rows.append(DrinkWindow(user=user, half_width=half_width, drinking_id=drinking_id, timestamp=timestamp,
+                                alcohol=alcohol, activity_count=count,
+                                steps_mean=steps / count if count else None,
+                                pulse_mean=pulse / count if count else None))
+    return rows
+
+
+def stale_windows(user, half_width, act_timestamps, using):
+    """(id, timestamp, alcohol) of the materialized drinks with new activity in their window."""
+    if not len(act_timestamps):
+        return []
+    candidates = list(DrinkWindow.objects.using(using).filter(
+        user=user, half_width=half_width,
+        timestamp__range=(from_epoch(act_timestamps[0] - half_width), from_epoch(act_timestamps[-1] + half_width))).
+        values_list('drinking_id', 'timestamp', 'alcohol'))
+    centers = to_epoch([c[1] for c in candidates])
+    left = np.searchsorted(act_timestamps, centers - half_width, side='left')
+    right = np.searchsorted(act_timestamps, centers + half_width, side='right')
+    return [c for c, hit in zip(candidates, (right > left).tolist()) if hit]
+
+
+def rewrite_windows(user, half_width, drinks, stale_ids, using):
+    """Replace the DrinkWindow rows of ``stale_ids`` by new ones of the (id, timestamp, alcohol) ``drinks``."""
+    drinks = sorted(drinks, key=lambda d: d[1])
+    rows = window_rows(user, half_width, drinks, using) if drinks else []
+    delete_windows(half_width, stale_ids, using)
+    DrinkWindow.objects.using(using).bulk_create(rows, batch_size=CHUNK_SIZE)
+
+
+def delete_windows(half_width, drinking_ids, using):
+    for i in range(0, len(drinking_ids), CHUNK_SIZE):
+        DrinkWindow.objects.using(using).filter(half_width=half_width,
+                                                drinking_id__in=drinking_ids[i:i + CHUNK_SIZE]).delete()
+
+
+def add_runs(runs, ids, seen_at):
+    """``runs`` plus the [first, last, seen_at] runs of consecutive sorted ``ids``, sorted and bridged to MAX_RUNS."""
+    runs = [list(r) for r in runs]
+    for i in ids:
+        if runs and runs[-1][2] == seen_at and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i, seen_at])
+    runs.sort()
+    if len(runs) > MAX_RUNS:
+        bridged = runs[:len(runs) - MAX_RUNS + 1]
+        runs[:len(bridged)] = [[bridged[0][0], max(r[1] for r in bridged), max(r[2] for r in bridged)]]
+    return runs
+
+
+def in_runs(ids, runs):
+    """Mask of the ``ids`` within one of the sorted, disjoint ``runs``."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not runs:
+        return np.zeros(len(ids), dtype=bool)
+    firsts = np.array([r[0] for r in runs], dtype=np.int64)
+    lasts = np.array([r[1] for r in runs], dtype=np.int64)
+    index = np.searchsorted(firsts, ids, side='right') - 1
+    return (index >= 0) & (ids <= lasts[np.maximum(index, 0)])
+
+
+def settle(mark, runs, now):
+    """(mark, runs) with the mark moved past the runs seen at least SETTLE_AFTER seconds ago."""
+    settled = [r[1] for r in runs if now - r[2] >= SETTLE_AFTER]
+    mark = max([mark] + settled)
+    return mark, [r for r in runs if r[1] > mark]
+
+
+def unseen(model, fields, user, mark, runs, using):
+    """(id, *fields) of the readings of ``user`` above ``mark`` outside ``runs``."""
+    rows = list(model.objects.using(using).filter(user=user, id__gt=mark).values_list('id', *fields))
+    seen = in_runs([r[0] for r in rows], runs)
+    return [r for r, s in zip(rows, seen.tolist()) if not s]
+
+
+def advance(state, now, activity_ids=(), drinking_ids=()):
+    marks = {}
+    for name, ids in (('activity', activity_ids), ('drinking', drinking_ids)):
+        runs = add_runs(json.loads(getattr(state, name + '_seen')), sorted(ids), now)
+        mark, runs = settle(getattr(state, name + '_id'), runs, now)
+        marks[name + '_id'], marks[name + '_seen'] = mark, json.dumps(runs)
+    moved = any(getattr(state, field) != value for field, value in marks.items())
+    for field, value in marks.items():
+        setattr(state, field, value)
+    return moved
+
+
+def materialize(state, using, now=None):
+    """Bring the DrinkWindow rows of ``state`` up to the newest readings, True if any changed."""
+    user, half_width = state.user, state.half_width
+    now = time.time() if now is None else now
+    new_activity = sorted(unseen(Activity, ['timestamp'], user, state.activity_id, json.loads(state.activity_seen),
+                                 using), key=lambda a: a[1])
+    new_drinks = unseen(Drinking, ['timestamp', 'alcohol'], user, state.drinking_id, json.loads(state.drinking_seen),
+                        using)
+    if not new_activity and not new_drinks:
+        return False
+    stale = stale_windows(user, half_width, to_epoch([a[1] for a in new_activity]), using)
+    rewrite_windows(user, half_width, stale + [d for d in new_drinks if d[2] is not None],
+                    [d[0] for d in stale], using)
+    advance(state, now, [a[0] for a in new_activity], [d[0] for d in new_drinks])
+    state.activity_count += len(new_activity)
+    state.drinking_count += len(new_drinks)
+    newest = max([a[1] for a in new_activity[-1:]] + [d[1] for d in new_drinks])
+    state.watermark = max(state.watermark, newest) if state.watermark else newest
+    return True
+
+
+def grids(user, half_width, grid_alcohol, grid_steps, using):
+    # sorted like the drinks plot_analysis joins, binning.grid2d keeps the first-seen order
+    triples = list(DrinkWindow.objects.using(using).filter(user=user, half_width=half_width, activity_count__gt=0).
+                   order_by('alcohol', 'timestamp', 'drinking_id').values_list('alcohol', 'steps_mean', 'pulse_mean'))
+    x, y, z = (list(column) for column in zip(*triples)) if triples else ([], [], [])
+    new_x, new_y, new_z = binning.grid3d(x, y, z, grid_alcohol, grid_steps)
+    return binning.grid2d(x, y, grid_alcohol), (new_x.tolist(), new_y.tolist(), new_z.tolist())
+
+
+def update(user, half_width, grid_alcohol, grid_steps, using=None, now=None):
+    """The analysis of ``user``, recomputing only what readings newer than the high-water marks touch.
+
+    New drinks get a DrinkWindow row, materialized drinks get theirs recomputed when
+    new activity falls into their window. The grids are recomputed from the stored
+    triples only when those or the grid widths changed.
+    """
+    using = using or routers.write_alias()
+    now = time.time() if now is None else now
+    with transaction.atomic(using=using):
+        # the row lock serializes concurrent updates of one user
+        state, _ = AnalysisState.objects.using(using).select_for_update().get_or_create(user=user,
+                                                                                       half_width=half_width)
+        changed = materialize(state, using, now)
+        # without new readings the runs of earlier ones may still settle
+        moved = changed or advance(state, now)
+        recomputed = changed or not state.grid2d or (state.grid_alcohol, state.grid_steps) != (grid_alcohol, grid_steps)
+        if recomputed:
+            grid2d, grid3d = grids(user, half_width, grid_alcohol, grid_steps, using)
+            state.grid_alcohol, state.grid_steps = grid_alcohol, grid_steps
+            state.grid2d, state.grid3d = json.dumps(grid2d), json.dumps(grid3d)
+        if recomputed or moved:
+            state.save()
+    grid3d = json.loads(state.grid3d)
+    return Analysis(state.activity_count, state.drinking_count, json.loads(state.grid2d),
+                    (np.array(grid3d[0]), np.array(grid3d[1]), np.array(grid3d[2], dtype=np.float64)), recomputed)
+
+
+def remove_readings(user, model, readings, using=None):
+    """Take deleted Activity or Drinking ``readings`` of ``user`` out of the materialized analysis.
+
+    Only readings already joined count, the windows of deleted drinks are dropped and
+    the ones with deleted activity recomputed; the grids follow on the next update.
+    """
+    using = using or routers.write_alias()
+    with transaction.atomic(using=using):
+        for state in AnalysisState.objects.using(using).select_for_update().filter(user=user):
+            name = 'activity' if model is Activity else 'drinking'
+            ids = np.array([r.pk for r in readings], dtype=np.int64)
+            joined = (ids <= getattr(state, name + '_id')) | in_runs(ids, json.loads(getattr(state, name + '_seen')))
+            removed = [r for r, j in zip(readings, joined.tolist()) if j]
+            if model is Activity:
+                timestamps = to_epoch(sorted(r.timestamp for r in removed))
+                stale = stale_windows(user, state.half_width, timestamps, using)
+                rewrite_windows(user, state.half_width, stale, [d[0] for d in stale], using)
+                state.activity_count -= len(removed)
+            else:
+                delete_windows(state.half_width, [r.pk for r in removed], using)
+                state.drinking_count -= len(removed)
+            state.grid2d = ''
+            state.save()
+
+
+def restore_readings(user, model, readings, using=None, now=None):
+    """Count saved ``readings`` of ``user`` that retention had dropped as joined already.
+
+    Their activity is still in the counts and windows, the DrinkWindow rows of the
+    dropped drinks move to the restored ones at the same timestamp. Restored drinks
+    without such a row are left to the next update.
+    """
+    using = using or routers.write_alias()
+    now = time.time() if now is None else now
+    with transaction.atomic(using=using):
+        for state in AnalysisState.objects.using(using).select_for_update().filter(user=user):
+            if model is Activity:
+                advance(state, now, activity_ids=[r.pk for r in readings])
+                state.save()
+                continue
+            joined = []
+            for i in range(0, len(readings), CHUNK_SIZE):
+                chunk = readings[i:i + CHUNK_SIZE]
+                windows = DrinkWindow.objects.using(using).filter(
+                    user=user, half_width=state.half_width, timestamp__in={r.timestamp for r in chunk}).exclude(
+                    drinking_id__in=Drinking.objects.using(using).filter(user=user).values('id'))
+                orphans = {}
+                for pk, timestamp in windows.values_list('pk', 'timestamp'):
+                    orphans.setdefault(timestamp, []).append(pk)
+                for drinking in chunk:
+                    if orphans.get(drinking.timestamp):
+                        DrinkWindow.objects.using(using).filter(pk=orphans[drinking.timestamp].pop()).update(
+                            drinking_id=drinking.pk)
+                        joined.append(drinking.pk)
+            advance(state, now, drinking_ids=joined)
+            state.save()
+
+
+def forget(user, using=None):
+    """Drop the materialized analysis of ``user``, the next update starts from scratch."""
+    using = using or routers.write_alias()
+    with transaction.atomic(using=using):
+        DrinkWindow.objects.using(using).filter(user=user).delete()
+        AnalysisState.objects.using(using).filter(user=user).delete()
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_activity_drinking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.PositiveIntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('activity_count', models.PositiveIntegerField(default=0)),
+                ('steps_sum', models.BigIntegerField(default=0)),
+                ('steps_sq', models.BigIntegerField(default=0)),
+                ('pulse_sum', models.FloatField(default=0.0)),
+                ('pulse_sq', models.FloatField(default=0.0)),
+                ('drinking_count', models.PositiveIntegerField(default=0)),
+                ('alcohol_sum', models.FloatField(default=0.0)),
+                ('alcohol_sq', models.FloatField(default=0.0)),
+            ],
+            options={
+                'abstract': False,
+                'unique_together': {('user', 'timestamp')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.PositiveIntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('activity_count', models.PositiveIntegerField(default=0)),
+                ('steps_sum', models.BigIntegerField(default=0)),
+                ('steps_sq', models.BigIntegerField(default=0)),
+                ('pulse_sum', models.FloatField(default=0.0)),
+                ('pulse_sq', models.FloatField(default=0.0)),
+                ('drinking_count', models.PositiveIntegerField(default=0)),
+                ('alcohol_sum', models.FloatField(default=0.0)),
+                ('alcohol_sq', models.FloatField(default=0.0)),
+            ],
+            options={
+                'abstract': False,
+                'unique_together': {('user', 'timestamp')},
+            },
+        ),
+    ]
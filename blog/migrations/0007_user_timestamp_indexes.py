@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', 'timestamp', 'steps', 'pulse'], name='activity_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drinking',
+            index=models.Index(fields=['user', 'timestamp', 'alcohol'], name='drinking_user_time_idx'),
+        ),
+    ]
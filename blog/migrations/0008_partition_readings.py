@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.utils import timezone
+
+from blog import partitions
+
+MONTHS_AHEAD = 3
+
+
+def partition_readings(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'mysql':
+        return
+    now = timezone.now()
+    for table in partitions.TABLES:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT MIN(timestamp) FROM %s' % table)
+            first = cursor.fetchone()[0] or now
+        months = list(partitions.months_between(first, partitions.add_months(partitions.month_floor(now), MONTHS_AHEAD)))
+        for sql in partitions.partition_table_sql(table, months):
+            schema_editor.execute(sql)
+
+
+def unpartition_readings(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table in partitions.TABLES:
+        for sql in partitions.unpartition_table_sql(table):
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_user_timestamp_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_readings, unpartition_readings),
+    ]
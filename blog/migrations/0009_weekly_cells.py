@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_partition_readings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyCell',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.PositiveIntegerField()),
+                ('activity_count', models.PositiveIntegerField(default=0)),
+                ('steps_sum', models.BigIntegerField(default=0)),
+                ('steps_sq', models.BigIntegerField(default=0)),
+                ('pulse_sum', models.FloatField(default=0.0)),
+                ('pulse_sq', models.FloatField(default=0.0)),
+                ('drinking_count', models.PositiveIntegerField(default=0)),
+                ('alcohol_sum', models.FloatField(default=0.0)),
+                ('alcohol_sq', models.FloatField(default=0.0)),
+                ('grid_minutes', models.PositiveIntegerField()),
+                ('weekday', models.PositiveSmallIntegerField()),
+                ('slot', models.PositiveSmallIntegerField()),
+            ],
+            options={
+                'unique_together': {('user', 'grid_minutes', 'weekday', 'slot')},
+            },
+        ),
+    ]
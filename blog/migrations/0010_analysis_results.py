@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_weekly_cells'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.PositiveIntegerField()),
+                ('output', models.CharField(default='div', max_length=10)),
+                ('version', models.CharField(blank=True, max_length=200)),
+                ('charts', models.TextField(default='{}')),
+                ('status', models.CharField(choices=[('idle', 'idle'), ('running', 'running')], default='idle', max_length=10)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('seconds', models.FloatField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'unique_together': {('user', 'output')},
+            },
+        ),
+    ]
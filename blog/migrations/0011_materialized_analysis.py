@@ -0,0 +1,57 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_analysis_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.PositiveIntegerField()),
+                ('half_width', models.BigIntegerField()),
+                ('activity_id', models.BigIntegerField(default=0)),
+                ('drinking_id', models.BigIntegerField(default=0)),
+                ('activity_count', models.BigIntegerField(default=0)),
+                ('drinking_count', models.BigIntegerField(default=0)),
+                ('watermark', models.DateTimeField(blank=True, null=True)),
+                ('grid_alcohol', models.FloatField(blank=True, null=True)),
+                ('grid_steps', models.FloatField(blank=True, null=True)),
+                ('grid2d', models.TextField(blank=True)),
+                ('grid3d', models.TextField(blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DrinkWindow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.PositiveIntegerField()),
+                ('half_width', models.BigIntegerField()),
+                ('drinking_id', models.BigIntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('alcohol', models.FloatField()),
+                ('activity_count', models.PositiveIntegerField(default=0)),
+                ('steps_mean', models.FloatField(blank=True, null=True)),
+                ('pulse_mean', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='drinkwindow',
+            index=models.Index(fields=['user', 'half_width', 'timestamp'], name='drinkwindow_user_time_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='drinkwindow',
+            unique_together={('half_width', 'drinking_id')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='analysisstate',
+            unique_together={('user', 'half_width')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_materialized_analysis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='failed_version',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+    ]
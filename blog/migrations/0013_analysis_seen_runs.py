@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_analysis_failed_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisstate',
+            name='activity_seen',
+            field=models.TextField(default='[]'),
+        ),
+        migrations.AddField(
+            model_name='analysisstate',
+            name='drinking_seen',
+            field=models.TextField(default='[]'),
+        ),
+    ]
@@ -39,6 +39,11 @@ class Activity(models.Model):
     steps = models.PositiveIntegerField(default=0)
     pulse = models.FloatField(default=0.0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp', 'steps', 'pulse'], name='activity_user_time_idx'),
+        ]
+
     def datetime(self):
         return self.timestamp.strftime("%Y.%m.%d %H:%M:%S")
 
@@ -52,9 +57,152 @@ class Drinking(models.Model):
     timestamp = models.DateTimeField()
     alcohol = models.FloatField(default=0.0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp', 'alcohol'], name='drinking_user_time_idx'),
+        ]
+
     def datetime(self):
         return self.timestamp.strftime("%Y.%m.%d %H:%M:%S")
 
     def __str__(self):
         d = {'user': self.user, 'datetime': self.datetime(), 'alcohol': self.alcohol}
-        return str(d)
\ No newline at end of file
+        return str(d)
+
+
+class ReadingStats(models.Model):
+    user = models.PositiveIntegerField()
+    activity_count = models.PositiveIntegerField(default=0)
+    steps_sum = models.BigIntegerField(default=0)
+    steps_sq = models.BigIntegerField(default=0)
+    pulse_sum = models.FloatField(default=0.0)
+    pulse_sq = models.FloatField(default=0.0)
+    drinking_count = models.PositiveIntegerField(default=0)
+    alcohol_sum = models.FloatField(default=0.0)
+    alcohol_sq = models.FloatField(default=0.0)
+
+    class Meta:
+        abstract = True
+
+    def count(self, name):
+        return self.drinking_count if name == 'alcohol' else self.activity_count
+
+    def mean(self, name):
+        count = self.count(name)
+        return getattr(self, name + '_sum') / count if count else None
+
+
+class Rollup(ReadingStats):
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        abstract = True
+        unique_together = ('user', 'timestamp')
+
+    def __str__(self):
+        d = {'user': self.user, 'timestamp': self.timestamp.strftime("%Y.%m.%d %H:%M:%S"),
+             'activity_count': self.activity_count, 'drinking_count': self.drinking_count}
+        return str(d)
+
+
+class HourlyRollup(Rollup):
+    class Meta(Rollup.Meta):
+        pass
+
+
+class DailyRollup(Rollup):
+    class Meta(Rollup.Meta):
+        pass
+
+
+class WeeklyCell(ReadingStats):
+    grid_minutes = models.PositiveIntegerField()
+    weekday = models.PositiveSmallIntegerField()
+    slot = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('user', 'grid_minutes', 'weekday', 'slot')
+
+    def __str__(self):
+        d = {'user': self.user, 'grid_minutes': self.grid_minutes, 'weekday': self.weekday, 'slot': self.slot,
+             'activity_count': self.activity_count, 'drinking_count': self.drinking_count}
+        return str(d)
+
+
+class AnalysisResult(models.Model):
+    IDLE = 'idle'
+    RUNNING = 'running'
+    STATUSES = [(IDLE, 'idle'), (RUNNING, 'running')]
+
+    user = models.PositiveIntegerField()
+    output = models.CharField(max_length=10, default='div')
+    # ChartCache version of the readings the charts were rendered from
+    version = models.CharField(max_length=200, blank=True)
+    charts = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUSES, default=IDLE)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    seconds = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # ChartCache version the last job failed on, not retried until the readings change
+    failed_version = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'output')
+
+    def __str__(self):
+        d = {'user': self.user, 'output': self.output, 'status': self.status, 'finished': self.finished}
+        return str(d)
+
+
+class DrinkWindow(models.Model):
+    """Mean steps and pulse of the activity within half_width microseconds of one drink."""
+    user = models.PositiveIntegerField()
+    half_width = models.BigIntegerField()
+    drinking_id = models.BigIntegerField()
+    timestamp = models.DateTimeField()
+    alcohol = models.FloatField()
+    # 0 while the window has no activity, the means are None then
+    activity_count = models.PositiveIntegerField(default=0)
+    steps_mean = models.FloatField(null=True, blank=True)
+    pulse_mean = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('half_width', 'drinking_id')
+        indexes = [
+            models.Index(fields=['user', 'half_width', 'timestamp'], name='drinkwindow_user_time_idx'),
+        ]
+
+    def __str__(self):
+        d = {'user': self.user, 'drinking_id': self.drinking_id, 'alcohol': self.alcohol,
+             'steps_mean': self.steps_mean, 'pulse_mean': self.pulse_mean}
+        return str(d)
+
+
+class AnalysisState(models.Model):
+    """How far the DrinkWindow rows of a user are materialized, plus the grids computed from them."""
+    user = models.PositiveIntegerField()
+    half_width = models.BigIntegerField()
+    # high-water marks, readings with a greater id are not in the DrinkWindow rows yet
+    # unless within the json [first id, last id, seen at] runs of *_seen
+    activity_id = models.BigIntegerField(default=0)
+    drinking_id = models.BigIntegerField(default=0)
+    activity_seen = models.TextField(default='[]')
+    drinking_seen = models.TextField(default='[]')
+    activity_count = models.BigIntegerField(default=0)
+    drinking_count = models.BigIntegerField(default=0)
+    # newest reading timestamp seen, for display
+    watermark = models.DateTimeField(null=True, blank=True)
+    grid_alcohol = models.FloatField(null=True, blank=True)
+    grid_steps = models.FloatField(null=True, blank=True)
+    grid2d = models.TextField(blank=True)
+    grid3d = models.TextField(blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'half_width')
+
+    def __str__(self):
+        d = {'user': self.user, 'half_width': self.half_width, 'watermark': self.watermark,
+             'activity_count': self.activity_count, 'drinking_count': self.drinking_count}
+        return str(d)
@@ -0,0 +1,109 @@
+import bisect
+import datetime
+
+# Monthly RANGE partitions of the readings tables on MySQL. Partition pYYYYMM holds the
+# month starting at its name, pmax catches everything after the last planned month.
+TABLES = ['blog_activity', 'blog_drinking']
+MAXVALUE = 'pmax'
+
+
+def month_floor(moment):
+    return datetime.date(moment.year, moment.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return 'p%04d%02d' % (month.year, month.month)
+
+
+def partition_month(name):
+    return datetime.date(int(name[1:5]), int(name[5:7]), 1)
+
+
+def months_between(first, last):
+    month = month_floor(first)
+    while month <= month_floor(last):
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_for(moment, existing):
+    """Partition of ``existing`` a reading at ``moment`` is stored in."""
+    month = month_floor(moment)
+    months = sorted(partition_month(name) for name in existing if name != MAXVALUE)
+    index = bisect.bisect_left(months, month)
+    if index < len(months):
+        return partition_name(months[index])
+    return MAXVALUE if MAXVALUE in existing else None
+
+
+def partitions_for_range(start, stop, existing):
+    """Names of the ``existing`` partitions a timestamp range query touches, as MySQL prunes it."""
+    months = sorted(partition_month(name) for name in existing if name != MAXVALUE)
+    if not months:
+        return [MAXVALUE] if MAXVALUE in existing else []
+    # everything before the first partition lands in it, everything after the last in pmax
+    first = max(month_floor(start), months[0])
+    last = min(month_floor(stop), add_months(months[-1], 1))
+    names = []
+    for month in months_between(first, last):
+        name = partition_for(month, existing)
+        if name is not None and name not in names:
+            names.append(name)
+    return names
+
+
+def partition_definition(month):
+    return "PARTITION %s VALUES LESS THAN (TO_DAYS('%s'))" % (partition_name(month), add_months(month, 1).isoformat())
+
+
+def maxvalue_definition():
+    return 'PARTITION %s VALUES LESS THAN MAXVALUE' % MAXVALUE
+
+
+def partition_table_sql(table, months):
+    """Statements turning ``table`` into a monthly partitioned table covering ``months``.
+
+    MySQL wants the partitioning column in every unique key, so the primary key
+    becomes (id, timestamp).
+    """
+    definitions = [partition_definition(month) for month in months] + [maxvalue_definition()]
+    return [
+        'ALTER TABLE %s DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)' % table,
+        'ALTER TABLE %s PARTITION BY RANGE (TO_DAYS(timestamp)) (%s)' % (table, ', '.join(definitions)),
+    ]
+
+
+def unpartition_table_sql(table):
+    return [
+        'ALTER TABLE %s REMOVE PARTITIONING' % table,
+        'ALTER TABLE %s DROP PRIMARY KEY, ADD PRIMARY KEY (id)' % table,
+    ]
+
+
+def missing_months(existing, until):
+    months = [partition_month(name) for name in existing if name != MAXVALUE]
+    if not months:
+        return []
+    return list(months_between(add_months(max(months), 1), until))
+
+
+def add_partitions_sql(table, months):
+    """Split the months off pmax ahead of time, pmax is empty then and the split is cheap."""
+    if not months:
+        return []
+    definitions = [partition_definition(month) for month in months] + [maxvalue_definition()]
+    return ['ALTER TABLE %s REORGANIZE PARTITION %s INTO (%s)' % (table, MAXVALUE, ', '.join(definitions))]
+
+
+def existing_partitions(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT partition_name FROM information_schema.partitions '
+            'WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL '
+            'ORDER BY partition_ordinal_position', [table])
+        return [row[0] for row in cursor.fetchall()]
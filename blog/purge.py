@@ -0,0 +1,117 @@
+import datetime
+import time
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from .models import Activity, Drinking, DailyRollup
+from . import live, materialized, rollups, routers
+
+CHUNK_SIZE = 5000
+TABLES = {'activity': Activity, 'drinking': Drinking}
+ROLLUP_COUNTS = {Activity: 'activity_count', Drinking: 'drinking_count'}
+# what the rollups and the materialized analysis need of a deleted reading
+READING_FIELDS = {Activity: ['timestamp', 'steps', 'pulse'], Drinking: ['timestamp', 'alcohol']}
+
+
+class PurgeResult(namedtuple('PurgeResult', ['deleted', 'chunks', 'seconds', 'skipped_days'])):
+    @property
+    def rows_per_second(self):
+        return self.deleted / self.seconds if self.seconds else float(self.deleted)
+
+    def __str__(self):
+        return '%d rows deleted in %d chunks, %.2f s (%.0f rows/s)' % (
+            self.deleted, self.chunks, self.seconds, self.rows_per_second)
+
+
+def purge(model, user=None, before=None, after=None, exclude=(), chunk_size=CHUNK_SIZE,
+          using=None, progress=None, keep_history=False):
+    """Delete readings of ``model`` by user and/or time range in primary key chunks.
+
+    Every chunk is its own short transaction, so locks are only held for
+    ``chunk_size`` rows at a time. ``exclude`` is a list of (user, start, stop)
+    ranges to keep, ``progress`` is called with the running total after each chunk.
+    The deleted readings are taken out of the rollups and the materialized analysis
+    in the same transaction, unless ``keep_history`` keeps them there.
+    """
+    using = using or routers.write_alias()
+    start = time.perf_counter()
+    rows = model.objects.using(using).all()
+    if user is not None:
+        rows = rows.filter(user=user)
+    if before is not None:
+        rows = rows.filter(timestamp__lt=before)
+    if after is not None:
+        rows = rows.filter(timestamp__gte=after)
+    for exclude_user, exclude_start, exclude_stop in exclude:
+        rows = rows.exclude(Q(user=exclude_user, timestamp__gte=exclude_start, timestamp__lt=exclude_stop))
+    deleted = chunks = 0
+    last_pk = 0
+    users = set()
+    while True:
+        chunk = list(rows.filter(pk__gt=last_pk).order_by('pk').
+                     values_list('pk', 'user', *READING_FIELDS[model])[:chunk_size])
+        if not chunk:
+            break
+        with transaction.atomic(using=using):
+            # a raw delete sends no post_delete per row, forget_history handles the chunk at once
+            model.objects.using(using).filter(pk__in=[row[0] for row in chunk])._raw_delete(using)
+            if not keep_history:
+                forget_history(model, chunk, using)
+        last_pk = chunk[-1][0]
+        users.update(row[1] for row in chunk)
+        deleted += len(chunk)
+        chunks += 1
+        if progress is not None:
+            progress(deleted, time.perf_counter() - start)
+    for u in users:
+        live.ENGINE.forget(u)
+    return PurgeResult(deleted, chunks, time.perf_counter() - start, [])
+
+
+def forget_history(model, chunk, using):
+    """Take deleted (pk, user, *READING_FIELDS) rows out of the rollups and the materialized analysis."""
+    readings = [model(pk=row[0], user=row[1], **dict(zip(READING_FIELDS[model], row[2:]))) for row in chunk]
+    if model is Activity:
+        rollups.remove_readings(activities=readings, using=using)
+    else:
+        rollups.remove_readings(drinks=readings, using=using)
+    by_user = defaultdict(list)
+    for reading in readings:
+        by_user[reading.user].append(reading)
+    for user, user_readings in by_user.items():
+        materialized.remove_readings(user, model, user_readings, using)
+
+
+def unrolled_days(model, before, using=None):
+    """(user, day) pairs before ``before`` whose raw row count differs from the daily rollup."""
+    # a lagging replica would let retention delete rows the rollups do not have yet
+    using = using or routers.write_alias()
+    rows = model.objects.using(using).filter(timestamp__lt=before)
+    if model is Drinking:
+        rows = rows.filter(alcohol__isnull=False)
+    raw = {(r['user'], r['day']): r['count'] for r in
+           rows.annotate(day=TruncDay('timestamp')).values('user', 'day').annotate(count=Count('id')).order_by()}
+    count_field = ROLLUP_COUNTS[model]
+    rolled = dict(((u, day), count) for u, day, count in DailyRollup.objects.using(using).
+                  filter(timestamp__lt=before).values_list('user', 'timestamp', count_field))
+    return sorted(key for key, count in raw.items() if rolled.get(key, 0) < count)
+
+
+def retention(model, days, chunk_size=CHUNK_SIZE, using=None, now=None, progress=None):
+    """Drop raw readings older than ``days`` full days once the daily rollups account for them.
+
+    Days whose readings are missing from the rollups, e.g. rows written outside
+    Django, are kept and reported in ``skipped_days`` until ``rebuild_rollups`` runs.
+    """
+    now = now or timezone.now()
+    before = (now - datetime.timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    skipped = unrolled_days(model, before, using)
+    exclude = [(u, day, day + datetime.timedelta(days=1)) for u, day in skipped]
+    # the rollups and the materialized analysis keep the history retention drops
+    result = purge(model, before=before, exclude=exclude, chunk_size=chunk_size, using=using, progress=progress,
+                   keep_history=True)
+    return result._replace(skipped_days=skipped)
@@ -0,0 +1,78 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import plotly
+import plotly.graph_objs as go
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+# sequential: one chart after the other in the calling thread
+# threads: every plot_* method on its own pool thread with its own DB connections
+# processes: threads, plus the figure serialization in a process pool
+MODES = ['sequential', 'threads', 'processes']
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def render_mode():
+    mode = getattr(settings, 'BLOG_RENDER_MODE', 'sequential')
+    if mode not in MODES:
+        raise ValueError('BLOG_RENDER_MODE must be one of %s, not %r' % (', '.join(MODES), mode))
+    return mode
+
+
+def pool(kind):
+    with _pools_lock:
+        if kind not in _pools:
+            if kind == 'threads':
+                _pools[kind] = ThreadPoolExecutor(max_workers=getattr(settings, 'BLOG_RENDER_THREADS', 6),
+                                                  thread_name_prefix='render')
+            else:
+                _pools[kind] = ProcessPoolExecutor(max_workers=getattr(settings, 'BLOG_RENDER_PROCESSES',
+                                                                       os.cpu_count()))
+        return _pools[kind]
+
+
+def serialize(data, layout, output='div', include_plotlyjs=False):
+    """Figure of plotly json ``data`` and ``layout`` as json or html div, runs in the process pool too."""
+    figure = go.Figure(data=data, layout=layout)
+    if output == 'json':
+        return json.dumps(figure.to_plotly_json(), cls=plotly.utils.PlotlyJSONEncoder, separators=(',', ':'))
+    return plotly.offline.plot(figure, auto_open=False, output_type='div', include_plotlyjs=include_plotlyjs)
+
+
+def in_transaction():
+    # pool threads use their own connections and would not see uncommitted rows
+    return any(connections[alias].in_atomic_block for alias in connections)
+
+
+def call_in_thread(func):
+    try:
+        return func()
+    finally:
+        connections.close_all()
+
+
+def call_all(funcs, mode):
+    """Results of the independent callables ``funcs`` (name -> callable), run as ``mode`` says."""
+    if mode == 'sequential' or len(funcs) < 2 or in_transaction():
+        return {name: func() for name, func in funcs.items()}
+    # the context carries the instrumentation of the caller into the pool threads
+    futures = {name: pool('threads').submit(contextvars.copy_context().run, call_in_thread, func)
+               for name, func in funcs.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+async def gather_all(funcs, mode):
+    """call_all for async views, the event loop is free while the callables run on threads."""
+    if mode == 'sequential' or len(funcs) < 2 or await sync_to_async(in_transaction)():
+        return await sync_to_async(call_all)(funcs, 'sequential')
+    results = await asyncio.gather(*[sync_to_async(call_in_thread, thread_sensitive=False)(func)
+                                     for func in funcs.values()])
+    return dict(zip(funcs, results))
@@ -0,0 +1,190 @@
+import datetime
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import Activity, Drinking, HourlyRollup, DailyRollup, WeeklyCell
+from . import binning, routers
+from .snapshot import DataSnapshot
+from .timeseries import to_epoch
+
+INTEGER_FIELDS = ['activity_count', 'steps_sum', 'steps_sq', 'drinking_count']
+
+
+def local_day(t):
+    # midnight has its own UTC offset on the days daylight saving time changes
+    return timezone.make_aware(datetime.datetime.combine(timezone.localdate(t), datetime.time()))
+
+
+# the truncations of add_readings bucket in the current time zone, like Trunc* of rebuild,
+# whatever UTC offset a reading was uploaded with
+ROLLUPS = [
+    (HourlyRollup, TruncHour, lambda t: timezone.localtime(t).replace(minute=0, second=0, microsecond=0)),
+    (DailyRollup, TruncDay, local_day),
+]
+
+
+def weekly_grids():
+    """Visualizer grid_time values, in minutes, with a maintained weekday x slot aggregate."""
+    return getattr(settings, 'BLOG_WEEKLY_GRIDS', [60])
+
+
+def activity_increments(a):
+    return {'activity_count': 1,
+            'steps_sum': a.steps, 'steps_sq': a.steps * a.steps,
+            'pulse_sum': a.pulse, 'pulse_sq': a.pulse * a.pulse}
+
+
+def drinking_increments(d):
+    return {'drinking_count': 1, 'alcohol_sum': d.alcohol, 'alcohol_sq': d.alcohol * d.alcohol}
+
+
+def add_readings(activities=(), drinks=(), using=None):
+    """Fold new Activity/Drinking readings into the hourly, daily and weekly aggregates.
+
+    Readings are summed per bucket in memory first. Buckets that do not exist yet
+    are bulk inserted, existing ones get one UPDATE each, so a batch costs queries
+    per touched existing bucket rather than per reading.
+    """
+    fold_readings(activities, drinks, 1, using)
+
+
+def remove_readings(activities=(), drinks=(), using=None):
+    """Take deleted readings back out of the aggregates, like add_readings, dropping emptied buckets."""
+    fold_readings(activities, drinks, -1, using)
+
+
+def fold_readings(activities, drinks, sign, using):
+    readings = [(a, activity_increments(a)) for a in activities]
+    readings += [(d, drinking_increments(d)) for d in drinks if d.alcohol is not None]
+    if not readings:
+        return
+    if sign < 0:
+        readings = [(reading, {field: -value for field, value in increments.items()})
+                    for reading, increments in readings]
+    using = using or routers.write_alias()
+    users = {reading.user for reading, _ in readings}
+    with transaction.atomic(using=using):
+        for model, _, truncate in ROLLUPS:
+            buckets = sum_buckets(((reading.user, truncate(reading.timestamp)), increments)
+                                  for reading, increments in readings)
+            timestamps = [timestamp for _, timestamp in buckets]
+            update_buckets(model, ('user', 'timestamp'), buckets, using, create=sign > 0,
+                           user__in=users, timestamp__range=(min(timestamps), max(timestamps)))
+        timestamps = to_epoch([reading.timestamp for reading, _ in readings])
+        for grid_minutes in weekly_grids():
+            weekday, slot, _ = binning.week_slots(timestamps, grid_minutes * 60 * 1000000)
+            buckets = sum_buckets(((reading.user, grid_minutes, d, sl), increments) for (reading, increments), d, sl
+                                  in zip(readings, weekday.tolist(), slot.tolist()))
+            update_buckets(WeeklyCell, ('user', 'grid_minutes', 'weekday', 'slot'), buckets, using,
+                           create=sign > 0, user__in=users, grid_minutes=grid_minutes)
+
+
+def sum_buckets(keyed_increments):
+    buckets = defaultdict(lambda: defaultdict(int))
+    for key, increments in keyed_increments:
+        bucket = buckets[key]
+        for field, value in increments.items():
+            bucket[field] += value
+    return buckets
+
+
+def update_buckets(model, key_fields, buckets, using, create=True, **scope):
+    # scope narrows the lookup of already existing buckets
+    existing = set(model.objects.using(using).filter(**scope).values_list(*key_fields))
+    if not create:
+        # readings never added, e.g. written outside Django, have no bucket to take them from
+        for key, increments in buckets.items():
+            if key in existing:
+                model.objects.using(using).filter(**dict(zip(key_fields, key))).update(
+                    **{field: F(field) + value for field, value in increments.items()})
+        model.objects.using(using).filter(activity_count__lte=0, drinking_count__lte=0, **scope).delete()
+        return
+    missing = [key for key in buckets if key not in existing]
+    try:
+        with transaction.atomic(using=using):
+            model.objects.using(using).bulk_create(
+                [model(**dict(zip(key_fields, key)), **buckets[key]) for key in missing], batch_size=1000)
+    except IntegrityError:
+        # a concurrent writer created some of them, fall back to row by row
+        pass
+    else:
+        buckets = {key: increments for key, increments in buckets.items() if key in existing}
+    for key, increments in buckets.items():
+        bucket, _ = model.objects.using(using).get_or_create(**dict(zip(key_fields, key)))
+        model.objects.using(using).filter(pk=bucket.pk).update(
+            **{field: F(field) + value for field, value in increments.items()})
+
+
+def rebuild(user=None, using=None):
+    """Recompute the rollups and weekly cells of ``user`` (or of every user) from the raw readings."""
+    using = using or routers.write_alias()
+    activities = Activity.objects.using(using).all()
+    drinks = Drinking.objects.using(using).filter(alcohol__isnull=False)
+    if user is not None:
+        activities = activities.filter(user=user)
+        drinks = drinks.filter(user=user)
+    for model, trunc, _ in ROLLUPS:
+        rollups = {}
+        for row in activities.annotate(bucket=trunc('timestamp')).values('user', 'bucket').annotate(
+                activity_count=Count('id'),
+                steps_sum=Sum('steps'), steps_sq=Sum(F('steps') * F('steps')),
+                pulse_sum=Sum('pulse'), pulse_sq=Sum(F('pulse') * F('pulse'))).order_by():
+            rollups[(row.pop('user'), row.pop('bucket'))] = row
+        for row in drinks.annotate(bucket=trunc('timestamp')).values('user', 'bucket').annotate(
+                drinking_count=Count('id'),
+                alcohol_sum=Sum('alcohol'), alcohol_sq=Sum(F('alcohol') * F('alcohol'))).order_by():
+            rollups.setdefault((row.pop('user'), row.pop('bucket')), {}).update(row)
+        with transaction.atomic(using=using):
+            existing = model.objects.using(using).all()
+            if user is not None:
+                existing = existing.filter(user=user)
+            existing.delete()
+            model.objects.using(using).bulk_create(
+                [model(user=u, timestamp=t, **fields) for (u, t), fields in rollups.items()], batch_size=1000)
+    rebuild_weekly(user, using)
+
+
+def weekly_cells(user, grid_minutes, snapshot):
+    """WeeklyCell instances of one user's snapshot, summed with bincount over weekday x slot."""
+    cells = {}
+    columns = [(snapshot.activity.timestamp, {'activity_count': None, 'steps': snapshot.activity.steps,
+                                              'pulse': snapshot.activity.pulse}),
+               (snapshot.drinking.timestamp, {'drinking_count': None, 'alcohol': snapshot.drinking.alcohol})]
+    for timestamps, metrics in columns:
+        weekday, slot, n_slots = binning.week_slots(timestamps, grid_minutes * 60 * 1000000)
+        index = slot * 7 + weekday
+        counts = np.bincount(index, minlength=n_slots * 7)
+        fields = {}
+        for name, values in metrics.items():
+            if values is None:
+                fields[name] = counts
+            else:
+                fields[name + '_sum'] = np.bincount(index, weights=values, minlength=n_slots * 7)
+                fields[name + '_sq'] = np.bincount(index, weights=values * values, minlength=n_slots * 7)
+        for cell in np.flatnonzero(counts).tolist():
+            cells.setdefault((cell // 7, cell % 7), {}).update(
+                {field: int(round(values[cell])) if field in INTEGER_FIELDS else float(values[cell])
+                 for field, values in fields.items()})
+    return [WeeklyCell(user=user, grid_minutes=grid_minutes, slot=sl, weekday=d, **fields)
+            for (sl, d), fields in cells.items()]
+
+
+def rebuild_weekly(user=None, using=None):
+    using = using or routers.write_alias()
+    if user is None:
+        users = set(Activity.objects.using(using).values_list('user', flat=True).distinct())
+        users |= set(Drinking.objects.using(using).values_list('user', flat=True).distinct())
+    else:
+        users = [user]
+    for u in sorted(users):
+        snapshot = DataSnapshot(u, using=using)
+        cells = [cell for grid_minutes in weekly_grids() for cell in weekly_cells(u, grid_minutes, snapshot)]
+        with transaction.atomic(using=using):
+            WeeklyCell.objects.using(using).filter(user=u).delete()
+            WeeklyCell.objects.using(using).bulk_create(cells, batch_size=1000)
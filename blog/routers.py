@@ -0,0 +1,137 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'new_smartband_db'
+# models living in the readings database
+SMARTBAND_MODELS = {'blog.activity', 'blog.drinking', 'blog.hourlyrollup', 'blog.dailyrollup',
+                    'blog.weeklycell', 'blog.analysisresult', 'blog.drinkwindow', 'blog.analysisstate'}
+# of those the ones whose reads may go to a replica, job claims and materialized state need the primary
+REPLICATED_MODELS = SMARTBAND_MODELS - {'blog.analysisresult', 'blog.drinkwindow', 'blog.analysisstate'}
+
+# reads of the current context stay on the primary until then, see SmartbandRouter
+_pinned_until = contextvars.ContextVar('blog_routers_pinned_until', default=0.0)
+
+_lag_lock = threading.Lock()
+# alias: (checked at, seconds behind the primary or None when unknown)
+_lags = {}
+
+
+def replicas():
+    return list(getattr(settings, 'BLOG_READ_REPLICAS', []))
+
+
+def max_lag():
+    return getattr(settings, 'BLOG_REPLICA_MAX_LAG', 5)
+
+
+def check_interval():
+    return getattr(settings, 'BLOG_REPLICA_CHECK_INTERVAL', 5)
+
+
+def measure_lag(alias):
+    """Seconds ``alias`` is behind its primary, None when it is not replicating or unreachable."""
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        # stand-ins of the tests and development have no replication
+        return 0
+    try:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute('SHOW REPLICA STATUS')
+                column = 'Seconds_Behind_Source'
+            except DatabaseError:
+                # before MySQL 8.0.22
+                cursor.execute('SHOW SLAVE STATUS')
+                column = 'Seconds_Behind_Master'
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            names = [c[0] for c in cursor.description]
+            return row[names.index(column)]
+    except DatabaseError:
+        logger.warning('Could not read the replication status of %s', alias, exc_info=True)
+        return None
+
+
+def replica_lag(alias):
+    """measure_lag of ``alias``, measured at most once every BLOG_REPLICA_CHECK_INTERVAL seconds."""
+    now = time.monotonic()
+    with _lag_lock:
+        checked = _lags.get(alias)
+        if checked is not None and now - checked[0] < check_interval():
+            return checked[1]
+    lag = measure_lag(alias)
+    with _lag_lock:
+        _lags[alias] = (now, lag)
+    return lag
+
+
+def healthy_replicas():
+    limit = max_lag()
+    lags = [(alias, replica_lag(alias)) for alias in replicas() if alias != PRIMARY]
+    return [alias for alias, lag in lags if lag is not None and lag <= limit]
+
+
+def forget_lags():
+    with _lag_lock:
+        _lags.clear()
+
+
+def pin_to_primary(seconds=None):
+    """Send the reads of the current context to the primary for ``seconds``, default BLOG_REPLICA_MAX_LAG."""
+    _pinned_until.set(time.monotonic() + (max_lag() if seconds is None else seconds))
+
+
+def pinned():
+    return _pinned_until.get() > time.monotonic()
+
+
+def write_alias():
+    """Database of the readings writes for the code running its own transactions, pins the reads like a write."""
+    pin_to_primary()
+    return PRIMARY
+
+
+class SmartbandRouter:
+    """Readings and their rollups live in new_smartband_db, reads may go to BLOG_READ_REPLICAS.
+
+    A replica is used while it is at most BLOG_REPLICA_MAX_LAG seconds behind the
+    primary, a random one of those for every query. After a write the reads of the
+    same request (context) stay on the primary for that long, so a user sees what
+    they just saved. Without healthy replicas everything goes to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        label = model._meta.label_lower
+        if label not in SMARTBAND_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if label not in REPLICATED_MODELS or pinned():
+            return PRIMARY
+        candidates = healthy_replicas()
+        return random.choice(candidates) if candidates else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        if model._meta.label_lower not in SMARTBAND_MODELS:
+            return None
+        pin_to_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # User lives in default, readings only hold its id
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are read only, they get the schema through replication
+        if db in replicas() and db != PRIMARY:
+            return False
+        return None
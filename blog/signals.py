@@ -0,0 +1,38 @@
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Activity, Drinking
+from . import instrumentation, live, rollups
+from .backends import health
+
+connection_created.connect(instrumentation.install)
+# after django.db's close_old_connections, which drops the expired and broken ones
+request_started.connect(health.check_connections)
+
+
+@receiver(post_save, sender=Activity)
+def activity_saved(sender, instance, created, using, **kwargs):
+    if created:
+        rollups.add_readings(activities=[instance], using=using)
+        live.ENGINE.add_readings(activities=[instance])
+
+
+@receiver(post_save, sender=Drinking)
+def drinking_saved(sender, instance, created, using, **kwargs):
+    if created:
+        rollups.add_readings(drinks=[instance], using=using)
+        live.ENGINE.add_readings(drinks=[instance])
+
+
+# instance and queryset deletes, purge deletes without signals and updates the rollups itself
+@receiver(post_delete, sender=Activity)
+def activity_deleted(sender, instance, using, **kwargs):
+    rollups.remove_readings(activities=[instance], using=using)
+    live.ENGINE.forget(instance.user)
+
+
+@receiver(post_delete, sender=Drinking)
+def drinking_deleted(sender, instance, using, **kwargs):
+    rollups.remove_readings(drinks=[instance], using=using)
+    live.ENGINE.forget(instance.user)
@@ -0,0 +1,52 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from .models import Activity, Drinking
+from .timeseries import to_epoch
+
+ActivityColumns = namedtuple('ActivityColumns', ['timestamp', 'steps', 'pulse'])
+DrinkingColumns = namedtuple('DrinkingColumns', ['timestamp', 'alcohol'])
+
+
+class DataSnapshot:
+    """Column arrays of one user's readings, every table fetched at most once.
+
+    Timestamps are int64 microseconds since the epoch, rows are sorted by timestamp.
+    Safe to share between the threads rendering charts concurrently. ``using`` None
+    leaves the database to the router, a replica when BLOG_READ_REPLICAS has one.
+    """
+    # the weekly cells and the materialized analysis describe the same readings
+    in_database = True
+
+    def __init__(self, user, using=None):
+        self.user = user
+        self.using = using
+        self._activity = None
+        self._drinking = None
+        self._activity_lock = threading.Lock()
+        self._drinking_lock = threading.Lock()
+
+    def rows(self, model, *fields):
+        return list(model.objects.using(self.using).filter(user=self.user).
+                    order_by('timestamp').values_list('timestamp', *fields))
+
+    @property
+    def activity(self):
+        with self._activity_lock:
+            if self._activity is None:
+                rows = self.rows(Activity, 'steps', 'pulse')
+                self._activity = ActivityColumns(timestamp=to_epoch([r[0] for r in rows]),
+                                                 steps=np.array([r[1] for r in rows], dtype=np.int64),
+                                                 pulse=np.array([r[2] for r in rows], dtype=np.float64))
+        return self._activity
+
+    @property
+    def drinking(self):
+        with self._drinking_lock:
+            if self._drinking is None:
+                rows = self.rows(Drinking, 'alcohol')
+                self._drinking = DrinkingColumns(timestamp=to_epoch([r[0] for r in rows]),
+                                                 alcohol=np.array([r[1] for r in rows], dtype=np.float64))
+        return self._drinking
@@ -0,0 +1,41 @@
+// Fetches the figure of every .lazy-chart once it scrolls into view and draws it with plotly.js
+(function () {
+    var RETRY_MS = 3000;
+
+    function load(div) {
+        fetch(div.dataset.url, {credentials: 'same-origin'})
+            .then(function (response) {
+                // 202: the background analysis has no result yet
+                if (response.status === 202) {
+                    setTimeout(function () { load(div); }, RETRY_MS);
+                    return undefined;
+                }
+                return response.json();
+            })
+            .then(function (figure) {
+                if (figure === undefined) {
+                    return;
+                }
+                if (figure === null) {
+                    div.parentNode.removeChild(div);
+                } else {
+                    Plotly.newPlot(div, figure.data, figure.layout);
+                }
+            });
+    }
+
+    var charts = document.querySelectorAll('.lazy-chart');
+    if (!('IntersectionObserver' in window)) {
+        charts.forEach(load);
+        return;
+    }
+    var observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                load(entry.target);
+            }
+        });
+    }, {rootMargin: '200px'});
+    charts.forEach(function (div) { observer.observe(div); });
+})();
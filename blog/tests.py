@@ -1,3 +1,1431 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, transaction
+from django.db.utils import ConnectionHandler
+from django.db.models import Avg, Sum
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+import numpy as np
+
+import data_generator
+from data_generator import DataGenerator
+from . import analysis_jobs, archive, binning, downsample, ingest, live, materialized, partitions, purge, rendering, rollups, routers
+from .backends import health, pool
+from .chart_cache import ChartCache
+from .instrumentation import ServerTimingMiddleware
+from .models import Activity, AnalysisResult, AnalysisState, Drinking, DrinkWindow, HourlyRollup, DailyRollup, Post, WeeklyCell
+from .snapshot import DataSnapshot
+from .timeseries import to_epoch, window_join
+from .visualizer import ANALYSIS_CHARTS, CHARTS, HOME_CHARTS, Visualizer
+
+
+def seed_readings(user, length, days=7, seed=0):
+    random.seed(seed)
+    stop = timezone.now()
+    gen = DataGenerator(user, stop - datetime.timedelta(days=days), stop)
+    act_list, drink_list = gen.rand_multiple_data(length)
+    Activity.objects.using('new_smartband_db').bulk_create(act_list)
+    Drinking.objects.using('new_smartband_db').bulk_create(drink_list)
+
+
+# the join over the snapshot, MaterializedAnalysisTest covers the stored one
+@override_settings(BLOG_MATERIALIZED_ANALYSIS=False)
+class PlotAnalysisTest(TestCase):
+    databases = '__all__'
+
+    def reference_triples(self, v):
+        # the original per-drink query loop
+        drink_query = Drinking.objects.using('new_smartband_db').filter(user=v.user).order_by('alcohol').all()
+        act_query = Activity.objects.using('new_smartband_db').filter(user=v.user).all()
+        x, y, z = [], [], []
+        for drink in drink_query:
+            act_filtered = act_query.filter(timestamp__range=(drink.timestamp - v.time_delta/2,
+                                                              drink.timestamp + v.time_delta/2))
+            if len(act_filtered) > 0:
+                x.append(drink.alcohol)
+                y.append(act_filtered.aggregate(Avg('steps'))['steps__avg'])
+                z.append(act_filtered.aggregate(Avg('pulse'))['pulse__avg'])
+        return x, y, z
+
+    def analysis_triples(self, v):
+        with mock.patch.object(v, 'plot_analysis2d'), mock.patch.object(v, 'plot_analysis3d') as plot3d:
+            v.plot_analysis()
+        return plot3d.call_args[0]
+
+    def test_matches_per_drink_queries(self):
+        seed_readings(user=1, length=2000, days=3)
+        seed_readings(user=2, length=300, days=3, seed=1)
+        v = Visualizer(user=1, min_3d_values=0)
+        x, y, z = self.analysis_triples(v)
+        ref_x, ref_y, ref_z = self.reference_triples(v)
+        self.assertEqual(x, ref_x)
+        self.assertEqual(y, ref_y)
+        self.assertEqual(len(z), len(ref_z))
+        for a, b in zip(z, ref_z):
+            self.assertAlmostEqual(a, b, places=9)
+
+    def test_query_count_is_constant(self):
+        for length in (100, 1000, 5000):
+            Activity.objects.using('new_smartband_db').all().delete()
+            Drinking.objects.using('new_smartband_db').all().delete()
+            seed_readings(user=1, length=length)
+            with self.assertNumQueries(2, using='new_smartband_db'):
+                self.analysis_triples(Visualizer(user=1, min_3d_values=0))
+
+    def test_analysis_page_fetches_each_table_once(self):
+        seed_readings(user=1, length=1000)
+        v = Visualizer(user=1, min_2d_values=0, min_3d_values=0)
+        # the two snapshot tables plus one lookup of the (not yet backfilled) weekly cells
+        with self.assertNumQueries(3, using='new_smartband_db'):
+            charts = [v.plot_alcohol(), v.plot_steps(), v.plot_pulse(), v.plot_activity()] + list(v.plot_analysis())
+        self.assertTrue(all(charts))
+
+    def test_too_few_values(self):
+        seed_readings(user=1, length=100)
+        self.assertEqual(Visualizer(user=1).plot_analysis(), (None, None))
+
+
+class MaterializedAnalysisTest(TestCase):
+    databases = '__all__'
+    half_width = 450000000
+
+    def snapshot_grids(self, user):
+        snapshot = DataSnapshot(user)
+        drinking, activity = snapshot.drinking, snapshot.activity
+        order = np.argsort(drinking.alcohol, kind='stable')
+        x, y, z = window_join(drinking.timestamp[order], drinking.alcohol[order], activity.timestamp,
+                              activity.steps, activity.pulse, self.half_width)
+        return binning.grid2d(x, y, 0.2), binning.grid3d(x, y, z, 0.2, 10)
+
+    def assertMatchesSnapshot(self, analysis, user=1):
+        grid2d, grid3d = self.snapshot_grids(user)
+        self.assertEqual(analysis.grid2d[0], grid2d[0])
+        np.testing.assert_allclose(analysis.grid2d[1], grid2d[1], rtol=1e-12)
+        for a, b in zip(analysis.grid3d, grid3d):
+            np.testing.assert_allclose(a, b, rtol=1e-12)
+
+    def update(self, user=1):
+        return materialized.update(user, self.half_width, 0.2, 10)
+
+    def test_matches_snapshot_join(self):
+        seed_readings(user=1, length=2000, days=3)
+        seed_readings(user=2, length=300, days=3, seed=1)
+        analysis = self.update()
+        self.assertTrue(analysis.recomputed)
+        self.assertEqual((analysis.activity_count, analysis.drinking_count),
+                         (Activity.objects.using('new_smartband_db').filter(user=1).count(),
+                          Drinking.objects.using('new_smartband_db').filter(user=1).count()))
+        self.assertMatchesSnapshot(analysis)
+
+    def test_only_new_readings_are_joined(self):
+        seed_readings(user=1, length=2000, days=3)
+        self.update()
+        # the locked state and the two high-water mark lookups, in a savepoint of the test transaction
+        with self.assertNumQueries(5, using='new_smartband_db'):
+            self.assertFalse(self.update().recomputed)
+        # new activity next to one old drink, and a new drink
+        drink = DrinkWindow.objects.using('new_smartband_db').filter(user=1).order_by('timestamp')[10]
+        Activity.objects.using('new_smartband_db').create(user=1, timestamp=drink.timestamp, steps=5000, pulse=150.0)
+        Drinking.objects.using('new_smartband_db').create(user=1, timestamp=timezone.now(), alcohol=3.0)
+        windows = list(DrinkWindow.objects.using('new_smartband_db').filter(user=1).values_list('drinking_id', 'pk'))
+        analysis = self.update()
+        rewritten = set(windows) - set(DrinkWindow.objects.using('new_smartband_db').filter(user=1).
+                                       values_list('drinking_id', 'pk'))
+        self.assertIn(drink.drinking_id, {d for d, _ in rewritten})
+        self.assertLess(len(rewritten), 10)
+        self.assertEqual(DrinkWindow.objects.using('new_smartband_db').filter(user=1).count(), len(windows) + 1)
+        self.assertMatchesSnapshot(analysis)
+
+    def test_readings_committed_out_of_id_order(self):
+        seed_readings(user=1, length=500)
+        last = Drinking.objects.using('new_smartband_db').latest('id')
+        late = Drinking(id=last.id + 1, user=1, timestamp=last.timestamp, alcohol=2.0)
+        # a concurrent transaction took the next id but commits after the update
+        Drinking.objects.using('new_smartband_db').create(id=last.id + 2, user=1, timestamp=timezone.now(),
+                                                          alcohol=1.0)
+        now = time.time()
+        materialized.update(1, self.half_width, 0.2, 10, now=now)
+        late.save(using='new_smartband_db')
+        analysis = materialized.update(1, self.half_width, 0.2, 10, now=now + 1)
+        self.assertTrue(analysis.recomputed)
+        self.assertTrue(DrinkWindow.objects.using('new_smartband_db').filter(drinking_id=late.id).exists())
+        self.assertEqual(analysis.drinking_count, Drinking.objects.using('new_smartband_db').filter(user=1).count())
+        self.assertMatchesSnapshot(analysis)
+        # once settled the mark passes the runs
+        self.assertFalse(materialized.update(1, self.half_width, 0.2, 10,
+                                             now=now + materialized.SETTLE_AFTER + 1).recomputed)
+        state = AnalysisState.objects.using('new_smartband_db').get(user=1)
+        self.assertEqual((state.drinking_id, state.drinking_seen), (last.id + 2, '[]'))
+
+    def test_runs(self):
+        runs = materialized.add_runs([], [3, 4, 5, 9], 10.0)
+        self.assertEqual(runs, [[3, 5, 10.0], [9, 9, 10.0]])
+        runs = materialized.add_runs(runs, [7, 12], 20.0)
+        self.assertEqual(materialized.in_runs([2, 3, 6, 7, 9, 10], runs).tolist(),
+                         [False, True, False, True, True, False])
+        self.assertEqual(materialized.settle(0, runs, 69.0), (0, runs))
+        # the young run 7 is joined already, only the unseen ids below 9 are given up
+        self.assertEqual(materialized.settle(0, runs, 71.0), (9, [[12, 12, 20.0]]))
+        self.assertEqual(materialized.settle(0, runs, 81.0), (12, []))
+        with mock.patch.object(materialized, 'MAX_RUNS', 2):
+            self.assertEqual(materialized.add_runs(runs, [], 20.0), [[3, 9, 20.0], [12, 12, 20.0]])
+
+    def test_grid_change_keeps_windows(self):
+        seed_readings(user=1, length=500)
+        self.update()
+        analysis = materialized.update(1, self.half_width, 0.5, 10)
+        self.assertTrue(analysis.recomputed)
+        self.assertEqual(AnalysisState.objects.using('new_smartband_db').get(user=1).grid_alcohol, 0.5)
+
+    def test_plot_analysis(self):
+        seed_readings(user=1, length=1000)
+        v = Visualizer(user=1, materialized=True, min_3d_values=0)
+        analysis2d, analysis3d = v.plot_analysis()
+        self.assertIn('steps (alcohol)', analysis2d)
+        self.assertEqual(Visualizer(user=1, materialized=True, min_3d_values=5000).plot_analysis(), (None, None))
+
+    def test_purge_takes_readings_out(self):
+        seed_readings(user=1, length=2000, days=3)
+        self.update()
+        middle = timezone.now() - datetime.timedelta(days=1)
+        purge.purge(Activity, user=1, after=middle - datetime.timedelta(hours=3), before=middle)
+        purge.purge(Drinking, user=1, after=middle, before=middle + datetime.timedelta(hours=3))
+        analysis = self.update()
+        self.assertTrue(analysis.recomputed)
+        self.assertEqual((analysis.activity_count, analysis.drinking_count),
+                         (Activity.objects.using('new_smartband_db').filter(user=1).count(),
+                          Drinking.objects.using('new_smartband_db').filter(user=1).count()))
+        self.assertMatchesSnapshot(analysis)
+
+    def test_merge_ranges(self):
+        self.assertEqual(materialized.merge_ranges([10, 15, 40], 5), [(5, 20), (35, 45)])
+        self.assertEqual(len(materialized.merge_ranges(np.arange(0, 1000, 20), 5)), 50)
+        self.assertEqual(materialized.merge_ranges(np.arange(0, 1000, 20), 5, max_ranges=10), [(-5, 985)])
+
+
+def reference_grid2d(x, y, grid_x):
+    d_lists = {}
+    for xx, yy in zip(x, y):
+        d_lists.setdefault(round(xx / grid_x), []).append(yy)
+    return ([k * grid_x for k in d_lists],
+            [float(sum(v)) / len(v) for v in d_lists.values()])
+
+
+def reference_grid3d(x, y, z, grid_x, grid_y):
+    d_lists = {}
+    for xx, yy, zz in zip(x, y, z):
+        d_lists.setdefault((round(xx / grid_x), round(yy / grid_y)), []).append(zz)
+    x_int_min = min([0] + [k[0] for k in d_lists])
+    x_int_max = max([0] + [k[0] for k in d_lists])
+    y_int_min = min([0] + [k[1] for k in d_lists])
+    y_int_max = max([0] + [k[1] for k in d_lists])
+    new_z = np.full((y_int_max - y_int_min + 1, x_int_max - x_int_min + 1), np.nan)
+    for (kx, ky), v in d_lists.items():
+        new_z[ky - y_int_min, kx - x_int_min] = float(sum(v)) / len(v)
+    return (np.arange(x_int_min, x_int_max + 1) * grid_x,
+            np.arange(y_int_min, y_int_max + 1) * grid_y,
+            new_z)
+
+
+def reference_week_grid(timestamps, values, grid_time):
+    y = Visualizer(user=None, minutes_grid=grid_time // datetime.timedelta(minutes=1)).get_grid_time_list()
+    d_lists = {}
+    for t, v in zip(timestamps, values):
+        t_time = t.time()
+        if t_time == datetime.time(hour=0, minute=0):
+            t_time_ind = 0
+        else:
+            t_time_ind = np.searchsorted(y, t_time) - 1
+        d_lists.setdefault((t.weekday(), t_time_ind), []).append(v)
+    z = np.full((len(y), 7), np.nan)
+    for (ind_x, ind_y), v in d_lists.items():
+        z[ind_y, ind_x] = float(sum(v)) / len(v)
+    return z
+
+
+class BinningTest(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def test_grid2d(self):
+        x = self.rng.uniform(0, 4, 5000).round(3).tolist()
+        y = self.rng.uniform(60, 140, 5000).tolist()
+        new_x, new_y = binning.grid2d(x, y, 0.2)
+        ref_x, ref_y = reference_grid2d(x, y, 0.2)
+        self.assertEqual(new_x, ref_x)
+        np.testing.assert_allclose(new_y, ref_y, rtol=1e-12)
+
+    def test_grid2d_sparse_keys(self):
+        x = [1000.0, 0.0, 5.0, 1000.0, -300.0]
+        y = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.assertEqual(binning.grid2d(x, y, 1), reference_grid2d(x, y, 1))
+
+    def test_grid2d_half_way_values_round_to_even(self):
+        new_x, new_y = binning.grid2d([5, 15, 25, 0], [1.0, 2.0, 3.0, 4.0], 10)
+        self.assertEqual(new_x, [0, 20])
+        self.assertEqual(new_y, [2.5, 2.5])
+
+    def test_grid3d(self):
+        x = self.rng.uniform(0, 4, 5000)
+        y = self.rng.randint(0, 50, 5000)
+        z = self.rng.uniform(60, 140, 5000)
+        for actual, expected in zip(binning.grid3d(x, y, z, 0.2, 10), reference_grid3d(x, y, z, 0.2, 10)):
+            np.testing.assert_allclose(actual, expected, rtol=1e-12)
+
+    def test_grid3d_rows_follow_y(self):
+        new_x, new_y, new_z = binning.grid3d([0.0, 0.0], [0, 20], [1.0, 3.0], 1, 10)
+        self.assertEqual(new_y.tolist(), [0, 10, 20])
+        np.testing.assert_array_equal(new_z[:, 0], [1.0, np.nan, 3.0])
+
+    def test_week_grid(self):
+        start = datetime.datetime(2018, 10, 1, tzinfo=timezone.utc)
+        timestamps = [start + datetime.timedelta(seconds=int(s)) for s in self.rng.randint(0, 21 * 86400, 5000)]
+        timestamps += [start, start + datetime.timedelta(hours=3), start + datetime.timedelta(days=2, minutes=45)]
+        values = self.rng.uniform(0, 100, len(timestamps))
+        for minutes in (60, 45, 7):
+            grid_time = datetime.timedelta(minutes=minutes)
+            z = binning.week_grid(to_epoch(timestamps), values, grid_time // datetime.timedelta(microseconds=1))
+            np.testing.assert_allclose(z, reference_week_grid(timestamps, values, grid_time), rtol=1e-12)
+
+
+class RollupTest(TestCase):
+    databases = '__all__'
+
+    def rollup_rows(self, model):
+        fields = ['user', 'timestamp', 'activity_count', 'steps_sum', 'steps_sq', 'drinking_count']
+        rows = model.objects.using('new_smartband_db').order_by('user', 'timestamp').values_list(*fields)
+        float_fields = ['pulse_sum', 'pulse_sq', 'alcohol_sum', 'alcohol_sq']
+        floats = model.objects.using('new_smartband_db').order_by('user', 'timestamp').values_list(*float_fields)
+        return list(rows), np.array(list(floats))
+
+    def test_saved_readings_match_rebuild(self):
+        random.seed(0)
+        stop = timezone.now()
+        gen = DataGenerator(1, stop - datetime.timedelta(days=3), stop)
+        act_list, drink_list = gen.rand_multiple_data(300)
+        for reading in act_list + drink_list:
+            reading.save(using='new_smartband_db')
+        incremental = {model: self.rollup_rows(model) for model in (HourlyRollup, DailyRollup)}
+        rollups.rebuild()
+        for model in (HourlyRollup, DailyRollup):
+            rows, floats = self.rollup_rows(model)
+            self.assertEqual(rows, incremental[model][0])
+            np.testing.assert_allclose(floats, incremental[model][1])
+        self.assertEqual(sum(r[2] for r in rows), 300)
+
+    def test_offset_timestamps_share_utc_buckets(self):
+        # one UTC day and hour, uploaded with three different offsets
+        day = datetime.datetime(2021, 3, 4, 20, 10, tzinfo=timezone.utc)
+        offsets = [datetime.timedelta(0), datetime.timedelta(hours=2), datetime.timedelta(hours=5, minutes=30)]
+        ingest.save_readings([Activity(user=1, timestamp=(day + datetime.timedelta(minutes=i)).astimezone(
+            datetime.timezone(offset)), steps=10, pulse=70.0) for i, offset in enumerate(offsets)], [])
+        incremental = {model: self.rollup_rows(model)[0] for model in (HourlyRollup, DailyRollup)}
+        self.assertEqual([r[1:3] for r in incremental[DailyRollup]],
+                         [(datetime.datetime(2021, 3, 4, tzinfo=timezone.utc), 3)])
+        self.assertEqual([r[1:3] for r in incremental[HourlyRollup]],
+                         [(datetime.datetime(2021, 3, 4, 20, tzinfo=timezone.utc), 3)])
+        rollups.rebuild()
+        for model in (HourlyRollup, DailyRollup):
+            self.assertEqual(self.rollup_rows(model)[0], incremental[model])
+
+    @override_settings(TIME_ZONE='Europe/Warsaw')
+    def test_daylight_saving_days(self):
+        # 2021-03-28 starts CEST, its local midnight is still CET
+        timestamps = [datetime.datetime(2021, 3, 28, 12, tzinfo=timezone.utc),
+                      datetime.datetime(2021, 10, 31, 12, tzinfo=timezone.utc)]
+        ingest.save_readings([Activity(user=1, timestamp=t, steps=10, pulse=70.0) for t in timestamps], [])
+        incremental = {model: self.rollup_rows(model)[0] for model in (HourlyRollup, DailyRollup)}
+        self.assertEqual([r[1] for r in incremental[DailyRollup]],
+                         [datetime.datetime(2021, 3, 27, 23, tzinfo=timezone.utc),
+                          datetime.datetime(2021, 10, 30, 22, tzinfo=timezone.utc)])
+        rollups.rebuild()
+        for model in (HourlyRollup, DailyRollup):
+            self.assertEqual(self.rollup_rows(model)[0], incremental[model])
+
+    def test_deleted_readings_leave_the_rollups(self):
+        random.seed(2)
+        stop = timezone.now()
+        gen = DataGenerator(1, stop - datetime.timedelta(days=3), stop)
+        act_list, drink_list = gen.rand_multiple_data(200)
+        ingest.save_readings(act_list, drink_list)
+        Activity.objects.using('new_smartband_db').filter(user=1, steps__lt=10).delete()
+        Drinking.objects.using('new_smartband_db').filter(user=1).first().delete()
+        incremental = {model: self.rollup_rows(model) for model in (HourlyRollup, DailyRollup)}
+        cells = self.weekly_rows()
+        rollups.rebuild()
+        for model in (HourlyRollup, DailyRollup):
+            rows, floats = self.rollup_rows(model)
+            self.assertEqual(rows, incremental[model][0])
+            np.testing.assert_allclose(floats, incremental[model][1], atol=1e-6)
+        self.assertEqual(self.weekly_rows()[0], cells[0])
+
+    def test_daily_grid_matches_raw_readings(self):
+        seed_readings(user=1, length=3000, days=2)
+        rollups.rebuild()
+        v = Visualizer(user=1)
+        data, hist_x, hist_y = v.daily_grid(Activity, 'steps', Sum)
+        for x, y in zip(hist_x, hist_y):
+            if x is None:
+                continue
+            start = x - datetime.timedelta(minutes=30)
+            raw = Activity.objects.using('new_smartband_db').filter(
+                user=1, timestamp__gte=start, timestamp__lt=start + datetime.timedelta(hours=1))
+            self.assertEqual(y, raw.aggregate(Sum('steps'))['steps__sum'])
+        self.assertEqual(len([x for x in hist_x if x is not None]), 24)
+
+    def test_monthly_grid_reads_buckets_only(self):
+        seed_readings(user=1, length=5000, days=40)
+        rollups.rebuild()
+        v = Visualizer(user=1)
+        with self.assertNumQueries(1, using='new_smartband_db'):
+            hist_x, hist_y = v.monthly_grid(Drinking, 'alcohol', Avg)
+        day = DailyRollup.objects.using('new_smartband_db').filter(user=1).latest('timestamp')
+        raw = Drinking.objects.using('new_smartband_db').filter(user=1, timestamp__date=day.timestamp.date())
+        self.assertAlmostEqual(hist_y[30], raw.aggregate(Avg('alcohol'))['alcohol__avg'])
+        self.assertEqual(hist_x[30], day.timestamp.date())
+
+    def weekly_rows(self):
+        fields = ['user', 'grid_minutes', 'weekday', 'slot', 'activity_count', 'steps_sum', 'steps_sq', 'drinking_count']
+        cells = WeeklyCell.objects.using('new_smartband_db').order_by('user', 'grid_minutes', 'weekday', 'slot')
+        floats = cells.values_list('pulse_sum', 'pulse_sq', 'alcohol_sum', 'alcohol_sq')
+        return list(cells.values_list(*fields)), np.array(list(floats))
+
+    @override_settings(BLOG_WEEKLY_GRIDS=[60, 15])
+    def test_saved_readings_match_weekly_rebuild(self):
+        random.seed(1)
+        stop = timezone.now()
+        gen = DataGenerator(1, stop - datetime.timedelta(days=10), stop)
+        act_list, drink_list = gen.rand_multiple_data(300)
+        ingest.save_readings(act_list[:100], drink_list[:100])
+        ingest.save_readings(act_list[100:], drink_list[100:])
+        rows, floats = self.weekly_rows()
+        rollups.rebuild()
+        self.assertEqual(self.weekly_rows()[0], rows)
+        np.testing.assert_allclose(self.weekly_rows()[1], floats)
+        self.assertEqual(sum(r[4] for r in rows if r[1] == 15), 300)
+
+    def test_week_means_match_raw_readings(self):
+        seed_readings(user=1, length=3000, days=20)
+        raw = Visualizer(user=1)
+        expected = {name: raw.week_means(name) for name in ('steps', 'pulse', 'alcohol')}
+        rollups.rebuild()
+        v = Visualizer(user=1)
+        with self.assertNumQueries(1, using='new_smartband_db'):
+            for name in ('steps', 'pulse', 'alcohol'):
+                count, z = v.week_means(name)
+                self.assertEqual(count, expected[name][0])
+                np.testing.assert_allclose(z, expected[name][1])
+
+
+class ChartCacheTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['charts'].clear()
+        self.user = User.objects.create_user(username='kamil', password='secret')
+        seed_readings(user=self.user.id, length=1000, days=7)
+        self.client.force_login(self.user)
+
+    def test_repeat_load_is_served_from_cache(self):
+        render = mock.Mock(return_value='<div>chart</div>')
+        self.assertEqual(ChartCache(self.user.id).get('steps', render), '<div>chart</div>')
+        self.assertEqual(ChartCache(self.user.id).get('steps', render), '<div>chart</div>')
+        self.assertEqual(render.call_count, 1)
+
+    def test_none_is_cached(self):
+        render = mock.Mock(return_value=None)
+        ChartCache(self.user.id).get('steps', render)
+        self.assertIsNone(ChartCache(self.user.id).get('steps', render))
+        self.assertEqual(render.call_count, 1)
+
+    def test_new_reading_invalidates(self):
+        render = mock.Mock(return_value='<div>chart</div>')
+        ChartCache(self.user.id).get('steps', render)
+        Activity(user=self.user.id, timestamp=timezone.now() - datetime.timedelta(days=30),
+                 steps=10, pulse=80.0).save(using='new_smartband_db')
+        ChartCache(self.user.id).get('steps', render)
+        self.assertEqual(render.call_count, 2)
+
+    def test_version_follows_the_database_alone(self):
+        # bulk_create and raw deletes stand in for the writes of another process
+        version = ChartCache(self.user.id).version()
+        caches['charts'].clear()
+        self.assertEqual(ChartCache(self.user.id).version(), version)
+        Activity.objects.using('new_smartband_db').bulk_create(
+            [Activity(user=self.user.id, timestamp=timezone.now(), steps=10, pulse=80.0)])
+        added = ChartCache(self.user.id).version()
+        self.assertNotEqual(added, version)
+        oldest = Drinking.objects.using('new_smartband_db').filter(user=self.user.id).order_by('pk')[:1]
+        Drinking.objects.using('new_smartband_db').filter(pk__in=list(oldest.values_list('pk', flat=True)))._raw_delete(
+            'new_smartband_db')
+        self.assertNotEqual(ChartCache(self.user.id).version(), added)
+
+    @override_settings(BLOG_LAZY_CHARTS=False, BLOG_ANALYSIS_BACKGROUND=False)
+    def test_analysis_view_renders_once(self):
+        with mock.patch.object(Visualizer, 'plot_analysis', return_value=(None, None)) as plot_analysis:
+            self.assertEqual(self.client.get('/analysis/').status_code, 200)
+            self.assertEqual(self.client.get('/analysis/').status_code, 200)
+        self.assertEqual(plot_analysis.call_count, 1)
+
+
+@override_settings(BLOG_LAZY_CHARTS=False, BLOG_ANALYSIS_BACKGROUND=False)
+class PageSizeTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['charts'].clear()
+        self.user = User.objects.create_user(username='kamil', password='secret')
+        seed_readings(user=self.user.id, length=3000, days=14)
+        rollups.rebuild()
+        self.client.force_login(self.user)
+
+    def assertChartPage(self, url, charts, max_bytes):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.count(b'Plotly.newPlot('), charts)
+        self.assertIn(b'blog/js/plotly.min.js', response.content)
+        self.assertNotIn(b'plotly.js v', response.content)
+        self.assertLess(len(response.content), max_bytes)
+
+    def test_home(self):
+        self.assertChartPage('/', charts=6, max_bytes=150 * 1000)
+
+    def test_analysis(self):
+        self.assertChartPage('/analysis/', charts=6, max_bytes=150 * 1000)
+
+
+@override_settings(BLOG_ANALYSIS_BACKGROUND=False)
+class ChartDataTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['charts'].clear()
+        self.user = User.objects.create_user(username='kamil', password='secret')
+        seed_readings(user=self.user.id, length=3000, days=14)
+        rollups.rebuild()
+        self.client.force_login(self.user)
+
+    def test_analysis_requires_login(self):
+        self.client.logout()
+        response = async_to_sync(self.async_client.get)('/analysis/')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login/', response['Location'])
+
+    @override_settings(BLOG_ANALYSIS_BACKGROUND=True, BLOG_LAZY_CHARTS=True)
+    def test_pages_are_shells(self):
+        with mock.patch.object(Visualizer, 'plot') as plot, mock.patch.object(analysis_jobs, 'executor') as executor:
+            for url, count in (('/', 6), ('/analysis/', 6)):
+                response = self.client.get(url)
+                self.assertEqual(response.content.count(b'class="lazy-chart"'), count)
+                self.assertIn(b'/charts/last_steps/' if url == '/' else b'/charts/analysis3d/', response.content)
+        plot.assert_not_called()
+        # the analysis page only queued its background job
+        self.assertEqual(executor().submit.call_count, 1)
+        self.assertIn(b'Refreshing the analysis', response.content)
+
+    def test_chart_json(self):
+        response = self.client.get('/charts/analysis3d/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        figure = response.json()
+        self.assertEqual(figure['data'][0]['type'], 'heatmap')
+        self.assertIn(b'pulse (alcohol, steps)', response.content)
+
+    def test_empty_chart_is_null(self):
+        Activity.objects.using('new_smartband_db').all().delete()
+        self.assertIsNone(self.client.get('/charts/activity/').json())
+
+    def test_unknown_chart(self):
+        self.assertEqual(self.client.get('/charts/nope/').status_code, 404)
+
+    def test_gzip(self):
+        response = self.client.get('/charts/steps/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_etag_not_modified(self):
+        response = self.client.get('/charts/monthly_steps/')
+        self.assertEqual(response.status_code, 200)
+        with mock.patch.object(Visualizer, 'plot') as plot:
+            again = self.client.get('/charts/monthly_steps/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        plot.assert_not_called()
+        Activity(user=self.user.id, timestamp=timezone.now(), steps=10, pulse=80.0).save(using='new_smartband_db')
+        changed = self.client.get('/charts/monthly_steps/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+
+
+@override_settings(BLOG_ANALYSIS_BACKGROUND=True)
+class AnalysisJobTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['charts'].clear()
+        seed_readings(user=1, length=1000, days=7)
+        self.executor = mock.patch.object(analysis_jobs, 'executor').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_concurrent_requests_start_one_job(self):
+        for _ in range(3):
+            self.assertEqual(analysis_jobs.latest(1), (None, True))
+        self.assertEqual(self.executor().submit.call_count, 1)
+        self.assertFalse(analysis_jobs.claim(1))
+
+    def test_dead_job_is_claimed_again(self):
+        self.assertTrue(analysis_jobs.claim(1))
+        AnalysisResult.objects.using('new_smartband_db').filter(user=1).update(
+            started=timezone.now() - analysis_jobs.STALE_AFTER - datetime.timedelta(seconds=1))
+        self.assertTrue(analysis_jobs.claim(1))
+
+    def test_last_result_is_shown_while_refreshing(self):
+        analysis_jobs.claim(1)
+        analysis_jobs.run(1)
+        charts, refreshing = analysis_jobs.latest(1)
+        self.assertFalse(refreshing)
+        self.assertEqual(set(charts), set(ANALYSIS_CHARTS))
+        self.executor().submit.assert_not_called()
+        Activity(user=1, timestamp=timezone.now(), steps=10, pulse=80.0).save(using='new_smartband_db')
+        self.assertEqual(analysis_jobs.latest(1), (charts, True))
+        self.assertEqual(self.executor().submit.call_count, 1)
+
+    def test_failed_job_is_recorded(self):
+        analysis_jobs.claim(1)
+        with mock.patch.object(Visualizer, 'plot_analysis', side_effect=ValueError('boom')), \
+                self.assertLogs('blog.analysis_jobs', 'ERROR'):
+            analysis_jobs.run(1)
+        result = AnalysisResult.objects.using('new_smartband_db').get(user=1)
+        self.assertEqual((result.status, result.version), (AnalysisResult.IDLE, ''))
+        self.assertIn('boom', result.error)
+        # not started again on every request until the readings change
+        self.assertEqual(analysis_jobs.latest(1), (None, False))
+        self.executor().submit.assert_not_called()
+        Activity(user=1, timestamp=timezone.now(), steps=10, pulse=80.0).save(using='new_smartband_db')
+        self.assertEqual(analysis_jobs.latest(1), (None, True))
+        self.assertEqual(self.executor().submit.call_count, 1)
+
+    def test_other_workers_see_the_same_result(self):
+        analysis_jobs.claim(1)
+        analysis_jobs.run(1)
+        # a worker process starts with an empty charts cache
+        caches['charts'].clear()
+        self.assertFalse(analysis_jobs.latest(1)[1])
+        self.executor().submit.assert_not_called()
+        # readings another process backfills without signals
+        Activity.objects.using('new_smartband_db').bulk_create(
+            [Activity(user=1, timestamp=timezone.now() - datetime.timedelta(days=30), steps=10, pulse=80.0)])
+        self.assertTrue(analysis_jobs.latest(1)[1])
+        self.assertEqual(self.executor().submit.call_count, 1)
+
+
+class RenderModeTest(TransactionTestCase):
+    # committed rows, pool threads use their own connections
+    databases = '__all__'
+
+    def setUp(self):
+        seed_readings(user=1, length=3000, days=14)
+        rollups.rebuild()
+
+    def render(self, mode):
+        return Visualizer(user=1, output='json', render_mode=mode).render(list(CHARTS))
+
+    def test_modes_render_identical_charts(self):
+        sequential = self.render('sequential')
+        self.assertTrue(all(sequential.values()))
+        with mock.patch.object(rendering, 'call_in_thread', wraps=rendering.call_in_thread) as call_in_thread:
+            self.assertEqual(self.render('threads'), sequential)
+        self.assertEqual(call_in_thread.call_count, len(set(CHARTS.values())))
+        self.assertEqual(self.render('processes'), sequential)
+
+    def test_sequential_inside_transaction(self):
+        with transaction.atomic(using='new_smartband_db'):
+            with mock.patch.object(rendering, 'call_in_thread') as call_in_thread:
+                self.render('threads')
+        call_in_thread.assert_not_called()
+
+    @override_settings(BLOG_LAZY_CHARTS=False, BLOG_RENDER_MODE='threads')
+    def test_async_home_gathers_on_threads(self):
+        user = User.objects.create_user(username='kamil', password='secret')
+        seed_readings(user=user.id, length=3000, days=14)
+        rollups.rebuild()
+        caches['charts'].clear()
+        self.async_client.force_login(user)
+        with mock.patch.object(rendering, 'call_in_thread', wraps=rendering.call_in_thread) as call_in_thread:
+            response = async_to_sync(self.async_client.get)('/')
+        self.assertEqual(response.content.count(b'Plotly.newPlot('), 6)
+        self.assertEqual(call_in_thread.call_count, len(HOME_CHARTS))
+
+    @override_settings(BLOG_RENDER_MODE='fibers')
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Visualizer(user=1)
+
+
+def reference_lttb(x, y, threshold):
+    # the textbook loop
+    n = len(x)
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    kept = [0]
+    for i in range(threshold - 2):
+        start, stop = int((i + 1) * every) + 1, min(int((i + 2) * every) + 1, n)
+        avg_x = sum(x[start:stop]) / (stop - start)
+        avg_y = sum(y[start:stop]) / (stop - start)
+        areas = [abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+                 for j in range(int(i * every) + 1, int((i + 1) * every) + 1)]
+        a = int(i * every) + 1 + areas.index(max(areas))
+        kept.append(a)
+    return kept + [n - 1]
+
+
+class DownsampleTest(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = np.sort(rng.integers(0, binning.DAY_US, 5000))
+        self.y = rng.normal(80.0, 10.0, 5000)
+
+    def test_lttb_matches_reference(self):
+        x = (self.x - self.x[0]).astype(float)
+        self.assertEqual(downsample.lttb(self.x, self.y, 300).tolist(), reference_lttb(list(x), list(self.y), 300))
+
+    def test_minmax_keeps_extremes(self):
+        keep = downsample.minmax(self.x, self.y, 500)
+        self.assertLessEqual(len(keep), 500)
+        self.assertEqual((keep[0], keep[-1]), (0, 4999))
+        self.assertIn(self.y.argmax(), keep)
+        self.assertIn(self.y.argmin(), keep)
+        self.assertTrue(np.all(np.diff(keep) > 0))
+
+    def test_short_series_unchanged(self):
+        for method in downsample.METHODS:
+            self.assertEqual(downsample.select(self.x[:100], self.y[:100], 2000, method).tolist(), list(range(100)))
+        with self.assertRaises(ValueError):
+            downsample.select(self.x, self.y, 100, 'every-other')
+
+
+class LastDayScatterTest(TestCase):
+    databases = '__all__'
+
+    def test_scatter_is_downsampled(self):
+        seed_readings(user=1, length=20000, days=1)
+        rollups.rebuild()
+        for method in downsample.METHODS:
+            figure = json.loads(Visualizer(user=1, output='json', max_points=500, downsampling=method).plot_last_pulse())
+            scatter = figure['data'][0]
+            self.assertLessEqual(len(scatter['x']), 500)
+            self.assertGreater(len(scatter['x']), 400)
+            self.assertEqual(sorted(scatter['x']), scatter['x'])
+        full = json.loads(Visualizer(user=1, output='json', max_points=10 ** 6).plot_last_pulse())
+        self.assertGreater(len(full['data'][0]['x']), 5000)
+
+
+class WindowStatsTest(SimpleTestCase):
+    def test_matches_recomputation(self):
+        rng = np.random.default_rng(0)
+        t = np.cumsum(rng.integers(1, 120, 3000)) * 1000000
+        values = rng.normal(80.0, 12.0, 3000).round(1)
+        width = 3600 * 1000000
+        stats = live.WindowStats(width, 0.1)
+        for i in range(len(t)):
+            stats.add(int(t[i]), float(values[i]))
+            if i % 97:
+                continue
+            window = values[(t > t[i] - width) & (t <= t[i])]
+            summary = stats.summary()
+            self.assertEqual(summary.count, len(window))
+            self.assertAlmostEqual(summary.mean, window.mean())
+            self.assertAlmostEqual(summary.variance, window.var(), places=6)
+            self.assertEqual((summary.min, summary.max), (window.min(), window.max()))
+            self.assertAlmostEqual(summary.percentiles[50], np.sort(window)[int(0.5 * (len(window) - 1))])
+
+    def test_expires_with_time(self):
+        stats = live.WindowStats(60, 1)
+        stats.add(0, 5)
+        stats.expire(59)
+        self.assertEqual(stats.summary().count, 1)
+        stats.expire(60)
+        self.assertEqual(stats.summary(), live.Summary(0, None, None, None, None, {50: None, 90: None, 99: None}))
+
+
+class LiveStatsTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        seed_readings(user=1, length=2000, days=2)
+        self.engine = live.LiveStats()
+
+    def test_incremental_matches_warm(self):
+        now = timezone.now()
+        self.engine.current(1, now=now)
+        random.seed(1)
+        act_list, drink_list = DataGenerator(1, now, now + datetime.timedelta(hours=2)).rand_multiple_data(300)
+        Activity.objects.using('new_smartband_db').bulk_create(act_list)
+        Drinking.objects.using('new_smartband_db').bulk_create(drink_list)
+        self.engine.add_readings(act_list, drink_list)
+        later = now + datetime.timedelta(hours=2)
+        # only the row counts, the readings of this process are in the windows already
+        with self.assertNumQueries(2, using='new_smartband_db'):
+            incremental = self.engine.current(1, now=later)
+        warm = live.LiveStats().current(1, now=later)
+        for name in live.METRICS:
+            for window in self.engine.windows:
+                a, b = incremental[name][window], warm[name][window]
+                self.assertEqual((a.count, a.min, a.max, a.percentiles), (b.count, b.min, b.max, b.percentiles))
+                if a.count:
+                    self.assertAlmostEqual(a.mean, b.mean)
+
+    def test_saved_readings_reach_engine(self):
+        self.client.force_login(User.objects.create_user(username='kamil', password='secret'))
+        user = User.objects.get(username='kamil').id
+        Activity.objects.using('new_smartband_db').filter(user=user).delete()
+        live.ENGINE.forget(user)
+        self.addCleanup(live.ENGINE.forget, user)
+        self.assertEqual(self.client.get('/live/').json()['pulse']['15min']['count'], 0)
+        Activity(user=user, timestamp=timezone.now(), steps=10, pulse=81.0).save(using='new_smartband_db')
+        ingest.save_readings([Activity(user=user, timestamp=timezone.now(), steps=20, pulse=83.0)], [])
+        pulse = self.client.get('/live/').json()['pulse']['15min']
+        self.assertEqual((pulse['count'], pulse['mean'], pulse['max']), (2, 82.0, 83.0))
+
+    def test_other_processes_reload_the_user(self):
+        now = timezone.now()
+        count = self.engine.current(1, now=now)['pulse'][datetime.timedelta(days=1)].count
+        # written by another process, this engine never sees the readings
+        Activity.objects.using('new_smartband_db').bulk_create(
+            [Activity(user=1, timestamp=now - datetime.timedelta(minutes=1), steps=10, pulse=80.0)])
+        self.assertEqual(self.engine.current(1, now=now)['pulse'][datetime.timedelta(days=1)].count, count + 1)
+        Activity.objects.using('new_smartband_db').filter(
+            user=1, timestamp__gt=now - datetime.timedelta(hours=1))._raw_delete('new_smartband_db')
+        fresh = live.LiveStats().current(1, now=now)
+        self.assertEqual(self.engine.current(1, now=now), fresh)
+
+    def test_purge_forgets_the_user(self):
+        live.ENGINE.current(1)
+        self.addCleanup(live.ENGINE.forget, 1)
+        purge.purge(Activity, user=1, after=timezone.now() - datetime.timedelta(hours=1))
+        self.assertNotIn(1, live.ENGINE.users)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PoolTest(SimpleTestCase):
+    def test_reuse_and_metrics(self):
+        p = pool.Pool(size=2, timeout=0.05)
+        a = p.acquire(FakeConnection)
+        b = p.acquire(FakeConnection)
+        p.release(a)
+        self.assertIs(p.acquire(FakeConnection), a)
+        with self.assertRaises(pool.PoolTimeout):
+            p.acquire(FakeConnection)
+        p.release(b, reusable=False)
+        self.assertTrue(b.closed)
+        p.acquire(FakeConnection)
+        self.assertEqual({k: v for k, v in p.stats().items() if k != 'wait_seconds'},
+                         {'size': 2, 'open': 2, 'idle': 0, 'in_use': 2, 'hits': 1, 'opens': 3,
+                          'waits': 1, 'timeouts': 1, 'discards': 1})
+
+    def test_waiter_gets_released_connection(self):
+        p = pool.Pool(size=1, timeout=5)
+        a = p.acquire(FakeConnection)
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(p.acquire(FakeConnection)))
+        waiter.start()
+        while not p.stats()['waits']:
+            time.sleep(0.001)
+        p.release(a)
+        waiter.join()
+        self.assertEqual((got, p.stats()['waits'], p.stats()['opens']), ([a], 1, 1))
+
+    def test_unhealthy_and_old_connections_are_replaced(self):
+        p = pool.Pool(size=1, max_age=60)
+        a = p.acquire(FakeConnection)
+        p.release(a)
+        b = p.acquire(FakeConnection, check=lambda raw: False)
+        self.assertIsNot(a, b)
+        self.assertTrue(a.closed)
+        p.opened_at[b] -= 61
+        p.release(b)
+        self.assertEqual(p.stats()['discards'], 2)
+
+    def test_sqlite_backend(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: [os.remove(os.path.join(directory, f)) for f in os.listdir(directory)])
+        databases = {'default': {'ENGINE': 'blog.backends.sqlite3', 'NAME': os.path.join(directory, 'pooled.sqlite3'),
+                                 'POOL': {'SIZE': 1, 'TIMEOUT': 0.05}}}
+        connection = ConnectionHandler(databases)['default']
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (x integer)')
+        raw = connection.connection
+        connection.close()
+        # another wrapper of the same alias, e.g. the next request's thread
+        other = ConnectionHandler(databases)['default']
+        with other.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM t')
+        self.assertIs(other.connection, raw)
+        with self.assertLogs('blog.backends.pool', 'WARNING'), self.assertRaises(OperationalError):
+            connection.ensure_connection()
+        other.close()
+        stats = connection.pool().stats()
+        self.assertEqual((stats['opens'], stats['hits'], stats['timeouts'], stats['idle']), (1, 1, 1, 1))
+        self.assertEqual(pool.stats()['default:%s' % connection.settings_dict['NAME']], stats)
+        raw.close()
+
+    def test_persistent_connections_are_pinged(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # in-memory SQLite connections are never closed
+        handler = ConnectionHandler({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory.name, 'a.sqlite3'),
+                        'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True},
+            'unchecked': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory.name, 'b.sqlite3'),
+                          'CONN_MAX_AGE': 60}})
+        for connection in handler.all():
+            connection.ensure_connection()
+        with mock.patch.object(health, 'connections', handler), \
+                mock.patch.object(type(handler['default']), 'is_usable', return_value=False) as is_usable, \
+                self.assertLogs('blog.backends.health', 'INFO'):
+            health.check_connections()
+        self.assertEqual(is_usable.call_count, 1)
+        self.assertIsNone(handler['default'].connection)
+        self.assertIsNotNone(handler['unchecked'].connection)
+        handler.close_all()
+
+
+# the test database of default has the blog tables as well and stands in for a replica
+@override_settings(BLOG_READ_REPLICAS=['default'])
+class RouterTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        routers.pin_to_primary(0)
+        routers.forget_lags()
+        self.addCleanup(routers.forget_lags)
+        self.router = routers.SmartbandRouter()
+
+    def test_reads_go_to_replica(self):
+        seed_readings(user=1, length=50)
+        now = timezone.now()
+        Activity.objects.using('default').create(user=1, timestamp=now, steps=1, pulse=60.0)
+        self.assertEqual(len(DataSnapshot(1).activity.timestamp), 1)
+        self.assertEqual(len(DataSnapshot(1, using='new_smartband_db').activity.timestamp), 50)
+        self.assertEqual(self.router.db_for_read(HourlyRollup), 'default')
+        # job claims and everything outside the readings stay where they were
+        self.assertEqual(self.router.db_for_read(AnalysisResult), 'new_smartband_db')
+        self.assertIsNone(self.router.db_for_read(Post))
+
+    def test_writes_go_to_primary_and_pin_reads(self):
+        self.assertEqual(self.router.db_for_read(Activity), 'default')
+        Activity.objects.create(user=1, timestamp=timezone.now(), steps=1, pulse=60.0)
+        self.assertEqual(Activity.objects.using('new_smartband_db').filter(user=1).count(), 1)
+        self.assertFalse(Activity.objects.using('default').filter(user=1).exists())
+        self.assertEqual(self.router.db_for_read(Activity), 'new_smartband_db')
+        routers.pin_to_primary(0)
+        self.assertEqual(self.router.db_for_read(Activity), 'default')
+
+    @override_settings(BLOG_REPLICA_MAX_LAG=5)
+    def test_lagging_replica_is_skipped(self):
+        for lag, alias in [(60, 'new_smartband_db'), (None, 'new_smartband_db'), (3, 'default')]:
+            routers.forget_lags()
+            with mock.patch.object(routers, 'measure_lag', return_value=lag):
+                self.assertEqual(self.router.db_for_read(Drinking), alias)
+
+    def test_lag_is_checked_once_per_interval(self):
+        with mock.patch.object(routers, 'measure_lag', return_value=0) as measure_lag:
+            for _ in range(10):
+                self.router.db_for_read(Activity)
+        self.assertEqual(measure_lag.call_count, 1)
+
+    def test_no_replicas(self):
+        with self.settings(BLOG_READ_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(Activity), 'new_smartband_db')
+        self.assertFalse(self.router.allow_migrate('default', 'blog', 'activity'))
+
+
+@override_settings(BLOG_LAZY_CHARTS=False, BLOG_ANALYSIS_BACKGROUND=False)
+class InstrumentationTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['charts'].clear()
+        self.user = User.objects.create_user(username='kamil', password='secret')
+        seed_readings(user=self.user.id, length=3000, days=14)
+        rollups.rebuild()
+        self.client.force_login(self.user)
+
+    def test_measure(self):
+        with self.assertLogs('blog.instrumentation', 'INFO') as logs:
+            v = Visualizer(user=self.user.id)
+            chart = v.plot_steps()
+        timings = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual([t['name'] for t in timings], ['serialize', 'plot_week', 'plot_steps'])
+        steps = timings[-1]
+        self.assertEqual(steps['bytes'], len(chart))
+        # the weekly cells
+        self.assertEqual(steps['queries'], 1)
+        self.assertGreater(steps['seconds'], timings[0]['seconds'])
+        self.assertEqual(timings[0]['queries'], 0)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/')
+        entries = re.findall(r'(\w+);dur=[\d.]+;desc="[^"]*"', response['Server-Timing'])
+        self.assertEqual(entries[-1], 'home')
+        self.assertEqual(entries.count('serialize'), 6)
+        self.assertIn('plot_monthly_steps', entries)
+        self.assertRegex(response['Server-Timing'],
+                         r'home;dur=[\d.]+;desc="\d+ queries, db [\d.]+ ms, cpu [\d.]+ ms, \d+ bytes"$')
+
+    def test_server_timing_header_async(self):
+        async def view(request):
+            pass
+
+        self.assertTrue(asyncio.iscoroutinefunction(ServerTimingMiddleware(view)))
+        self.async_client.force_login(self.user)
+        # the handler logs every adapted middleware with DEBUG
+        with self.settings(DEBUG=True), mock.patch('django.core.handlers.base.logger') as handler_logger:
+            response = async_to_sync(self.async_client.get)('/analysis/')
+        self.assertNotIn('adapted', str(handler_logger.debug.call_args_list))
+        entries = re.findall(r'(\w+);dur=[\d.]+;desc="[^"]*"', response['Server-Timing'])
+        self.assertEqual(entries[-1], 'analysis')
+
+    def test_profile_dump(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(BLOG_PROFILE_REQUESTS=True, BLOG_PROFILE_DIR=directory):
+                self.client.get('/analysis/')
+            dumps = os.listdir(directory)
+            self.assertEqual(len(dumps), 1)
+            self.assertIn('-analysis-', dumps[0])
+
+
+class BenchmarkCompareTest(SimpleTestCase):
+    def results(self, **metrics):
+        case = {'seconds': 0.5, 'queries': 2, 'peak_bytes': 10 ** 6, 'bytes': 20000}
+        case.update(metrics)
+        return {'results': {'1000': {'Visualizer.plot_analysis': case}}}
+
+    def test_regressions(self):
+        from benchmarks.dashboard import regressions
+        baseline = self.results()
+        self.assertEqual(regressions(baseline, self.results(seconds=0.6, bytes=24000), 0.25, 0, 0.05), [])
+        self.assertEqual(regressions(baseline, self.results(queries=1002), 0.25, 0, 0.05),
+                         [('1000', 'Visualizer.plot_analysis', 'queries', 2, 1002)])
+        self.assertEqual(len(regressions(baseline, self.results(seconds=0.7, peak_bytes=2 * 10 ** 6), 0.25, 0, 0.05)), 2)
+        # fast cases are too noisy to compare
+        self.assertEqual(regressions(self.results(seconds=0.01), self.results(seconds=0.03), 0.25, 0, 0.05), [])
+
+
+class IngestTest(TestCase):
+    databases = '__all__'
+
+    def records(self, n, start=datetime.datetime(2018, 11, 5, tzinfo=timezone.utc)):
+        for i in range(n):
+            yield {'timestamp': start + datetime.timedelta(minutes=i), 'steps': i % 30,
+                   'pulse': 80.0 + i % 7, 'alcohol': 0.1 if i % 3 == 0 else None}
+
+    def test_batches(self):
+        result = ingest.ingest(self.records(1000), user=3, batch_size=128)
+        self.assertEqual((result.accepted, result.rejected), (1000, 0))
+        self.assertEqual((result.activities, result.drinks), (1000, 334))
+        self.assertEqual(Activity.objects.using('new_smartband_db').filter(user=3).count(), 1000)
+        self.assertEqual(Drinking.objects.using('new_smartband_db').filter(user=3).count(), 334)
+        self.assertGreater(result.rows_per_second, 0)
+
+    def test_rollups_follow_bulk_inserts(self):
+        ingest.ingest(self.records(1000), user=3, batch_size=100)
+        hourly = list(HourlyRollup.objects.using('new_smartband_db').order_by('timestamp').
+                      values_list('timestamp', 'activity_count', 'steps_sum', 'drinking_count'))
+        rollups.rebuild()
+        rebuilt = list(HourlyRollup.objects.using('new_smartband_db').order_by('timestamp').
+                       values_list('timestamp', 'activity_count', 'steps_sum', 'drinking_count'))
+        self.assertEqual(hourly, rebuilt)
+
+    def test_invalid_records_are_rejected(self):
+        records = [
+            {'timestamp': '2018-11-05T10:00:00Z', 'steps': '12', 'pulse': '81.5'},
+            {'timestamp': 'yesterday', 'steps': 1},
+            {'timestamp': '2018-11-05T10:01:00', 'steps': -4},
+            {'timestamp': 1541412120, 'pulse': 'nan'},
+            {'steps': 3},
+            {'timestamp': 1541412180},
+            None,
+            {'timestamp': 1541412240, 'alcohol': 0.4, 'user': 8},
+        ]
+        result = ingest.ingest(records, user=3)
+        self.assertEqual((result.accepted, result.rejected), (2, 6))
+        self.assertEqual(len(result.errors), 6)
+        self.assertTrue(Drinking.objects.using('new_smartband_db').filter(user=8, alcohol=0.4).exists())
+
+    def test_out_of_range_records_are_rejected(self):
+        records = [
+            {'timestamp': 1e20, 'steps': 1},
+            {'timestamp': 'inf', 'steps': 1},
+            {'timestamp': '-1e300', 'steps': 1},
+            {'timestamp': 1541412000, 'steps': '1e400'},
+            {'timestamp': 1541412000, 'steps': 10 ** 400},
+            {'timestamp': 1541412000, 'steps': ingest.MAX_INTEGER + 1},
+            {'timestamp': 1541412000, 'pulse': 'inf'},
+            {'timestamp': 1541412000, 'alcohol': '-inf'},
+            {'timestamp': 1541412000, 'steps': 1, 'user': 2 ** 40},
+            {'timestamp': 1541412060, 'steps': ingest.MAX_INTEGER},
+        ]
+        result = ingest.ingest(records, user=3)
+        self.assertEqual((result.accepted, result.rejected), (1, 9))
+        self.assertEqual(Activity.objects.using('new_smartband_db').get(user=3).steps, ingest.MAX_INTEGER)
+
+    def test_csv_and_ndjson(self):
+        csv_lines = io.StringIO('timestamp,steps,pulse,alcohol\n2018-11-05 10:00:00,5,80,\n2018-11-05 10:01:00,6,82,0.2\n')
+        self.assertEqual(list(ingest.iter_csv(csv_lines))[1],
+                         {'timestamp': '2018-11-05 10:01:00', 'steps': '6', 'pulse': '82', 'alcohol': '0.2'})
+        headless = list(ingest.iter_csv(['2018-11-05 10:00:00,5,80,0.1']))
+        self.assertEqual(headless, [{'timestamp': '2018-11-05 10:00:00', 'steps': '5', 'pulse': '80', 'alcohol': '0.1'}])
+        ndjson = list(ingest.iter_ndjson(['{"timestamp": 1, "steps": 2}', '', 'oops']))
+        self.assertEqual(ndjson, [{'timestamp': 1, 'steps': 2}, None])
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('timestamp,steps,pulse,alcohol\n2018-11-05 10:00:00,5,80,\n2018-11-05 10:01:00,6,82,0.2\n')
+            f.flush()
+            out = io.StringIO()
+            call_command('ingest_readings', f.name, user=4, stdout=out)
+        self.assertIn('2 accepted, 0 rejected, 3 rows', out.getvalue())
+
+
+class UploadTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='kamil', password='secret')
+        self.client.force_login(self.user)
+
+    def test_ndjson(self):
+        body = '\n'.join(['{"timestamp": "2018-11-05T10:%02d:00Z", "steps": %d, "pulse": 80.5, "user": 99}' % (i, i)
+                          for i in range(60)] + ['not json', '{"timestamp": "2018-11-05T11:00:00Z", "alcohol": 0.3}'])
+        response = self.client.post('/upload/', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['accepted'], 61)
+        self.assertEqual(response.json()['rejected'], 1)
+        self.assertEqual(Activity.objects.using('new_smartband_db').filter(user=self.user.id).count(), 60)
+        self.assertEqual(Drinking.objects.using('new_smartband_db').filter(user=self.user.id).count(), 1)
+
+    def test_csv_is_flushed_in_batches(self):
+        body = 'timestamp,steps,pulse,alcohol\n' + ''.join(
+            '%d,%d,81,0.1\n' % (1541412000 + 60 * i, i % 20) for i in range(5000))
+        with mock.patch('blog.ingest.save_readings', wraps=ingest.save_readings) as save:
+            response = self.client.post('/upload/', data=body, content_type='text/csv')
+        self.assertEqual(response.json()['rows'], 10000)
+        self.assertEqual(save.call_count, 10000 // ingest.BATCH_SIZE)
+        self.assertEqual(Drinking.objects.using('new_smartband_db').filter(user=self.user.id).count(), 5000)
+
+    def test_requires_login_and_post(self):
+        self.assertEqual(self.client.get('/upload/').status_code, 405)
+        self.assertEqual(self.client.post('/upload/', data='x', content_type='image/png').status_code, 415)
+        self.client.logout()
+        self.assertEqual(self.client.post('/upload/', data='', content_type='text/csv').status_code, 302)
+
+    def basic_auth(self, password):
+        return 'Basic ' + base64.b64encode(('kamil:' + password).encode()).decode()
+
+    def test_device_basic_auth_needs_no_csrf_token(self):
+        device = Client(enforce_csrf_checks=True)
+        body = '{"timestamp": "2018-11-05T10:00:00Z", "steps": 3, "pulse": 80.5}'
+        response = device.post('/upload/', data=body, content_type='application/x-ndjson',
+                               HTTP_AUTHORIZATION=self.basic_auth('secret'))
+        self.assertEqual(response.json()['accepted'], 1)
+        self.assertEqual(Activity.objects.using('new_smartband_db').filter(user=self.user.id).count(), 1)
+        response = device.post('/upload/', data=body, content_type='application/x-ndjson',
+                               HTTP_AUTHORIZATION=self.basic_auth('wrong'))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Basic', response['WWW-Authenticate'])
+
+    def test_session_upload_is_csrf_checked(self):
+        browser = Client(enforce_csrf_checks=True)
+        browser.force_login(self.user)
+        body = 'timestamp,steps,pulse,alcohol\n1541412000,3,81,\n'
+        self.assertEqual(browser.post('/upload/', data=body, content_type='text/csv').status_code, 403)
+        browser.get('/login/')
+        response = browser.post('/upload/', data=body, content_type='text/csv',
+                                HTTP_X_CSRFTOKEN=browser.cookies['csrftoken'].value)
+        self.assertEqual(response.json()['accepted'], 1)
+
+
+class ArrayGeneratorTest(SimpleTestCase):
+    def generator(self):
+        start = datetime.datetime(2018, 10, 1, tzinfo=timezone.utc)
+        return DataGenerator(1, start, start + datetime.timedelta(days=28))
+
+    def test_reproducible(self):
+        a = list(self.generator().iter_chunks(10000, chunk_size=3000, seed=5))
+        b = list(self.generator().iter_chunks(10000, chunk_size=3000, seed=5))
+        self.assertEqual([len(c.timestamp) for c in a], [3000, 3000, 3000, 1000])
+        for x, y in zip(a, b):
+            np.testing.assert_array_equal(x.pulse, y.pulse)
+            np.testing.assert_array_equal(x.alcohol, y.alcohol)
+
+    def test_rules(self):
+        gen = self.generator()
+        r = gen.rand_arrays(3000, np.random.RandomState(0))
+        for t, steps, pulse, alco in zip(r.timestamp, r.steps, r.pulse, r.alcohol):
+            moment = datetime.datetime.fromtimestamp(t / 1e6, timezone.utc)
+            weekday, hour = moment.weekday(), moment.hour
+            alco = None if np.isnan(alco) else alco
+            # rand_* with random.random() pinned to 0 and to 1 bound every value
+            with mock.patch('random.random', return_value=1.0):
+                max_alco = gen.rand_alco(weekday, hour)
+                max_steps = gen.rand_steps(weekday, hour, alco)
+                max_pulse = gen.rand_pulse(weekday, hour, steps, alco)
+            with mock.patch('random.random', return_value=0.0):
+                min_pulse = gen.rand_pulse(weekday, hour, steps, alco)
+            self.assertEqual(alco is None, max_alco is None)
+            if alco is not None:
+                self.assertLessEqual(alco, max_alco)
+            self.assertLessEqual(steps, max_steps)
+            self.assertTrue(min_pulse <= pulse <= max_pulse)
+
+    def test_models_and_csv(self):
+        readings = next(self.generator().iter_chunks(500, seed=1))
+        act_list, drink_list = data_generator.readings_models(readings)
+        self.assertEqual(len(act_list), 500)
+        self.assertEqual(len(drink_list), np.count_nonzero(~np.isnan(readings.alcohol)))
+        f = io.StringIO()
+        self.assertEqual(data_generator.write_csv([readings], f), 500)
+        f.seek(0)
+        records = list(ingest.iter_csv(f))
+        self.assertEqual(len(records), 500)
+        self.assertEqual(ingest.parse_timestamp(records[0]['timestamp']), act_list[0].timestamp)
+
+
+class ArchiveTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        seed_readings(user=1, length=1500, days=40)
+
+    def months(self):
+        return archive.user_months(1, 'new_smartband_db')
+
+    def test_round_trip(self):
+        for compress in (False, True):
+            paths = archive.export(self.root, users=[1], compress=compress)
+            self.assertEqual(len(paths), len(self.months()))
+            snapshot = DataSnapshot(1)
+            stored = archive.ArchiveSnapshot(paths)
+            np.testing.assert_array_equal(stored.activity.timestamp, snapshot.activity.timestamp)
+            np.testing.assert_array_equal(stored.activity.steps, snapshot.activity.steps)
+            np.testing.assert_allclose(stored.activity.pulse, snapshot.activity.pulse, rtol=1e-6)
+            np.testing.assert_array_equal(stored.drinking.timestamp, snapshot.drinking.timestamp)
+            np.testing.assert_allclose(stored.drinking.alcohol, snapshot.drinking.alcohol, rtol=1e-6)
+
+    def test_columns_are_views_of_the_file(self):
+        path = archive.export(self.root, users=[1], months=[self.months()[-1]])[0]
+        header, activity, drinking = archive.load_month(path)
+        self.assertEqual(header['columns']['activity.steps']['offset'] % archive.ALIGN, 0)
+        self.assertEqual((activity.steps.dtype, activity.pulse.dtype), (np.uint16, np.float32))
+        self.assertIsInstance(activity.steps, np.memmap)
+        self.assertIsInstance(drinking.alcohol, np.memmap)
+        # timestamps are decoded once from their differences
+        self.assertEqual(activity.timestamp.dtype, np.int64)
+        self.assertTrue(np.all(np.diff(activity.timestamp) >= 0))
+
+    def test_compression_shrinks_timestamps(self):
+        month = [self.months()[-1]]
+        plain = archive.read_header(archive.export(os.path.join(self.root, 'plain'), users=[1], months=month)[0])
+        packed = archive.read_header(archive.export(os.path.join(self.root, 'packed'), users=[1], months=month,
+                                                    compress=True)[0])
+        column = 'activity.timestamp'
+        self.assertLess(packed['columns'][column]['nbytes'], plain['columns'][column]['nbytes'])
+
+    def test_visualizer_charts_archive(self):
+        archive.export(self.root, users=[1])
+        stored = Visualizer(user=1, snapshot=archive.ArchiveSnapshot.of_user(self.root, 1), min_3d_values=0)
+        live = Visualizer(user=1, min_3d_values=0)
+        with self.assertNumQueries(0, using='new_smartband_db'):
+            count, z = stored.week_means('steps')
+            self.assertIsNotNone(stored.plot_steps())
+            self.assertEqual(len(stored.plot_analysis()), 2)
+        live_count, live_z = live.week_means('steps')
+        self.assertEqual(count, live_count)
+        np.testing.assert_array_equal(z, live_z)
+
+    def rollup_counts(self, model, field='activity_count'):
+        return sum(model.objects.using('new_smartband_db').filter(user=1).values_list(field, flat=True))
+
+    def test_import(self):
+        rollups.rebuild(1)
+        paths = archive.export(self.root, users=[1])
+        with self.assertRaises(ValueError):
+            archive.import_month(paths[0])
+        count = Activity.objects.using('new_smartband_db').filter(user=1).count()
+        drinks = Drinking.objects.using('new_smartband_db').filter(user=1, alcohol__isnull=False).count()
+        for path in paths:
+            archive.import_month(path, replace=True)
+        self.assertEqual(Activity.objects.using('new_smartband_db').filter(user=1).count(), count)
+        # the replaced months leave the rollups, the saved readings enter them through ingest
+        for model in (HourlyRollup, DailyRollup, WeeklyCell):
+            self.assertEqual(self.rollup_counts(model), count)
+            self.assertEqual(self.rollup_counts(model, 'drinking_count'), drinks)
+
+    def test_import_restores_retained_days(self):
+        rollups.rebuild(1)
+        half_width = 450000000
+        materialized.update(1, half_width, 0.2, 10)
+        count = Activity.objects.using('new_smartband_db').filter(user=1).count()
+        drinks = Drinking.objects.using('new_smartband_db').filter(user=1, alcohol__isnull=False).count()
+        paths = archive.export(self.root, users=[1])
+        for model in (Activity, Drinking):
+            purge.retention(model, days=10)
+        self.assertLess(Activity.objects.using('new_smartband_db').filter(user=1).count(), count)
+        for path in paths:
+            # only the last month still has raw readings
+            archive.import_month(path, replace=path == paths[-1])
+        self.assertEqual(Activity.objects.using('new_smartband_db').filter(user=1).count(), count)
+        # the restored days are not counted twice, the retained history of the others survives the replace
+        for model in (HourlyRollup, DailyRollup, WeeklyCell):
+            self.assertEqual(self.rollup_counts(model), count)
+            self.assertEqual(self.rollup_counts(model, 'drinking_count'), drinks)
+        analysis = materialized.update(1, half_width, 0.2, 10)
+        self.assertEqual((analysis.activity_count, analysis.drinking_count), (count, drinks))
+        self.assertEqual(DrinkWindow.objects.using('new_smartband_db').filter(user=1).count(), drinks)
+
+    def test_steps_must_fit(self):
+        Activity.objects.using('new_smartband_db').create(user=1, timestamp=timezone.now(), steps=70000, pulse=1.0)
+        with self.assertRaises(ValueError):
+            archive.export(self.root, users=[1])
+
+    def test_commands(self):
+        out = io.StringIO()
+        call_command('export_readings', self.root, '--user', '1', '--compress', stdout=out)
+        self.assertIn('months exported', out.getvalue())
+        path = archive.user_paths(self.root, 1)[0]
+        call_command('import_readings', path, '--replace', stdout=out)
+        self.assertIn('readings saved', out.getvalue())
+
+
+class PurgeTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.now = timezone.now()
+        seed_readings(user=1, length=2000, days=20)
+        seed_readings(user=2, length=500, days=20, seed=1)
+        rollups.rebuild()
+
+    def activities(self, **filters):
+        return Activity.objects.using('new_smartband_db').filter(**filters)
+
+    def test_purge_user_range_in_chunks(self):
+        before = self.now - datetime.timedelta(days=10)
+        expected = self.activities(user=1, timestamp__lt=before).count()
+        progress = mock.Mock()
+        result = purge.purge(Activity, user=1, before=before, chunk_size=100, progress=progress)
+        self.assertEqual(result.deleted, expected)
+        self.assertEqual(result.chunks, -(-expected // 100))
+        self.assertEqual(progress.call_count, result.chunks)
+        self.assertFalse(self.activities(user=1, timestamp__lt=before).exists())
+        self.assertEqual(self.activities(user=2).count(), 500)
+        for model in (HourlyRollup, DailyRollup):
+            counts = model.objects.using('new_smartband_db').filter(user=1).values_list('activity_count', flat=True)
+            self.assertEqual(sum(counts), self.activities(user=1).count())
+        cells = WeeklyCell.objects.using('new_smartband_db').filter(user=1).values_list('activity_count', flat=True)
+        self.assertEqual(sum(cells), self.activities(user=1).count())
+
+    def test_purge_keeps_retained_history(self):
+        retained = self.activities(user=1).count()
+        purge.retention(Activity, days=10, now=self.now)
+        recent = self.now - datetime.timedelta(days=2)
+        purged = purge.purge(Activity, user=1, after=recent).deleted
+        self.assertGreater(purged, 0)
+        # the days retention dropped stay in the rollups
+        for model in (HourlyRollup, DailyRollup, WeeklyCell):
+            counts = model.objects.using('new_smartband_db').filter(user=1).values_list('activity_count', flat=True)
+            self.assertEqual(sum(counts), retained - purged)
+        self.assertFalse(DailyRollup.objects.using('new_smartband_db').filter(
+            user=1, timestamp__gte=recent + datetime.timedelta(days=1), activity_count__gt=0).exists())
+
+    def test_retention_keeps_days_missing_from_rollups(self):
+        old = self.now - datetime.timedelta(days=15)
+        Activity.objects.using('new_smartband_db').bulk_create(
+            [Activity(user=3, timestamp=old, steps=1, pulse=80.0)])
+        result = purge.retention(Activity, days=7, chunk_size=250, now=self.now)
+        cutoff = (self.now - datetime.timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.assertEqual([u for u, _ in result.skipped_days], [3])
+        self.assertEqual(list(self.activities(timestamp__lt=cutoff).values_list('user', flat=True)), [3])
+        self.assertTrue(self.activities(timestamp__gte=cutoff).exists())
+        self.assertEqual(sum(HourlyRollup.objects.using('new_smartband_db').values_list('activity_count', flat=True)),
+                         2500)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('purge_readings', user=2, chunk_size=200, stdout=out)
+        self.assertIn('activity: 500 rows deleted in 3 chunks', out.getvalue())
+        self.assertFalse(Drinking.objects.using('new_smartband_db').filter(user=2).exists())
+        self.assertEqual(self.activities(user=1).count(), 2000)
+
+
+class PartitionTest(SimpleTestCase):
+    existing = ['p201810', 'p201811', 'p201812', 'p201901', 'pmax']
+
+    def moment(self, *args):
+        return datetime.datetime(*args, tzinfo=timezone.utc)
+
+    def test_partition_for(self):
+        self.assertEqual(partitions.partition_for(self.moment(2018, 11, 30, 23, 59), self.existing), 'p201811')
+        self.assertEqual(partitions.partition_for(self.moment(2018, 12, 1), self.existing), 'p201812')
+        self.assertEqual(partitions.partition_for(self.moment(2017, 1, 1), self.existing), 'p201810')
+        self.assertEqual(partitions.partition_for(self.moment(2019, 2, 1), self.existing), 'pmax')
+
+    def test_last_day_and_month_prune(self):
+        now = self.moment(2018, 12, 1, 8)
+        last_day = partitions.partitions_for_range(now - datetime.timedelta(days=1), now, self.existing)
+        self.assertEqual(last_day, ['p201811', 'p201812'])
+        now = self.moment(2018, 12, 20)
+        last_month = partitions.partitions_for_range(now - datetime.timedelta(days=31), now, self.existing)
+        self.assertEqual(last_month, ['p201811', 'p201812'])
+        self.assertEqual(partitions.partitions_for_range(self.moment(2018, 12, 5), self.moment(2018, 12, 6),
+                                                         self.existing), ['p201812'])
+        self.assertEqual(partitions.partitions_for_range(self.moment(2000, 1, 1), self.moment(2030, 1, 1),
+                                                         self.existing), self.existing)
+
+    def test_sql(self):
+        months = list(partitions.months_between(self.moment(2018, 11, 5), self.moment(2019, 1, 1)))
+        sql = partitions.partition_table_sql('blog_activity', months)
+        self.assertIn('ADD PRIMARY KEY (id, timestamp)', sql[0])
+        self.assertIn("PARTITION p201812 VALUES LESS THAN (TO_DAYS('2019-01-01'))", sql[1])
+        self.assertTrue(sql[1].endswith('PARTITION pmax VALUES LESS THAN MAXVALUE)'))
+        missing = partitions.missing_months(self.existing, datetime.date(2019, 3, 1))
+        self.assertEqual(missing, [datetime.date(2019, 2, 1), datetime.date(2019, 3, 1)])
+        self.assertEqual(partitions.add_partitions_sql('blog_drinking', missing), [
+            "ALTER TABLE blog_drinking REORGANIZE PARTITION pmax INTO ("
+            "PARTITION p201902 VALUES LESS THAN (TO_DAYS('2019-03-01')), "
+            "PARTITION p201903 VALUES LESS THAN (TO_DAYS('2019-04-01')), "
+            "PARTITION pmax VALUES LESS THAN MAXVALUE)"])
+
+    def test_command_dry_run(self):
+        connection = mock.Mock(vendor='mysql')
+        out = io.StringIO()
+        with mock.patch('blog.management.commands.create_partitions.connections', {'new_smartband_db': connection}), \
+                mock.patch.object(partitions, 'existing_partitions', return_value=self.existing), \
+                mock.patch('django.utils.timezone.now', return_value=self.moment(2019, 1, 15)):
+            call_command('create_partitions', months_ahead=2, dry_run=True, stdout=out)
+        self.assertIn('REORGANIZE PARTITION pmax INTO (PARTITION p201902', out.getvalue())
+        self.assertIn('blog_activity: 2 partitions added, up to p201903', out.getvalue())
+        connection.cursor.assert_not_called()
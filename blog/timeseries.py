@@ -0,0 +1,57 @@
+import datetime
+import numpy as np
+from django.utils import timezone
+
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_UTC = EPOCH.replace(tzinfo=timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_epoch(timestamps):
+    # int64 microseconds since 1970-01-01 UTC, exact for both aware and naive datetimes
+    return np.array([((t - EPOCH_UTC) if t.tzinfo is not None else (t - EPOCH)) // MICROSECOND
+                     for t in timestamps], dtype=np.int64)
+
+
+def from_epoch(us):
+    # aware UTC datetime of to_epoch microseconds
+    return EPOCH_UTC + datetime.timedelta(microseconds=int(us))
+
+
+def to_microseconds(delta):
+    return delta // MICROSECOND
+
+
+def window_sums(centers, timestamps, values, half_width):
+    """Count and sum of ``values`` with timestamp in [center - half_width, center + half_width].
+
+    ``timestamps`` must be sorted ascending. Every window is answered with two binary
+    searches over the sorted timestamps and a difference of prefix sums.
+    """
+    left = np.searchsorted(timestamps, centers - half_width, side='left')
+    right = np.searchsorted(timestamps, centers + half_width, side='right')
+    prefix = np.zeros(len(values) + 1, dtype=np.result_type(values, np.int64))
+    np.cumsum(values, out=prefix[1:])
+    return right - left, prefix[right] - prefix[left]
+
+
+def window_join(drink_timestamps, alcohol, act_timestamps, steps, pulse, half_width):
+    """Mean steps and pulse in the activity window around every drink.
+
+    Drinks without any activity in their window are dropped, the rest keep their
+    input order. Returns ``(alcohol, mean_steps, mean_pulse)`` as lists.
+    """
+    drink_timestamps = np.asarray(drink_timestamps, dtype=np.int64)
+    act_timestamps = np.asarray(act_timestamps, dtype=np.int64)
+    order = np.argsort(act_timestamps, kind='stable')
+    act_timestamps = act_timestamps[order]
+    steps = np.asarray(steps, dtype=np.int64)[order]
+    pulse = np.asarray(pulse, dtype=np.float64)[order]
+
+    counts, steps_sum = window_sums(drink_timestamps, act_timestamps, steps, half_width)
+    _, pulse_sum = window_sums(drink_timestamps, act_timestamps, pulse, half_width)
+    found = counts > 0
+    x = np.asarray(alcohol, dtype=np.float64)[found]
+    y = steps_sum[found] / counts[found]
+    z = pulse_sum[found] / counts[found]
+    return x.tolist(), y.tolist(), z.tolist()
@@ -5,4 +5,8 @@ urlpatterns = [
     path('', views.home, name='blog-home'),
     path('analysis/', views.analysis, name='blog-analysis'),
     path('about/', views.about, name='blog-about'),
+    path('charts/<str:name>/', views.chart_data, name='blog-chart'),
+    path('upload/', views.upload, name='blog-upload'),
+    path('live/', views.live_stats, name='blog-live'),
+    path('pools/', views.pool_stats, name='blog-pools'),
 ]
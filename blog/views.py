@@ -1,5 +1,14 @@
+import base64
+import binascii
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_POST
 from django.contrib.auth.models import User
 from .models import Post
 from .models import Stats
@@ -7,8 +16,16 @@ from .models import Test
 from .models import Drinking
 from .models import Activity
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.auth import authenticate
+from django.middleware.csrf import CsrfViewMiddleware
 
 from .visualizer import *
+from .chart_cache import ChartCache
+from . import analysis_jobs, ingest, live
+from .backends import pool
+from .instrumentation import instrumented
 
 posts = [
     {
@@ -24,51 +41,166 @@ posts = [
         'date_posted': 'October 18, 2018'
     }
 ]
+
+def lazy_charts():
+    return getattr(settings, 'BLOG_LAZY_CHARTS', True)
+
+
+def chart_shell(request, template, user, names, **context):
+    context.update({
+        'lazy_charts': True,
+        'chart_urls': [reverse('blog-chart', args=[name]) for name in names],
+        'user_db_id': user.id
+    })
+    return render(request, template, context)
+
+
+def db_user(request):
+    if not request.user.is_authenticated:
+        return None
+    return User.objects.filter(username=request.user).first()
+
+
 # Create your views here.
-def home(request):
-    current_user = User.objects.filter(username=request.user).first()
+# home and analysis are async: under ASGI (django_project/asgi.py) the event loop
+# serves other requests while their queries and charts run on threads
+@instrumented()
+async def home(request):
+    current_user = await sync_to_async(db_user)(request)
     if current_user is None:
-        return render(request, 'blog/home.html', {})
+        return await sync_to_async(render)(request, 'blog/home.html', {})
+    if lazy_charts():
+        return await sync_to_async(chart_shell)(request, 'blog/home.html', current_user, HOME_CHARTS)
     v = Visualizer(user=current_user.id)
-    context = {
-        #'posts': Post.objects.all()
-        #'stats': Stats.objects.all()
-        #'tests': Test.objects.using('smartband_database').all(),
-        #'drinking' : Drinking.objects.using('new_smartband_db').order_by('-timestamp').all(),
-        #'activity': Activity.objects.using('new_smartband_db').order_by('-timestamp').all(),
-        'last_alcohol': v.plot_last_alcohol(),
-        'last_steps': v.plot_last_steps(),
-        'last_pulse': v.plot_last_pulse(),
-        'monthly_alcohol': v.plot_monthly_alcohol(),
-        'monthly_steps': v.plot_monthly_steps(),
-        'monthly_pulse': v.plot_monthly_pulse(),
-        'user_db_id': current_user.id
-    }
-    return render(request, 'blog/home.html', context)
+    charts = ChartCache(user=current_user.id)
+    context = await sync_to_async(charts.get_cached)(HOME_CHARTS)
+    missing = [name for name in HOME_CHARTS if name not in context]
+    if missing:
+        # the missing charts are rendered concurrently, see BLOG_RENDER_MODE
+        rendered = await v.arender(missing)
+        await sync_to_async(charts.set_many)(rendered)
+        context.update(rendered)
+    context['user_db_id'] = current_user.id
+    return await sync_to_async(render)(request, 'blog/home.html', context)
 
-@login_required
-def analysis(request):
-    current_user = User.objects.filter(username=request.user).first()
+@instrumented()
+async def analysis(request):
+    current_user = await sync_to_async(db_user)(request)
     if current_user is None:
-        return render(request, 'blog/analysis.html', {})
-    v = Visualizer(user=current_user.id)
-    analysis = v.plot_analysis()
-    context = {
-        #'posts': Post.objects.all()
-        #'stats': Stats.objects.all()
-        #'tests': Test.objects.using('smartband_database').all(),
-        #'drinking' : Drinking.objects.using('new_smartband_db').order_by('-timestamp').all(),
-        #'activity': Activity.objects.using('new_smartband_db').order_by('-timestamp').all(),
-        #'user_id': current_user_id,
-        'alcohol': v.plot_alcohol(),
-        'steps': v.plot_steps(),
-        'pulse': v.plot_pulse(),
-        'activity': v.plot_activity(),
-        'analysis2d': analysis[0],
-        'analysis3d': analysis[1],
+        # login_required does not wrap async views
+        return redirect_to_login(request.get_full_path())
+    # the charts are rendered by a background job, the page shows its last result
+    if lazy_charts():
+        _, refreshing = await sync_to_async(analysis_jobs.latest)(current_user.id, output='json')
+        return await sync_to_async(chart_shell)(request, 'blog/analysis.html', current_user, ANALYSIS_CHARTS,
+                                                refreshing=refreshing)
+    charts, refreshing = await sync_to_async(analysis_jobs.latest)(current_user.id)
+    context = dict(charts or {})
+    context.update({
+        'refreshing': refreshing,
         'user_db_id': current_user.id
-    }
-    return render(request, 'blog/analysis.html', context)
+    })
+    return await sync_to_async(render)(request, 'blog/analysis.html', context)
+
+def chart_etag(request, name):
+    if name not in CHARTS or name in ANALYSIS_CHARTS:
+        return None
+    return ChartCache(user=request.user.id, output='json').etag(name)
+
+
+@login_required
+@gzip_page
+@condition(etag_func=chart_etag)
+def chart_data(request, name):
+    if name not in CHARTS:
+        raise Http404('Unknown chart')
+    if name in ANALYSIS_CHARTS:
+        charts, refreshing = analysis_jobs.latest(request.user.id, output='json')
+        if charts is None:
+            # no completed analysis yet, the page polls again unless the job failed
+            return HttpResponse('null', content_type='application/json', status=202 if refreshing else 200)
+        data = charts[name]
+    else:
+        v = Visualizer(user=request.user.id, output='json')
+        data = ChartCache(user=request.user.id, output='json').get(name, getattr(v, CHARTS[name]))
+    return HttpResponse(data if data is not None else 'null', content_type='application/json')
+
+@login_required
+def live_stats(request):
+    # from the in-process sliding windows, no query once the user is warm
+    stats = live.ENGINE.current(request.user.id)
+    return JsonResponse({name: {'%dmin' % (window.total_seconds() // 60): summary._asdict()
+                                for window, summary in windows.items()}
+                         for name, windows in stats.items()})
+
+@staff_member_required
+def pool_stats(request):
+    # connection pools of this worker process only
+    return JsonResponse(pool.stats())
+
+def body_lines(request):
+    # iterating the request reads the body stream line by line instead of loading it
+    for line in request:
+        yield line.decode('utf-8', 'replace')
+
+
+def user_records(records, user):
+    for record in records:
+        if isinstance(record, dict):
+            record['user'] = user
+        yield record
+
+
+def basic_auth_user(request):
+    """The active user of the request's HTTP Basic credentials, None when they are wrong."""
+    scheme, _, credentials = request.META['HTTP_AUTHORIZATION'].partition(' ')
+    if scheme.lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials, validate=True).decode('utf-8').partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+@csrf_exempt
+@require_POST
+def upload(request):
+    """Readings of the authenticated user as ndjson or csv, see blog.ingest.
+
+    Devices send their credentials with HTTP Basic auth on every request, which
+    needs no CSRF token. A browser session instead passes the CSRF check, the
+    token in the X-CSRFToken header.
+    """
+    if 'HTTP_AUTHORIZATION' in request.META:
+        user = basic_auth_user(request)
+        if user is None:
+            response = JsonResponse({'error': 'invalid credentials'}, status=401)
+            response['WWW-Authenticate'] = 'Basic realm="upload"'
+            return response
+    elif request.user.is_authenticated:
+        # cookies are sent by the browser on their own, csrf_exempt only spares the devices
+        rejected = CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {})
+        if rejected is not None:
+            return rejected
+        user = request.user
+    else:
+        return redirect_to_login(request.get_full_path())
+    content_type = request.content_type
+    if content_type in ('text/csv', 'application/csv'):
+        records = ingest.iter_csv(body_lines(request))
+    elif content_type in ('application/x-ndjson', 'application/jsonlines', 'application/json', 'text/plain'):
+        records = ingest.iter_ndjson(body_lines(request))
+    else:
+        return JsonResponse({'error': 'unsupported content type %s' % content_type}, status=415)
+    result = ingest.ingest(user_records(records, user.id))
+    return JsonResponse({
+        'accepted': result.accepted,
+        'rejected': result.rejected,
+        'rows': result.activities + result.drinks,
+        'seconds': round(result.seconds, 3),
+        'errors': result.errors,
+    })
 
 def about(request):
     return render(request, 'blog/about.html', {'title': 'About'})
@@ -1,16 +1,54 @@
 import datetime
+import threading
 import numpy as np
 import plotly
 import plotly.graph_objs as go
 
 from .models import *
+from . import binning, downsample, materialized, rendering, rollups
+from .instrumentation import instrumented
+from .snapshot import DataSnapshot
+from .timeseries import to_epoch, to_microseconds, window_join
+from django.conf import settings
 from django.utils import timezone
 from django.db.models import Avg, Sum, F
 
+CHARTS = {
+    'last_alcohol': 'plot_last_alcohol',
+    'last_steps': 'plot_last_steps',
+    'last_pulse': 'plot_last_pulse',
+    'monthly_alcohol': 'plot_monthly_alcohol',
+    'monthly_steps': 'plot_monthly_steps',
+    'monthly_pulse': 'plot_monthly_pulse',
+    'alcohol': 'plot_alcohol',
+    'steps': 'plot_steps',
+    'pulse': 'plot_pulse',
+    'activity': 'plot_activity',
+    'analysis2d': 'plot_analysis',
+    'analysis3d': 'plot_analysis',
+}
+HOME_CHARTS = ['last_alcohol', 'last_steps', 'last_pulse', 'monthly_alcohol', 'monthly_steps', 'monthly_pulse']
+ANALYSIS_CHARTS = ['alcohol', 'steps', 'pulse', 'activity', 'analysis2d', 'analysis3d']
+
 
 class Visualizer:
-    def __init__(self, user, auto_open=False, minutes_delta=15, minutes_grid=60, grid_steps=10, grid_pulse=5.0, grid_alcohol=0.2, min_daily_values=10, min_monthly_values=100, min_2d_values=200, min_3d_values=500):
+    def __init__(self, user, auto_open=False, minutes_delta=15, minutes_grid=60, grid_steps=10, grid_pulse=5.0, grid_alcohol=0.2, min_daily_values=10, min_monthly_values=100, min_2d_values=200, min_3d_values=500, snapshot=None, include_plotlyjs=False, output='div', render_mode=None, max_points=None, downsampling=None, materialized=None):
         self.user = user
+        # 'div' renders html for the template, 'json' the figure for client-side rendering
+        self.output = output
+        # plotly.js is served once as a static file, see the write_plotlyjs command
+        self.include_plotlyjs = include_plotlyjs
+        self.snapshot = snapshot if snapshot is not None else DataSnapshot(user)
+        self._weekly_cells = None
+        self._lock = threading.Lock()
+        # see rendering.MODES, defaults to the BLOG_RENDER_MODE setting
+        self.render_mode = render_mode or rendering.render_mode()
+        # raw scatter traces are downsampled to about max_points points
+        self.max_points = max_points or getattr(settings, 'BLOG_SCATTER_POINTS', 2000)
+        self.downsampling = downsampling or getattr(settings, 'BLOG_DOWNSAMPLING', 'lttb')
+        # plot_analysis from the stored per-drink windows, see blog.materialized
+        self.materialized = materialized if materialized is not None else \
+            getattr(settings, 'BLOG_MATERIALIZED_ANALYSIS', False)
         self.auto_open = auto_open
         self.grid_steps = grid_steps
         self.grid_pulse = grid_pulse
@@ -23,87 +61,115 @@ class Visualizer:
         self.min_2d_values = min_2d_values
         self.min_3d_values = min_3d_values
 
+    @instrumented()
     def plot_all(self):
-        analysis = self.plot_analysis()
-        d = {'last_steps': self.plot_last_steps(),
-             'last_pulse': self.plot_last_pulse(),
-             'last_alcohol': self.plot_last_alcohol(),
-             'steps_in_time': self.plot_steps(),
-             'pulse_in_time': self.plot_pulse(),
-             'alcohol_in_time': self.plot_alcohol(),
-             'activity': self.plot_activity(),
-             'analysis2d': analysis[0],
-             'analysis3d': analysis[1]}
+        charts = self.render(['last_steps', 'last_pulse', 'last_alcohol', 'steps', 'pulse', 'alcohol',
+                              'activity', 'analysis2d', 'analysis3d'])
+        d = {'last_steps': charts['last_steps'],
+             'last_pulse': charts['last_pulse'],
+             'last_alcohol': charts['last_alcohol'],
+             'steps_in_time': charts['steps'],
+             'pulse_in_time': charts['pulse'],
+             'alcohol_in_time': charts['alcohol'],
+             'activity': charts['activity'],
+             'analysis2d': charts['analysis2d'],
+             'analysis3d': charts['analysis3d']}
         return d
 
+    def render(self, names):
+        """Charts of the CHARTS ``names``, the plot_* methods run concurrently unless render_mode is sequential."""
+        methods = {CHARTS[name] for name in names}
+        return self.pick(names, rendering.call_all({m: getattr(self, m) for m in methods}, self.render_mode))
+
+    async def arender(self, names):
+        """render for async views."""
+        methods = {CHARTS[name] for name in names}
+        return self.pick(names, await rendering.gather_all({m: getattr(self, m) for m in methods}, self.render_mode))
+
+    @staticmethod
+    def pick(names, results):
+        # results of plot_* method names -> charts of names
+        charts = {}
+        for name in names:
+            chart = results[CHARTS[name]]
+            if name in ('analysis2d', 'analysis3d'):
+                chart = chart[name == 'analysis3d']
+            charts[name] = chart
+        return charts
+
     def get_last_data(self, model, days_nr=1, now=None, prev=None):
         if now is None:
             now = timezone.now()
         if prev is None:
             prev = now - datetime.timedelta(days=days_nr)
-        return model.objects.using('new_smartband_db'). \
-            filter(user=self.user). \
-            filter(timestamp__range=(prev, now)).all()
+        return model.objects.filter(user=self.user).filter(timestamp__range=(prev, now)).all()
 
+    @instrumented('serialize')
     def plot(self, data, title, xaxis, yaxis, filename="temp.html", showlegend=False):
         layout = go.Layout(title=title, xaxis=xaxis, yaxis=yaxis, showlegend=showlegend)
-        figure = go.Figure(data=data, layout=layout)
         if self.auto_open:
-            plotly.offline.plot(figure, auto_open=True, filename=filename)
-        else:
-            div = plotly.offline.plot(figure, auto_open=False, output_type='div')
-            return div
-	
-    def daily_grid(self, model, name, func):    
+            plotly.offline.plot(go.Figure(data=data, layout=layout), auto_open=True, filename=filename)
+            return None
+        args = ([trace.to_plotly_json() for trace in data], layout.to_plotly_json(), self.output, self.include_plotlyjs)
+        if self.render_mode == 'processes':
+            return rendering.pool('processes').submit(rendering.serialize, *args).result()
+        return rendering.serialize(*args)
+
+    @staticmethod
+    def rollup_value(rollup, name, func):
+        if func is Sum:
+            return getattr(rollup, name + "_sum")
+        return rollup.mean(name)
+
+    def daily_grid(self, model, name, func):
         now = timezone.now()
         prev = now - datetime.timedelta(days=1)
-        data = self.get_last_data(model, now=now, prev=prev)
-        if len(data) < self.min_daily_values:
+        hours = list(HourlyRollup.objects.filter(user=self.user, timestamp__gt=prev, timestamp__lte=now))
+        if sum(h.count(name) for h in hours) < self.min_daily_values:
             return None, None, None
-        hist = data.values("timestamp__date", "timestamp__hour").annotate(data_agg=func(name))
         hist_x = [None for _ in range(24)]
         hist_y = [None for _ in range(24)]
-        for h in hist:
-            ind = (h["timestamp__hour"] - now.hour) % 24
-            y = h["data_agg"]
-            x = datetime.datetime(year=h["timestamp__date"].year, 
-                                  month=h["timestamp__date"].month,
-                                  day=h["timestamp__date"].day,
-                                  hour=h["timestamp__hour"],
-                                  minute=30,
-                                  tzinfo=now.tzinfo)
-            hist_x[ind] = x
-            hist_y[ind] = y
-        print("now", now.hour)
-        print("x", hist_x)
-        print("y", hist_y)
+        for h in hours:
+            if not h.count(name):
+                continue
+            ind = (h.timestamp.hour - now.hour) % 24
+            hist_x[ind] = h.timestamp + datetime.timedelta(minutes=30)
+            hist_y[ind] = self.rollup_value(h, name, func)
+        data = self.get_last_data(model, now=now, prev=prev)
         return data.order_by('timestamp'), hist_x, hist_y
-	
-    def monthly_grid(self, model, name, func):    
+
+    def monthly_grid(self, model, name, func):
         now = timezone.now()
         prev = now - datetime.timedelta(days=31)
-        data = self.get_last_data(model, now=now, prev=prev)
-        if len(data) < self.min_monthly_values:
+        days = list(DailyRollup.objects.filter(user=self.user, timestamp__gt=prev, timestamp__lte=now))
+        if sum(d.count(name) for d in days) < self.min_monthly_values:
             return None, None
-        hist = data.values("timestamp__date").annotate(data_agg=func(name))
         hist_x = [None for _ in range(31)]
         hist_y = [None for _ in range(31)]
-        for h in hist:
-            h_datetime = datetime.datetime.combine(h["timestamp__date"], datetime.datetime.min.time(), now.tzinfo)
-            ind = (h_datetime - now).days % 31
-            y = h["data_agg"]
-            x = h["timestamp__date"]
-            hist_x[ind] = x
-            hist_y[ind] = y
+        for d in days:
+            if not d.count(name):
+                continue
+            ind = (d.timestamp - now).days % 31
+            hist_x[ind] = d.timestamp.date()
+            hist_y[ind] = self.rollup_value(d, name, func)
         return hist_x, hist_y
 
+    def last_points(self, data, name):
+        """x and y of the raw last day scatter trace, downsampled to max_points."""
+        rows = list(data.values_list('timestamp', name))
+        timestamps = to_epoch([r[0] for r in rows])
+        keep = downsample.select(timestamps, [r[1] for r in rows], self.max_points, self.downsampling)
+        return [rows[i][0] for i in keep], [rows[i][1] for i in keep]
+
+    @instrumented()
     def plot_last_steps(self):
         #activities = self.get_last_data(Activity)
         activities, hist_x, hist_y = self.daily_grid(model=Activity, name="steps", func=Sum)
         if activities is None or hist_x is None or hist_y is None:
             return None
-        trace1 = go.Scatter(x=[a.timestamp for a in activities],
-                            y=[a.steps for a in activities],
+        x, y = self.last_points(activities, 'steps')
+        trace1 = go.Scatter(x=x,
+                            y=y,
                             mode="markers",
                             marker={"color": "red"})
         trace2 = go.Bar(x=hist_x,
@@ -115,13 +181,15 @@ class Visualizer:
                          yaxis={'title': 'steps'},
                          filename="last_steps.html")
 
+    @instrumented()
     def plot_last_pulse(self):
         #activities = self.get_last_data(Activity)
         activities, hist_x, hist_y = self.daily_grid(model=Activity, name="pulse", func=Avg)
         if activities is None or hist_x is None or hist_y is None:
             return None
-        trace1 = go.Scatter(x=[a.timestamp for a in activities],
-                           y=[a.pulse for a in activities],
+        x, y = self.last_points(activities, 'pulse')
+        trace1 = go.Scatter(x=x,
+                            y=y,
                            mode="markers",
                             marker={"color": "red"})
         trace2 = go.Scatter(x=hist_x,
@@ -134,13 +202,15 @@ class Visualizer:
                          yaxis={'title': 'pulse'},
                          filename="last_pulse.html")
 
+    @instrumented()
     def plot_last_alcohol(self):
         #drinking = self.get_last_data(Drinking)
         drinking, hist_x, hist_y = self.daily_grid(model=Drinking, name="alcohol", func=Avg)
         if drinking is None or hist_x is None or hist_y is None:
             return None
-        trace1 = go.Scatter(x=[a.timestamp for a in drinking],
-                            y=[a.alcohol for a in drinking],
+        x, y = self.last_points(drinking, 'alcohol')
+        trace1 = go.Scatter(x=x,
+                            y=y,
                             mode="markers",
                             marker={"color": "red"})
         trace2 = go.Scatter(x=hist_x,
@@ -153,6 +223,7 @@ class Visualizer:
                          yaxis={'title': 'alcohol'},
                          filename="last_alcohol.html")
 
+    @instrumented()
     def plot_monthly_steps(self):
         #activities = self.get_last_data(Activity)
         hist_x, hist_y = self.monthly_grid(model=Activity, name="steps", func=Sum)
@@ -166,6 +237,7 @@ class Visualizer:
                          yaxis={'title': 'steps'},
                          filename="monthly_steps.html")
 
+    @instrumented()
     def plot_monthly_pulse(self):
         #activities = self.get_last_data(Activity)
         hist_x, hist_y = self.monthly_grid(model=Activity, name="pulse", func=Avg)
@@ -179,6 +251,7 @@ class Visualizer:
                          yaxis={'title': 'pulse'},
                          filename="monthly_pulse.html")
 
+    @instrumented()
     def plot_monthly_alcohol(self):
         #drinking = self.get_last_data(Drinking)
         hist_x, hist_y = self.monthly_grid(model=Drinking, name="alcohol", func=Avg)
@@ -194,77 +267,43 @@ class Visualizer:
 
     @staticmethod
     def grid2d(x, y, grid_x):
-        d_lists = {}
-        for xx, yy in zip(x, y):
-            x_int = round(xx/grid_x)
-            if x_int in d_lists.keys():
-                d_lists[x_int].append(yy)
-            else:
-                d_lists[x_int] = [yy]
-        new_x = []
-        new_y = []
-        for k in d_lists.keys():
-            k_list = d_lists[k]
-            new_x.append(k*grid_x)
-            new_y.append(float(sum(k_list))/len(k_list))
-        return new_x, new_y
+        return binning.grid2d(x, y, grid_x)
 
     @staticmethod
     def grid3d(x, y, z, grid_x, grid_y):
-        d_lists = {}
-        x_int_min = 0
-        x_int_max = 0
-        y_int_min = 0
-        y_int_max = 0
-        for xx, yy, zz in zip(x, y, z):
-            x_int = round(xx / grid_x)
-            y_int = round(yy / grid_y)
-            x_int_min = min(x_int_min, x_int)
-            x_int_max = max(x_int_max, x_int)
-            y_int_min = min(y_int_min, y_int)
-            y_int_max = max(y_int_max, y_int)
-            if (x_int, y_int) in d_lists.keys():
-                d_lists[(x_int, y_int)].append(zz)
-            else:
-                d_lists[(x_int, y_int)] = [zz]
-        new_x = np.array(list(range(x_int_min, x_int_max + 1))) * grid_x
-        new_y = np.array(list(range(y_int_min, y_int_max + 1))) * grid_y
-        new_z = np.zeros(shape=(len(new_y), len(new_x)))
-        new_z[:] = np.NaN
-        for k in d_lists.keys():
-            k_list = d_lists[k]
-            ind_x = k[0] - x_int_min
-            ind_y = k[1] - y_int_max
-            new_z[ind_y, ind_x] = float(sum(k_list)) / len(k_list)
-        return new_x, new_y, new_z
+        return binning.grid3d(x, y, z, grid_x, grid_y)
 
+    @instrumented()
     def plot_analysis(self):
-        drink_query = Drinking.objects.using('new_smartband_db').filter(user=self.user).order_by('alcohol').all()
-        act_query = Activity.objects.using('new_smartband_db').filter(user=self.user).order_by('steps').all()
-        x = []
-        y = []
-        z = []
-        for drink in drink_query:
-            alco = drink.alcohol
-            alco_time = drink.timestamp
-            act_filtered = act_query.filter(timestamp__range=(alco_time - self.time_delta/2, alco_time + self.time_delta/2))
-            '''print(drink)
-            for a in act_filtered:
-                print("\t", a)'''
-            if len(act_filtered) > 0:
-                mean_steps = act_filtered.aggregate(Avg('steps'))['steps__avg']
-                mean_pulse = act_filtered.aggregate(Avg('pulse'))['pulse__avg']
-                x.append(alco)
-                y.append(mean_steps)
-                z.append(mean_pulse)
-        if len(drink_query) < self.min_3d_values or len(act_query) < self.min_3d_values:
+        if self.materialized and self.snapshot.in_database:
+            return self.plot_materialized_analysis()
+        drinking = self.snapshot.drinking
+        activity = self.snapshot.activity
+        if len(drinking.timestamp) < self.min_3d_values or len(activity.timestamp) < self.min_3d_values:
             return None, None
+        order = np.argsort(drinking.alcohol, kind='stable')
+        x, y, z = window_join(drink_timestamps=drinking.timestamp[order],
+                              alcohol=drinking.alcohol[order],
+                              act_timestamps=activity.timestamp,
+                              steps=activity.steps,
+                              pulse=activity.pulse,
+                              half_width=to_microseconds(self.time_delta / 2))
         analysis2d = self.plot_analysis2d(x, y)
         analysis3d = self.plot_analysis3d(x, y, z)
         return analysis2d, analysis3d
 
+    def plot_materialized_analysis(self):
+        analysis = materialized.update(self.user, to_microseconds(self.time_delta / 2), self.grid_alcohol,
+                                       self.grid_steps, using=self.snapshot.using)
+        if analysis.drinking_count < self.min_3d_values or analysis.activity_count < self.min_3d_values:
+            return None, None
+        return self.plot_grid2d(*analysis.grid2d), self.plot_grid3d(*analysis.grid3d)
+
+    @instrumented()
     def plot_analysis2d(self, x, y):
-        new_x, new_y = self.grid2d(x, y, self.grid_alcohol)
+        return self.plot_grid2d(*self.grid2d(x, y, self.grid_alcohol))
+
+    def plot_grid2d(self, new_x, new_y):
         trace = go.Scatter(x=new_x,
                            y=new_y,
                            mode="lines+markers")
@@ -274,8 +313,11 @@ class Visualizer:
                          yaxis={'title': 'steps'},
                          filename='analysis2d.html')
 
+    @instrumented()
     def plot_analysis3d(self, x, y, z):
-        new_x, new_y, new_z = self.grid3d(x, y, z, self.grid_alcohol, self.grid_steps)
+        return self.plot_grid3d(*self.grid3d(x, y, z, self.grid_alcohol, self.grid_steps))
+
+    def plot_grid3d(self, new_x, new_y, new_z):
         trace = go.Heatmap(
             x=new_x,
             y=new_y,
@@ -289,12 +331,14 @@ class Visualizer:
                          filename='analysis3d.html',
                          showlegend=True)
 
+    @instrumented()
     def plot_activity(self):
-        act_query = Activity.objects.using('new_smartband_db').filter(user=self.user).order_by('steps').all()
-        if len(act_query) < self.min_2d_values:
+        activity = self.snapshot.activity
+        if len(activity.steps) < self.min_2d_values:
             return None
-        x = [a.steps for a in act_query]
-        y = [a.pulse for a in act_query]
+        order = np.argsort(activity.steps, kind='stable')
+        x = activity.steps[order]
+        y = activity.pulse[order]
         new_x, new_y = self.grid2d(x, y, self.grid_steps)
         trace = go.Scatter(x=new_x,
                            y=new_y,
@@ -314,31 +358,43 @@ class Visualizer:
             gtime += self.grid_time
         return np.array(times)
 
-    def plot_week(self, timestamps, values, colorbar, title, xaxis, yaxis, filename="temp.html"):
-        if len(values) < self.min_3d_values:
+    def weekly_cells(self):
+        """Maintained WeeklyCell rows of grid_time, an empty list if grid_time has none."""
+        minutes = self.grid_time.total_seconds() / 60
+        if minutes not in rollups.weekly_grids() or not self.snapshot.in_database:
+            return []
+        with self._lock:
+            if self._weekly_cells is None:
+                self._weekly_cells = list(WeeklyCell.objects.using(self.snapshot.using).
+                                          filter(user=self.user, grid_minutes=int(minutes)))
+        return self._weekly_cells
+
+    def week_means(self, name):
+        """(number of readings, mean per time slot and weekday) of ``name``.
+
+        Read from the weekly cells when they are maintained for grid_time, computed
+        from the snapshot otherwise (e.g. before rebuild_rollups backfilled them).
+        """
+        grid_us = to_microseconds(self.grid_time)
+        cells = self.weekly_cells()
+        if not cells:
+            columns = self.snapshot.drinking if name == 'alcohol' else self.snapshot.activity
+            return len(columns.timestamp), binning.week_grid(columns.timestamp, getattr(columns, name), grid_us)
+        z = np.full((-(-binning.DAY_US // grid_us), 7), np.nan)
+        count = 0
+        for cell in cells:
+            if cell.count(name):
+                z[cell.slot, cell.weekday] = cell.mean(name)
+                count += cell.count(name)
+        return count, z
+
+    @instrumented()
+    def plot_week(self, name, colorbar, title, xaxis, yaxis, filename="temp.html"):
+        count, z = self.week_means(name)
+        if count < self.min_3d_values:
             return None
-        x = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+        x = binning.WEEKDAYS
         y = self.get_grid_time_list()
-        d_lists = {}
-        for t, v in zip(timestamps, values):
-            t_weekday_ind = t.weekday()
-            t_time = t.time()
-            if t_time == datetime.time(hour=0, minute=0):
-                t_time_ind = 0
-            else:
-                t_time_ind = np.searchsorted(y, t_time) - 1
-            ind = (t_weekday_ind, t_time_ind)
-            if ind not in d_lists.keys():
-                d_lists[ind] = [v]
-            else:
-                d_lists[ind].append(v)
-        z = np.zeros(shape=(len(y), len(x)))
-        z[:] = np.NaN
-        for k in d_lists.keys():
-            k_list = d_lists[k]
-            ind_x = k[0]
-            ind_y = k[1]
-            z[ind_y, ind_x] = float(sum(k_list)) / len(k_list)
 
         trace = go.Heatmap(
             x=x,
@@ -353,33 +409,27 @@ class Visualizer:
                          filename=filename,
                          showlegend=True)
 
+    @instrumented()
     def plot_steps(self):
-        act_query = Activity.objects.using('new_smartband_db').filter(user=self.user).all()
-        timestamps = [a.timestamp for a in act_query]
-        values = [a.steps for a in act_query]
-        return self.plot_week(timestamps, values,
+        return self.plot_week('steps',
                               colorbar='steps',
                               title='steps in time',
                               xaxis={'title': 'weekday'},
                               yaxis={'title': 'hour'},
                               filename='steps_in_time.html')
 
+    @instrumented()
     def plot_pulse(self):
-        act_query = Activity.objects.using('new_smartband_db').filter(user=self.user).all()
-        timestamps = [a.timestamp for a in act_query]
-        values = [a.pulse for a in act_query]
-        return self.plot_week(timestamps, values,
+        return self.plot_week('pulse',
                               colorbar='pulse',
                               title='pulse in time',
                               xaxis={'title': 'weekday'},
                               yaxis={'title': 'hour'},
                               filename='pulse_in_time.html')
 
+    @instrumented()
     def plot_alcohol(self):
-        drink_query = Drinking.objects.using('new_smartband_db').filter(user=self.user).all()
-        timestamps = [d.timestamp for d in drink_query]
-        values = [d.alcohol for d in drink_query]
-        return self.plot_week(timestamps, values,
+        return self.plot_week('alcohol',
                               colorbar='alcohol',
                               title='alcohol in time',
                               xaxis={'title': 'weekday'},
@@ -1,11 +1,23 @@
 #!/usr/bin/env python
 from blog.models import *
+from blog.ingest import save_readings
+from blog.purge import purge
+from blog.timeseries import EPOCH_UTC, to_epoch
 from django.utils import timezone
 
+from collections import namedtuple
 from datetime import datetime
 from datetime import timedelta
+import csv
 import random
 
+import numpy as np
+
+DAY_SECONDS = 24 * 60 * 60
+
+# one chunk of generated readings, timestamps in epoch microseconds, alcohol NaN where rand_alco gives None
+Readings = namedtuple('Readings', ['user', 'timestamp', 'steps', 'pulse', 'alcohol'])
+
 
 class DataGenerator:
     def __init__(self, user, start_datetime=None, stop_datetime=None, steps_factor=25, pulse_factor=0.5, alco_factor=2.0, time_shift=timedelta(hours=0)):
@@ -81,6 +93,43 @@ class DataGenerator:
                 drink_list.append(drink)
         return act_list, drink_list
 
+    def rand_arrays(self, length, rng):
+        # same rules as rand_alco, rand_steps and rand_pulse over whole arrays
+        delta_seconds = int((self.stop_datetime - self.start_datetime).total_seconds())
+        seconds = rng.randint(0, delta_seconds, length).astype(np.int64)
+        timestamp = to_epoch([self.start_datetime])[0] + seconds * 1000000
+        day_seconds = timestamp // 1000000 % DAY_SECONDS
+        weekday = (timestamp // 1000000 // DAY_SECONDS + 3) % 7
+        hour = day_seconds // 3600
+        night = (1 <= hour) & (hour <= 6)
+        no_alco = (weekday <= 4) & night
+
+        alco = np.full(length, self.alco_factor)
+        alco[(6 <= hour) & (hour <= 16)] /= 4
+        alco[weekday >= 5] *= 2
+        alco *= rng.random_sample(length)
+        alco[no_alco] = np.nan
+        alco_ratio = np.where(no_alco, 0.0, alco / self.alco_factor)
+
+        steps = np.full(length, float(self.steps_factor))
+        steps[(10 <= hour) & (hour <= 17)] /= 2
+        steps[weekday == 6] *= 2
+        steps *= 1 + alco_ratio
+        steps = (rng.random_sample(length) * steps).astype(np.int64)
+        steps[no_alco] = 0
+
+        pulse = np.full(length, 85.0)
+        pulse[night] *= 0.8
+        pulse[~no_alco] += 1 + alco_ratio[~no_alco]
+        pulse += steps * self.pulse_factor
+        pulse += rng.random_sample(length)
+        return Readings(self.user, timestamp, steps, pulse, alco)
+
+    def iter_chunks(self, length, chunk_size=1000000, seed=None):
+        rng = np.random.RandomState(seed)
+        for offset in range(0, length, chunk_size):
+            yield self.rand_arrays(min(chunk_size, length - offset), rng)
+
 
 class DataContainer:
     def __init__(self, user, days):
@@ -108,23 +157,72 @@ class DataContainer:
         self.max_alco = max([x.alcohol for x in self.drink_list])
 
     def save(self):
-        for a in self.act_list:
-            print(a)
-            a.save(using='new_smartband_db')
-        for d in self.drink_list:
-            print(d)
-            d.save(using='new_smartband_db')
+        return save_readings(self.act_list, self.drink_list)
 
     @staticmethod
     def clear_database():
-        for a in Activity.objects.using('new_smartband_db').all():
-            print(a)
-            a.delete()
-        for d in Drinking.objects.using('new_smartband_db').all():
-            print(d)
-            d.delete()
+        for model in (Activity, Drinking):
+            print(purge(model))
             
 
+def readings_models(readings):
+    act_list = []
+    drink_list = []
+    for t, steps, pulse, alco in zip(readings.timestamp.tolist(), readings.steps.tolist(),
+                                     readings.pulse.tolist(), readings.alcohol.tolist()):
+        measure_time = EPOCH_UTC + timedelta(microseconds=t)
+        act_list.append(Activity(user=readings.user, timestamp=measure_time, steps=steps, pulse=pulse))
+        if alco == alco:
+            drink_list.append(Drinking(user=readings.user, timestamp=measure_time, alcohol=alco))
+    return act_list, drink_list
+
+
+def save_chunks(chunks, using=None):
+    rows = 0
+    for readings in chunks:
+        act_list, drink_list = readings_models(readings)
+        rows += sum(save_readings(act_list, drink_list, using=using))
+    return rows
+
+
+def write_csv(chunks, f):
+    writer = csv.writer(f)
+    writer.writerow(['user', 'timestamp', 'steps', 'pulse', 'alcohol'])
+    rows = 0
+    for readings in chunks:
+        alcohol = np.char.mod('%.6f', readings.alcohol).astype(object)
+        alcohol[np.isnan(readings.alcohol)] = ''
+        writer.writerows(zip([readings.user] * len(readings.timestamp),
+                             (readings.timestamp // 1000000).tolist(),
+                             readings.steps.tolist(),
+                             np.char.mod('%.6f', readings.pulse).tolist(),
+                             alcohol.tolist()))
+        rows += len(readings.timestamp)
+    return rows
+
+
+def write_parquet(chunks, path):
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([('user', pyarrow.int64()), ('timestamp', pyarrow.timestamp('us', tz='UTC')),
+                             ('steps', pyarrow.int64()), ('pulse', pyarrow.float64()),
+                             ('alcohol', pyarrow.float64())])
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for readings in chunks:
+            length = len(readings.timestamp)
+            writer.write_table(pyarrow.table({
+                'user': np.full(length, readings.user, dtype=np.int64),
+                'timestamp': pyarrow.array(readings.timestamp, type=pyarrow.timestamp('us', tz='UTC')),
+                'steps': readings.steps,
+                'pulse': readings.pulse,
+                'alcohol': pyarrow.array(readings.alcohol, from_pandas=True),
+            }, schema=schema))
+            rows += length
+    return rows
+
+
 def generate(user, days, numbers=1000):
     cont = DataContainer(user, days)
     cont.rand(numbers)
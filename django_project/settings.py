@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.instrumentation.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -98,11 +99,48 @@ DATABASES = {
         'TEST': {
             'CHARSET': 'utf8mb4',
             'COLLATION': 'utf8mb4_unicode_ci'
-        }
-
+        },
+        # keep connections open across requests, pinged at the start of every request
+        # (blog.backends.health before Django 4.1)
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        # or share at most SIZE connections per process, waiting up to TIMEOUT seconds
+        # for a free one, with pool metrics at blog-pools:
+        # 'ENGINE': 'blog.backends.mysql',
+        # 'CONN_MAX_AGE': 0,
+        # 'POOL': {'SIZE': 10, 'TIMEOUT': 10, 'MAX_AGE': 3600},
     }
 }
 
+# Readings go to new_smartband_db, their reads to one of BLOG_READ_REPLICAS that is at
+# most BLOG_REPLICA_MAX_LAG seconds behind (checked every BLOG_REPLICA_CHECK_INTERVAL
+# seconds). A replica is another alias like new_smartband_db on the replica host with
+# 'TEST': {'MIRROR': 'new_smartband_db'}.
+DATABASE_ROUTERS = ['blog.routers.SmartbandRouter']
+BLOG_READ_REPLICAS = []
+BLOG_REPLICA_MAX_LAG = 5
+BLOG_REPLICA_CHECK_INTERVAL = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# Rendered charts go to their own LRU cache, use a shared backend (memcached, file)
+# when running several worker processes so invalidation reaches all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'charts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'charts',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -148,4 +186,43 @@ MEDIA_URL = '/media/'
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 LOGIN_REDIRECT_URL = 'blog-home'
-LOGIN_URL = 'login'
\ No newline at end of file
+LOGIN_URL = 'login'
+
+# Dashboard pages return an empty shell and fetch every chart from blog-chart
+BLOG_LAZY_CHARTS = True
+
+# Visualizer grid_time values (minutes) whose weekday x slot heatmap cells are kept up to date
+BLOG_WEEKLY_GRIDS = [60]
+
+# The analysis page charts are rendered by background jobs in a thread pool of this size,
+# BLOG_ANALYSIS_BACKGROUND = False renders them in the request instead
+BLOG_ANALYSIS_WORKERS = 2
+
+# How Visualizer.render runs the plot_* methods, one of blog.rendering.MODES
+BLOG_RENDER_MODE = 'threads'
+
+# Raw last day scatter traces are downsampled to about this many points, with 'lttb' or 'minmax'
+BLOG_SCATTER_POINTS = 2000
+BLOG_DOWNSAMPLING = 'lttb'
+
+# plot_analysis from per-drink windows stored in the database, only new readings are joined
+BLOG_MATERIALIZED_ANALYSIS = True
+
+# Sliding windows (minutes) of the live statistics served by blog-live
+BLOG_LIVE_WINDOWS = [15, 60, 1440]
+
+# Run every request under cProfile and dump the stats to BLOG_PROFILE_DIR (default: the temp dir)
+BLOG_PROFILE_REQUESTS = False
+BLOG_PROFILE_DIR = None
+
+# Timings of the Visualizer plots and dashboard views are json log lines at INFO level
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'blog.instrumentation': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
\ No newline at end of file